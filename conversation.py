@@ -61,207 +61,7 @@ class Conversation:
 
     def get_prompt(self) -> str:
         """Get the prompt for generation."""
-        system_prompt = self.system_template.format(system_message=self.system_message)
-        if self.sep_style == SeparatorStyle.ADD_COLON_SINGLE:
-            ret = system_prompt + self.sep
-            for role, message in self.messages:
-                if message:
-                    ret += role + ": " + message + self.sep
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.sep_style == SeparatorStyle.ADD_COLON_TWO:
-            seps = [self.sep, self.sep2]
-            ret = system_prompt + seps[0]
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    if type(message) is tuple:
-                        message, images = message
-                    ret += role + ": " + message + seps[i % 2]
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.sep_style == SeparatorStyle.ADD_COLON_SPACE_SINGLE:
-            ret = system_prompt + self.sep
-            for role, message in self.messages:
-                if message:
-                    ret += role + ": " + message + self.sep
-                else:
-                    ret += role + ": "  # must be end with a space
-            return ret
-        elif self.sep_style == SeparatorStyle.ADD_NEW_LINE_SINGLE:
-            ret = "" if system_prompt == "" else system_prompt + self.sep
-            for role, message in self.messages:
-                if message:
-                    ret += role + "\n" + message + self.sep
-                else:
-                    ret += role + "\n"
-            return ret
-        elif self.sep_style == SeparatorStyle.NO_COLON_SINGLE:
-            ret = system_prompt
-            for role, message in self.messages:
-                if message:
-                    ret += role + message + self.sep
-                else:
-                    ret += role
-            return ret
-        elif self.sep_style == SeparatorStyle.NO_COLON_TWO:
-            seps = [self.sep, self.sep2]
-            ret = system_prompt
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += role + message + seps[i % 2]
-                else:
-                    ret += role
-            return ret
-        elif self.sep_style == SeparatorStyle.RWKV:
-            ret = system_prompt
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += (
-                        role
-                        + ": "
-                        + message.replace("\r\n", "\n").replace("\n\n", "\n")
-                    )
-                    ret += "\n\n"
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.sep_style == SeparatorStyle.LLAMA2:
-            seps = [self.sep, self.sep2]
-            if self.system_message:
-                ret = system_prompt
-            else:
-                ret = "[INST] "
-            for i, (role, message) in enumerate(self.messages):
-                tag = self.roles[i % 2]
-                if message:
-                    if i == 0:
-                        ret += message + " "
-                    else:
-                        ret += tag + " " + message + seps[i % 2]
-                else:
-                    ret += tag
-            return ret
-        elif self.sep_style == SeparatorStyle.CHATGLM:
-            # source: https://huggingface.co/THUDM/chatglm-6b/blob/1d240ba371910e9282298d4592532d7f0f3e9f3e/modeling_chatglm.py#L1302-L1308
-            # source2: https://huggingface.co/THUDM/chatglm2-6b/blob/e186c891cf64310ac66ef10a87e6635fa6c2a579/modeling_chatglm.py#L926
-            round_add_n = 1 if self.name == "chatglm2" else 0
-            if system_prompt:
-                ret = system_prompt + self.sep
-            else:
-                ret = ""
-
-            for i, (role, message) in enumerate(self.messages):
-                if i % 2 == 0:
-                    ret += f"[Round {i//2 + round_add_n}]{self.sep}"
-
-                if message:
-                    ret += f"{role}：{message}{self.sep}"
-                else:
-                    ret += f"{role}："
-            return ret
-        elif self.sep_style == SeparatorStyle.CHATML:
-            ret = "" if system_prompt == "" else system_prompt + self.sep + "\n"
-            for role, message in self.messages:
-                if message:
-                    ret += role + "\n" + message + self.sep + "\n"
-                else:
-                    ret += role + "\n"
-            return ret
-        elif self.sep_style == SeparatorStyle.CHATGLM3:
-            ret = ""
-            if self.system_message:
-                ret += system_prompt
-            for role, message in self.messages:
-                if message:
-                    ret += role + "\n" + message
-                else:
-                    ret += role
-            return ret
-        elif self.sep_style == SeparatorStyle.CHATINTERN:
-            # source: https://huggingface.co/internlm/internlm-chat-7b-8k/blob/bd546fa984b4b0b86958f56bf37f94aa75ab8831/modeling_internlm.py#L771
-            seps = [self.sep, self.sep2]
-            ret = system_prompt
-            for i, (role, message) in enumerate(self.messages):
-                if i % 2 == 0:
-                    ret += "<s>"
-                if message:
-                    ret += role + ":" + message + seps[i % 2] + "\n"
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.sep_style == SeparatorStyle.DOLLY:
-            seps = [self.sep, self.sep2]
-            ret = system_prompt
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += role + ":\n" + message + seps[i % 2]
-                    if i % 2 == 1:
-                        ret += "\n\n"
-                else:
-                    ret += role + ":\n"
-            return ret
-        elif self.sep_style == SeparatorStyle.PHOENIX:
-            ret = system_prompt
-            for role, message in self.messages:
-                if message:
-                    ret += role + ": " + "<s>" + message + "</s>"
-                else:
-                    ret += role + ": " + "<s>"
-            return ret
-        elif self.sep_style == SeparatorStyle.ROBIN:
-            ret = system_prompt + self.sep
-            for role, message in self.messages:
-                if message:
-                    ret += role + ":\n" + message + self.sep
-                else:
-                    ret += role + ":\n"
-            return ret
-        elif self.sep_style == SeparatorStyle.FALCON_CHAT:
-            ret = ""
-            if self.system_message:
-                ret += system_prompt + self.sep
-            for role, message in self.messages:
-                if message:
-                    ret += role + ": " + message + self.sep
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.sep_style == SeparatorStyle.METAMATH:
-            ret = "" if system_prompt == "" else system_prompt + self.sep
-            for i, (role, message) in enumerate(self.messages):
-                # For MetaMath, sep2 is used to prefix the message.
-                starting_sep = ":\n" if i % 2 == 0 else ": " + self.sep2
-                ending_sep = self.sep if i % 2 == 0 else ""
-                if message:
-                    ret += role + starting_sep + message + ending_sep
-                else:
-                    ret += role + starting_sep
-            return ret
-        elif self.sep_style == SeparatorStyle.DEEPSEEK_CHAT:
-            seps = [self.sep, self.sep2]
-            ret = system_prompt
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += role + ": " + message + seps[i % 2]
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.sep_style == SeparatorStyle.YUAN2:
-            seps = [self.sep, self.sep2]
-            ret = ""
-            if self.system_message:
-                ret += system_prompt + seps[1]
-            for _, message in self.messages:
-                if message:
-                    ret += message + "<n>"
-                else:
-                    ret += ""
-            ret = ret.rstrip("<n>") + seps[0]
-            return ret
-        else:
-            raise ValueError(f"Invalid style: {self.sep_style}")
+        return get_render_plan(self).render(self.system_message, self.messages)
 
     def get_images(self):
         images = []
@@ -339,6 +139,193 @@ class Conversation:
         }
 
 
+class RenderPlan:
+    """The prompt format of a template, compiled once: `header` renders the system
+    prompt, `piece` renders the i-th message, and `finish` post-processes the whole
+    prompt. Prompts are assembled with a single join, and the rendered system and
+    few-shot prefix of the last prompt is memoized, so consecutive prompts sharing
+    their few-shot examples (e.g. `fixed` prompts) only render their final turn.
+    """
+
+    def __init__(self, name, system_template, roles, sep_style, sep, sep2):
+        self.system_template = system_template
+        seps = [sep, sep2]
+
+        def header(system_prompt, system_message):
+            return system_prompt
+
+        def finish(ret):
+            return ret
+
+        if sep_style == SeparatorStyle.ADD_COLON_SINGLE:
+            def header(system_prompt, system_message):
+                return system_prompt + sep
+
+            def piece(i, role, message):
+                return role + ": " + message + sep if message else role + ":"
+        elif sep_style == SeparatorStyle.ADD_COLON_TWO:
+            def header(system_prompt, system_message):
+                return system_prompt + seps[0]
+
+            def piece(i, role, message):
+                if message:
+                    if type(message) is tuple:
+                        message, images = message
+                    return role + ": " + message + seps[i % 2]
+                return role + ":"
+        elif sep_style == SeparatorStyle.ADD_COLON_SPACE_SINGLE:
+            def header(system_prompt, system_message):
+                return system_prompt + sep
+
+            def piece(i, role, message):
+                # must be end with a space
+                return role + ": " + message + sep if message else role + ": "
+        elif sep_style == SeparatorStyle.ADD_NEW_LINE_SINGLE:
+            def header(system_prompt, system_message):
+                return "" if system_prompt == "" else system_prompt + sep
+
+            def piece(i, role, message):
+                return role + "\n" + message + sep if message else role + "\n"
+        elif sep_style == SeparatorStyle.NO_COLON_SINGLE:
+            def piece(i, role, message):
+                return role + message + sep if message else role
+        elif sep_style == SeparatorStyle.NO_COLON_TWO:
+            def piece(i, role, message):
+                return role + message + seps[i % 2] if message else role
+        elif sep_style == SeparatorStyle.RWKV:
+            def piece(i, role, message):
+                if message:
+                    return role + ": " + message.replace("\r\n", "\n").replace("\n\n", "\n") + "\n\n"
+                return role + ":"
+        elif sep_style == SeparatorStyle.LLAMA2:
+            def header(system_prompt, system_message):
+                return system_prompt if system_message else "[INST] "
+
+            def piece(i, role, message):
+                tag = roles[i % 2]
+                if message:
+                    if i == 0:
+                        return message + " "
+                    return tag + " " + message + seps[i % 2]
+                return tag
+        elif sep_style == SeparatorStyle.CHATGLM:
+            # source: https://huggingface.co/THUDM/chatglm-6b/blob/1d240ba371910e9282298d4592532d7f0f3e9f3e/modeling_chatglm.py#L1302-L1308
+            # source2: https://huggingface.co/THUDM/chatglm2-6b/blob/e186c891cf64310ac66ef10a87e6635fa6c2a579/modeling_chatglm.py#L926
+            round_add_n = 1 if name == "chatglm2" else 0
+
+            def header(system_prompt, system_message):
+                return system_prompt + sep if system_prompt else ""
+
+            def piece(i, role, message):
+                ret = f"[Round {i//2 + round_add_n}]{sep}" if i % 2 == 0 else ""
+                return ret + (f"{role}：{message}{sep}" if message else f"{role}：")
+        elif sep_style == SeparatorStyle.CHATML:
+            def header(system_prompt, system_message):
+                return "" if system_prompt == "" else system_prompt + sep + "\n"
+
+            def piece(i, role, message):
+                return role + "\n" + message + sep + "\n" if message else role + "\n"
+        elif sep_style == SeparatorStyle.CHATGLM3:
+            def header(system_prompt, system_message):
+                return system_prompt if system_message else ""
+
+            def piece(i, role, message):
+                return role + "\n" + message if message else role
+        elif sep_style == SeparatorStyle.CHATINTERN:
+            # source: https://huggingface.co/internlm/internlm-chat-7b-8k/blob/bd546fa984b4b0b86958f56bf37f94aa75ab8831/modeling_internlm.py#L771
+            def piece(i, role, message):
+                ret = "<s>" if i % 2 == 0 else ""
+                return ret + (role + ":" + message + seps[i % 2] + "\n" if message else role + ":")
+        elif sep_style == SeparatorStyle.DOLLY:
+            def piece(i, role, message):
+                if message:
+                    return role + ":\n" + message + seps[i % 2] + ("\n\n" if i % 2 == 1 else "")
+                return role + ":\n"
+        elif sep_style == SeparatorStyle.PHOENIX:
+            def piece(i, role, message):
+                return role + ": " + "<s>" + message + "</s>" if message else role + ": " + "<s>"
+        elif sep_style == SeparatorStyle.ROBIN:
+            def header(system_prompt, system_message):
+                return system_prompt + sep
+
+            def piece(i, role, message):
+                return role + ":\n" + message + sep if message else role + ":\n"
+        elif sep_style == SeparatorStyle.FALCON_CHAT:
+            def header(system_prompt, system_message):
+                return system_prompt + sep if system_message else ""
+
+            def piece(i, role, message):
+                return role + ": " + message + sep if message else role + ":"
+        elif sep_style == SeparatorStyle.METAMATH:
+            def header(system_prompt, system_message):
+                return "" if system_prompt == "" else system_prompt + sep
+
+            def piece(i, role, message):
+                # For MetaMath, sep2 is used to prefix the message.
+                starting_sep = ":\n" if i % 2 == 0 else ": " + sep2
+                ending_sep = sep if i % 2 == 0 else ""
+                return role + starting_sep + message + ending_sep if message else role + starting_sep
+        elif sep_style == SeparatorStyle.DEEPSEEK_CHAT:
+            def piece(i, role, message):
+                return role + ": " + message + seps[i % 2] if message else role + ":"
+        elif sep_style == SeparatorStyle.YUAN2:
+            def header(system_prompt, system_message):
+                return system_prompt + seps[1] if system_message else ""
+
+            def piece(i, role, message):
+                return message + "<n>" if message else ""
+
+            def finish(ret):
+                return ret.rstrip("<n>") + seps[0]
+        else:
+            raise ValueError(f"Invalid style: {sep_style}")
+
+        self.header = header
+        self.piece = piece
+        self.finish = finish
+        # (system_message, prefix messages, rendered prefix) of the last prompt
+        self._last_prefix = None
+
+    def render_prefix(self, system_message, messages):
+        """Renders the system prompt and `messages`, the first messages of a conversation."""
+        last_prefix = self._last_prefix
+        # compared by value, which is fast for the same strings and for different
+        # few-shot examples
+        if last_prefix is not None and last_prefix[0] == system_message and last_prefix[1] == messages:
+            return last_prefix[2]
+        system_prompt = self.system_template.format(system_message=system_message)
+        prefix = "".join(
+            [self.header(system_prompt, system_message)]
+            + [self.piece(i, role, message) for i, (role, message) in enumerate(messages)]
+        )
+        self._last_prefix = (system_message, [[role, message] for role, message in messages], prefix)
+        return prefix
+
+    def render(self, system_message, messages):
+        """Renders the prompt of a conversation."""
+        # the prefix is everything but the last turn (the question and the
+        # generation prompt), i.e. the system message and the few-shot examples
+        num_prefix = max(0, len(messages) - 2)
+        prefix = self.render_prefix(system_message, messages[:num_prefix])
+        suffix = "".join(
+            self.piece(i, role, message) for i, (role, message) in enumerate(messages[num_prefix:], num_prefix)
+        )
+        return self.finish(prefix + suffix)
+
+
+# Render plans of the templates, compiled the first time a template is rendered
+_render_plans: Dict[tuple, RenderPlan] = {}
+
+
+def get_render_plan(conv: Conversation) -> RenderPlan:
+    """Get the render plan of the format of a conversation."""
+    key = (conv.name, conv.system_template, tuple(conv.roles), conv.sep_style, conv.sep, conv.sep2)
+    plan = _render_plans.get(key)
+    if plan is None:
+        plan = _render_plans[key] = RenderPlan(*key)
+    return plan
+
+
 # A global registry for all conversation templates
 conv_templates: Dict[str, Conversation] = {}
 
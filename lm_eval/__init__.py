@@ -0,0 +1,16 @@
+import os
+import sys
+
+
+# With LM_EVAL_OFFLINE=1 (see lm_eval.mirror), the Hugging Face libraries are set
+# offline too. They read their flags when they are imported, so the flags are set here,
+# before any task imports them, and on the libraries that were already imported.
+if os.environ.get("LM_EVAL_OFFLINE", "0") == "1":
+    os.environ.setdefault("HF_DATASETS_OFFLINE", "1")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    if "huggingface_hub" in sys.modules and os.environ["HF_HUB_OFFLINE"] == "1":
+        from huggingface_hub import constants as _hub_constants
+        _hub_constants.HF_HUB_OFFLINE = True
+    if "datasets" in sys.modules and os.environ["HF_DATASETS_OFFLINE"] == "1":
+        import datasets.config as _datasets_config
+        _datasets_config.HF_HUB_OFFLINE = _datasets_config.HF_DATASETS_OFFLINE = True
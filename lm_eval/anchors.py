@@ -0,0 +1,170 @@
+"""Anchor docs: small subsets of each task's docs whose results, weighted, estimate
+the score on all the docs. Anchors are selected from the per-doc results of past
+runs of many models (the samples logged by the evaluator, see
+lm_eval.sample_logger): docs are clustered by how the models did on them, and the
+doc closest to each cluster center stands for all the docs of its cluster.
+"""
+import json
+import math
+import os
+
+import numpy as np
+
+
+def load_sample_metrics(run_dir, task_name, prompt_mode):
+    """Returns {doc_id: metrics} from the samples logged for a task in `run_dir`,
+    or None if the task was not logged there."""
+    path = os.path.join(run_dir, f"{task_name}_{prompt_mode}_samples.jsonl")
+    if not os.path.exists(path):
+        return None
+    doc_metrics = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            sample = json.loads(line)
+            doc_metrics[sample["doc_id"]] = sample["metrics"]
+    return doc_metrics
+
+
+def doc_score(value):
+    """Turns a per-doc metric item into a number describing how well the model did
+    on the doc: the item itself for per-doc scores (e.g. acc), whether the prediction
+    matches the reference for (prediction, reference) items (e.g. f1), or minus the
+    error for numeric (prediction, reference) items (e.g. pearson).
+    """
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        pred, gold = value
+        if isinstance(pred, (int, float)) and isinstance(gold, (int, float)) and not isinstance(pred, bool):
+            return -abs(pred - gold)
+        return float(pred == gold)
+    return float(value)
+
+
+def select_anchors(scores, num_anchors, seed=0):
+    """Clusters the docs by the scores the models got on them.
+
+    :param scores: np.ndarray
+        [models, docs] matrix of `doc_score`s
+    :param num_anchors: int
+    :return: (anchor doc indexes, weights). Each weight is the fraction of the
+        docs represented by the anchor
+    """
+    from sklearn.cluster import KMeans
+
+    num_docs = scores.shape[1]
+    if num_docs <= num_anchors:
+        return list(range(num_docs)), [1 / num_docs] * num_docs
+
+    doc_vectors = scores.T
+    # docs with the very same results can't be split between clusters (e.g. few models
+    # and per-doc scores that are 0 or 1)
+    num_clusters = min(num_anchors, len(np.unique(doc_vectors, axis=0)))
+    kmeans = KMeans(n_clusters=num_clusters, n_init=10, random_state=seed).fit(doc_vectors)
+    anchors, weights = [], []
+    for cluster in range(num_clusters):
+        members = np.flatnonzero(kmeans.labels_ == cluster)
+        if len(members) == 0:
+            continue
+        distances = np.linalg.norm(doc_vectors[members] - kmeans.cluster_centers_[cluster], axis=1)
+        anchors.append(int(members[np.argmin(distances)]))
+        weights.append(len(members) / num_docs)
+    return anchors, weights
+
+
+def estimate(aggregation, anchor_items, weights, num_docs):
+    """Estimates the aggregated metric over all the docs from the anchor items.
+
+    The anchor items are repeated in proportion to their weights, so any aggregation
+    (means, but also f1 or pearson over (prediction, reference) pairs) can be used.
+    """
+    items = []
+    for item, weight in zip(anchor_items, weights):
+        items.extend([item] * max(1, round(weight * num_docs)))
+    return aggregation(items)
+
+
+def build_task_anchors(doc_metrics_per_model, metric, aggregation, num_anchors, seed=0):
+    """Selects the anchors of a task and validates them.
+
+    Validation is leave-one-model-out: anchors are selected without one of the
+    models, and the score of that model estimated from them is compared with its
+    score on all the docs. The root mean squared error is kept as the error bar.
+
+    :param doc_metrics_per_model: list[dict[int, dict]]
+        {doc_id: metrics} of each past run
+    :param metric: str
+        Metric to estimate
+    :param aggregation: Callable
+        Aggregation of the metric, see Task.aggregation
+    :return: dict
+    """
+    doc_ids = sorted(set.intersection(*(set(doc_metrics) for doc_metrics in doc_metrics_per_model)))
+    items = [[doc_metrics[doc_id][metric] for doc_id in doc_ids] for doc_metrics in doc_metrics_per_model]
+    scores = np.array([[doc_score(item) for item in model_items] for model_items in items])
+
+    errors = []
+    if len(items) >= 3:
+        for held_out in range(len(items)):
+            others = np.delete(scores, held_out, axis=0)
+            anchors, weights = select_anchors(others, num_anchors, seed=seed)
+            estimated = estimate(aggregation, [items[held_out][i] for i in anchors], weights, len(doc_ids))
+            errors.append(estimated - aggregation(items[held_out]))
+
+    anchors, weights = select_anchors(scores, num_anchors, seed=seed)
+    return {
+        "metric": metric,
+        "num_docs": len(doc_ids),
+        "anchors": [doc_ids[i] for i in anchors],
+        "weights": weights,
+        "num_models": len(items),
+        "rmse": math.sqrt(sum(e ** 2 for e in errors) / len(errors)) if errors else None,
+        "max_abs_error": max(abs(e) for e in errors) if errors else None,
+    }
+
+
+def load_anchors(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def doc_filter(anchor_spec):
+    """Returns {task_name: set of anchor doc ids}, see evaluator.evaluate"""
+    return {task_name: set(task_anchors["anchors"]) for task_name, task_anchors in anchor_spec["tasks"].items()}
+
+
+def normalized_score(raw_score, task_config):
+    # same normalization as scripts/calculate_npm.py
+    return 100 * (raw_score - task_config["random_score"]) / (task_config["max_score"] - task_config["random_score"])
+
+
+def estimate_npm(results, task_configs, prompt_mode):
+    """Estimates the NPM (see scripts/calculate_npm.py) from the `<metric>_estimate`
+    and `<metric>_estimate_error` results of a quick evaluation. The error of the NPM
+    assumes the errors of the tasks are independent.
+
+    :return: dict with NPM.All, NPM.Translated, NPM.Native, their errors, and NPMPerTask
+    """
+    normalized = {}
+    for task_config in task_configs["tasks"]:
+        for task_name in task_config["lm_eval_task"].split(","):
+            task_results = results["results"].get(task_name, {}).get(prompt_mode)
+            metric = task_config["preferred_metric"]
+            if task_results is None or f"{metric}_estimate" not in task_results:
+                continue
+            score = normalized_score(task_results[f"{metric}_estimate"], task_config)
+            error = task_results.get(f"{metric}_estimate_error")
+            if error is not None:
+                error = 100 * error / (task_config["max_score"] - task_config["random_score"])
+            normalized[task_name] = (score, error, task_config["translated"])
+
+    npm = {"NPMPerTask": {task_name: score for task_name, (score, _, _) in normalized.items()}}
+    for name, selected in [
+        ("All", list(normalized.values())),
+        ("Translated", [x for x in normalized.values() if x[2]]),
+        ("Native", [x for x in normalized.values() if not x[2]]),
+    ]:
+        if not selected:
+            continue
+        npm[f"NPM.{name}"] = float(np.mean([score for score, _, _ in selected]))
+        if all(error is not None for _, error, _ in selected):
+            npm[f"NPM.{name}_error"] = math.sqrt(sum(error ** 2 for _, error, _ in selected)) / len(selected)
+    return npm
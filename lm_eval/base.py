@@ -7,14 +7,15 @@ import re
 import os
 import json
 import hashlib
-import datasets
 from sqlitedict import SqliteDict
 from tqdm import tqdm
-import torch
-import torch.nn.functional as F
 
 from lm_eval.metrics import mean, weighted_perplexity, weighted_mean, bits_per_byte
 from lm_eval import utils
+from lm_eval import profiling
+from lm_eval import bm25
+from lm_eval.prompt_segments import SegmentedPrompt, SegmentEncoder
+from lm_eval import docs_cache
 from abc import abstractmethod
 
 from conversation import get_conv_template
@@ -180,18 +181,27 @@ class BaseLM(LM):
     # subclass must implement properties vocab_size, eot_token_id, max_gen_toks, batch_size, device, max_length.
     # TODO: enforce this somehow
 
+    def tok_encode_prompt(self, prompt):
+        """Encodes a context, from the cached tokens of its segments if it is a
+        SegmentedPrompt (see lm_eval.prompt_segments).
+        """
+        if getattr(self, "_segment_encoder", None) is None:
+            self._segment_encoder = SegmentEncoder(self.tok_encode)
+        return self._segment_encoder.encode(prompt)
+
     def loglikelihood(self, requests):
         new_reqs = []
-        for context, continuation in requests:
-            if context == "":
-                # end of text as context
-                context_enc = [self.eot_token_id]
-            else:
-                context_enc = self.tok_encode(context)
+        with profiling.span("tokenize", requests=len(requests)):
+            for context, continuation in requests:
+                if context == "":
+                    # end of text as context
+                    context_enc = [self.eot_token_id]
+                else:
+                    context_enc = self.tok_encode_prompt(context)
 
-            continuation_enc = self.tok_encode(continuation)
+                continuation_enc = self.tok_encode(continuation)
 
-            new_reqs.append(((context, continuation), context_enc, continuation_enc))
+                new_reqs.append(((context, continuation), context_enc, continuation_enc))
 
         return self._loglikelihood_tokens(new_reqs)
 
@@ -223,6 +233,10 @@ class BaseLM(LM):
         return loglikelihoods
 
     def _loglikelihood_tokens(self, requests, disable_tqdm=False):
+        # torch is only needed by the models that run locally, API models don't import it
+        import torch
+        import torch.nn.functional as F
+
         # TODO: implement some kind of efficient-request-middleware that lumps together requests with the same context
         res = []
 
@@ -286,7 +300,10 @@ class BaseLM(LM):
                 inplens.append(inplen)
 
             batched_inps = torch.cat(inps, dim=0)  # [batch, padding_length
-            multi_logits = F.log_softmax(self._model_call(batched_inps), dim=-1).cpu()  # [batch, padding_length, vocab]
+            profiling.count("tokens", sum(inplens))
+            profiling.count("padded_tokens", padding_length * len(inplens))
+            with profiling.span("forward", batch_size=len(inplens), padding_length=padding_length):
+                multi_logits = F.log_softmax(self._model_call(batched_inps), dim=-1).cpu()  # [batch, padding_length, vocab]
 
             for (cache_key, _, _), logits, inp, inplen, cont_toks \
                     in zip(chunk, multi_logits, inps, inplens, cont_toks_list):
@@ -320,10 +337,12 @@ class BaseLM(LM):
         #       multiple tokens or that span multiple tokens correctly
 
         # TODO: extract to TokenizedLM?
+        import torch
+
         res = []
 
         def _collate(x):
-            toks = self.tok_encode(x[0])
+            toks = self.tok_encode_prompt(x[0])
             return len(toks), x[0]
         
         reord = utils.Reorderer(requests, _collate)
@@ -337,13 +356,15 @@ class BaseLM(LM):
             # add EOS token to stop sequences
             until.append(eos)
 
-            context_tokens = self.tok_encode(context)
+            context_tokens = self.tok_encode_prompt(context)
             if len(context_tokens) > abs(self.max_gen_toks - self.max_length):
                 print(f'The context occupies {len(context_tokens)} tokens, but it is possible to accomodate only {abs(self.max_gen_toks - self.max_length)}. The prompt will be incomplete.')
             
-            context_enc = torch.tensor([self.tok_encode(context)[self.max_gen_toks - self.max_length:]]).to(self.device)
+            context_enc = torch.tensor([context_tokens[self.max_gen_toks - self.max_length:]]).to(self.device)
 
-            cont = self._model_generate(context_enc, context_enc.shape[1] + self.max_gen_toks, until)
+            with profiling.span("generate", prompt_tokens=context_enc.shape[1]):
+                cont = self._model_generate(context_enc, context_enc.shape[1] + self.max_gen_toks, until)
+            profiling.count("tokens", cont.shape[1])
 
             s = self.tok_decode(cont[0].tolist()[context_enc.shape[1]:])
 
@@ -358,6 +379,63 @@ class BaseLM(LM):
         return reord.get_original(res)
 
 
+class TokenBudget:
+    """The context window of a model, used to fit the few-shot contexts to it (see
+    PromptSelectionTask.fit_fewshot_context).
+    """
+
+    # rough number of characters per token, when the tokenizer is unknown
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, count_tokens, max_length, max_gen_toks):
+        """
+        :param count_tokens: Callable[[str], int]
+            Number of tokens of a text, with the tokenizer of the model
+        :param max_length: int
+            Maximum number of tokens of a context and its continuation or generation
+        :param max_gen_toks: int
+            Number of tokens left for the generations
+        """
+        self.count_tokens = count_tokens
+        self.max_length = max_length
+        self.max_gen_toks = max_gen_toks
+        self._counts = {}
+
+    @classmethod
+    def from_lm(cls, lm):
+        """Returns the budget of a BaseLM, or None if it has no known max length. The
+        tokens of models without a local tokenizer (e.g. API models) are approximated
+        as CHARS_PER_TOKEN characters per token.
+        """
+        try:
+            max_length, max_gen_toks = lm.max_length, lm.max_gen_toks
+        except (AttributeError, NotImplementedError):
+            print(f"WARNING: the max length of {type(lm).__name__} is unknown, the few-shot contexts are not fitted")
+            return None
+        try:
+            lm.tok_encode("")
+            encode = getattr(lm, "tok_encode_prompt", lm.tok_encode)
+            count_tokens = lambda text: len(encode(text))
+        except (AttributeError, NotImplementedError):
+            print(
+                f"WARNING: {type(lm).__name__} has no tokenizer, the tokens of the few-shot contexts are approximated "
+                f"as {cls.CHARS_PER_TOKEN} characters per token"
+            )
+            count_tokens = lambda text: -(-len(text) // cls.CHARS_PER_TOKEN)
+        return cls(count_tokens, max_length, max_gen_toks)
+
+    def count(self, text, cache=False):
+        """Returns the number of tokens of `text`. Texts counted with `cache=True`
+        (e.g. few-shot examples, which appear in many contexts) are only tokenized once.
+        """
+        if not cache:
+            return self.count_tokens(text)
+        n = self._counts.get(text)
+        if n is None:
+            n = self._counts[text] = self.count_tokens(text)
+        return n
+
+
 class Task(abc.ABC):
     """A task represents an entire benchmark including its dataset, problems,
     answers, and evaluation methods. See BoolQ for a simple example implementation
@@ -376,6 +454,8 @@ class Task(abc.ABC):
     DATASET_NAME: str = None
     description_as_system_message = False  # if True, the task description is used as the system message for chat models
     description_complement = {}  # if not empty, it will be added to the description
+    # if True, the docs built by `download` are cached, see lm_eval.docs_cache
+    CACHE_DOCS = False
 
 
     def __init__(self, data_dir=None, cache_dir=None, download_mode=None):
@@ -401,7 +481,10 @@ class Task(abc.ABC):
             - `datasets.DownloadMode.FORCE_REDOWNLOAD`
                 Fresh download and fresh dataset.
         """
-        self.download(data_dir, cache_dir, download_mode)
+        if self.CACHE_DOCS:
+            docs_cache.download_cached(self, data_dir, cache_dir, download_mode)
+        else:
+            self.download(data_dir, cache_dir, download_mode)
         self._training_docs = None
         self._fewshot_docs = None
 
@@ -430,6 +513,8 @@ class Task(abc.ABC):
             - `datasets.DownloadMode.FORCE_REDOWNLOAD`
                 Fresh download and fresh dataset.
         """
+        import datasets
+
         self.dataset = datasets.load_dataset(
             path=self.DATASET_PATH,
             name=self.DATASET_NAME,
@@ -438,6 +523,19 @@ class Task(abc.ABC):
             download_mode=download_mode,
         )
 
+    def docs_cache_sources(self):
+        """Files (or directories) the docs are built from, used to key the docs cache.
+        By default, `DATASET_PATH` when it is a local directory."""
+        if self.DATASET_PATH and os.path.isdir(self.DATASET_PATH):
+            return [self.DATASET_PATH]
+        return []
+
+    def docs_cache_version(self):
+        """Version of the data the docs are built from that the source files don't
+        capture (e.g. the commit of a Hugging Face Hub dataset), used to key the docs
+        cache. If None, the version is unknown and the docs are not cached."""
+        return ""
+
     def set_inference_model_category(self, model_category):
         self.inference_model_category = model_category
 
@@ -644,6 +742,11 @@ class PromptSelectionTask(Task):
     # multiple of NUM_CLASSES to get the expected number of few-shot examples.
     NUM_CLASSES = 0
 
+    # The dataset argument that partitions the documents, e.g. the exam of a 
+    # question. If set, the few-shot examples of a document are drawn from the
+    # other partitions only, see `partition_pool`.
+    PARTITION_KEY = None
+
     manual_examples = []
 
     def __init__(self, data_dir=None, cache_dir=None, download_mode=None):
@@ -653,10 +756,16 @@ class PromptSelectionTask(Task):
             self.select_balanced_fewshot_indices()
 
         self.searcher = None
-
-    def create_collection_to_index(self):
-        """ Creates a JSON collection to index. Overwrite this funtion to keep
-        more arguments.
+        self._training_doc_indices = None
+        self._partition_pools = None
+        self._fewshot_pools = None
+        # the few-shot examples selected for the last context built, see `fewshot_context`
+        self.last_fewshot_docs = []
+
+    def collection_to_index(self):
+        """ Returns the collection to index for `dynamic-similar` prompts: dicts 
+        whose `contents` are indexed, returned as the search hits. Overwrite this 
+        funtion to keep more arguments.
         """
         json_data = []
         for i, doc in enumerate(self.training_docs()):
@@ -675,22 +784,38 @@ class PromptSelectionTask(Task):
 
             json_data.append(data)
 
-        with open(self.documents_to_index, 'w') as f:
-            json.dump(json_data, f)
+        return json_data
+
+    def fewshot_query(self, doc):
+        """ Returns the query that searches the examples similar to `doc`.
+        """
+        return '. '.join(doc[key] for key in self.KEYS_TO_INDEX)
 
-    def indexing(self):
-        """ Uses pyserini to index training documents with BM25.
+    def search(self, doc):
+        """ Returns the SEARCHER_K documents of `collection_to_index` most similar 
+        to `doc` with BM25, best first. The index is built once (and cached on 
+        disk, see lm_eval.bm25), and the queries of all the evaluated docs are 
+        answered together on the first search.
         """
-        command = f'''python3 -m pyserini.index.lucene \
-                --collection JsonCollection \
-                --input {os.path.dirname(self.documents_to_index)} \
-                --language pt \
-                --index {self.indexes_dir} \
-                --generator DefaultLuceneDocumentGenerator \
-                --threads 1 \
-                --storePositions --storeDocvectors --storeRaw
-                '''
-        os.system(command)
+        if self.searcher is None:
+            self.indexes_dir = os.path.join('data', self.DATASET_PATH, 'indexes')
+            self._collection = self.collection_to_index()
+            self.searcher = bm25.load_or_build(
+                [hit['contents'] for hit in self._collection], self.indexes_dir, language='pt')
+
+            if self.has_test_docs():
+                eval_docs = self.test_docs()
+            elif self.has_validation_docs():
+                eval_docs = self.validation_docs()
+            else:
+                eval_docs = []
+            queries = list(dict.fromkeys(self.fewshot_query(d) for d in eval_docs))
+            self._search_results = dict(zip(queries, self.searcher.search(queries, self.SEARCHER_K)))
+
+        query = self.fewshot_query(doc)
+        if query not in self._search_results:
+            self._search_results[query] = self.searcher.search([query], self.SEARCHER_K)[0]
+        return [self._collection[i] for i in self._search_results[query]]
 
     def select_balanced_fewshot_indices(self):
         """ Selects the indices of the training examples that will be used as 
@@ -709,6 +834,199 @@ class PromptSelectionTask(Task):
             self.manual_indices_per_class[gold].append(i)
 
         self.classes = list(self.indices_per_class.keys())
+        self._balanced_indices = {}
+
+    def balanced_fewshot_indices(self, k, manual=False):
+        """ Returns the indices of the first k // NUM_CLASSES training (or manual)
+        examples of each class, computed once for each k.
+        """
+        if (k, manual) not in self._balanced_indices:
+            indices_per_class = self.manual_indices_per_class if manual else self.indices_per_class
+            self._balanced_indices[k, manual] = [
+                id for lst in indices_per_class.values() for id in lst[:k // self.NUM_CLASSES]
+            ]
+        return self._balanced_indices[k, manual]
+
+    def training_doc_index(self, doc):
+        """ Returns the index of the first training doc equal to `doc`, as
+        `list.index` (and so `list.remove`) would find it, in O(1) when `doc` is one
+        of the training docs (e.g. when the test docs are the training docs).
+        """
+        if self._training_doc_indices is None:
+            self._training_doc_indices = {}
+            first_by_content = {}
+            for i, d in enumerate(self._training_docs):
+                j = first_by_content.setdefault(json.dumps(d, sort_keys=True, default=repr), i)
+                if self._training_docs[j] != d:
+                    j = self._training_docs.index(d)
+                self._training_doc_indices[id(d)] = j
+        index = self._training_doc_indices.get(id(doc))
+        if index is None:
+            index = self._training_docs.index(doc)
+        return index
+
+    def fewshot_candidate_docs(self):
+        """ Returns the documents the few-shot examples are drawn from when 
+        PARTITION_KEY is set.
+        """
+        return self.training_docs()
+
+    def is_fewshot_candidate(self, doc):
+        """ Whether a document can be used as few-shot example when PARTITION_KEY
+        is set, e.g. it is not too large.
+        """
+        return True
+
+    def _build_partition_pools(self, docs):
+        partitions = dict.fromkeys(doc[self.PARTITION_KEY] for doc in docs)
+        pools = {
+            partition: [doc for doc in docs if doc[self.PARTITION_KEY] != partition]
+            for partition in partitions
+        }
+        return pools, docs
+
+    def partition_pool(self, doc, manual=False):
+        """ Returns the few-shot candidates (or the manual examples) that are not
+        in the partition of `doc`, in their original order. The pools of all the
+        partitions are built once, instead of filtering the candidates for each doc.
+        """
+        if self._partition_pools is None:
+            candidates = [d for d in self.fewshot_candidate_docs() if self.is_fewshot_candidate(d)]
+            self._partition_pools = {
+                False: self._build_partition_pools(candidates),
+                True: self._build_partition_pools(list(self.manual_examples)),
+            }
+        pools, all_docs = self._partition_pools[manual]
+        # documents of a partition without candidates can use all of them
+        return pools.get(doc[self.PARTITION_KEY], all_docs)
+
+    def sample_fewshot_docs(self, k, rnd, docs, indices=None, exclude=None, limit=None):
+        """ Samples k of the candidates given by `utils.SampleView(docs, indices,
+        exclude, limit)`, e.g. the training docs without the current one. Selects
+        the same docs as `rnd.sample` on a list of the candidates, without building it.
+        """
+        return rnd.sample(utils.SampleView(docs, indices, exclude, limit), k)
+
+    def fewshot_pools(self):
+        """ Returns the named lists the few-shot examples are drawn from: the 
+        training docs, the manual examples, and the validation and test docs. An 
+        example is referred to by its position in a pool, see `fewshot_example_id`.
+        """
+        if self._fewshot_pools is None:
+            pools = {}
+            if self.has_training_docs():
+                if self._training_docs is None:
+                    self._training_docs = list(self.training_docs())
+                pools['train'] = self._training_docs
+            pools['manual'] = list(self.manual_examples)
+            if self.has_validation_docs():
+                pools['validation'] = list(self.validation_docs())
+            if self.has_test_docs():
+                pools['test'] = list(self.test_docs())
+
+            ids_by_object, ids_by_content = {}, {}
+            for name, docs in pools.items():
+                for i, d in enumerate(docs):
+                    ids_by_object.setdefault(id(d), f'{name}:{i}')
+                    ids_by_content.setdefault(json.dumps(d, sort_keys=True, default=repr), f'{name}:{i}')
+            self._fewshot_pools = pools, ids_by_object, ids_by_content
+        return self._fewshot_pools[0]
+
+    def fewshot_example_id(self, doc):
+        """ Returns the id of a few-shot example: `<pool>:<index>` of the first doc
+        of `fewshot_pools` equal to it, or the example itself (`{"doc": doc}`) when
+        it is in none of them (e.g. a search hit with its own fields).
+        """
+        self.fewshot_pools()
+        _, ids_by_object, ids_by_content = self._fewshot_pools
+        example_id = ids_by_object.get(id(doc))
+        if example_id is None:
+            example_id = ids_by_content.get(json.dumps(doc, sort_keys=True, default=repr))
+        return example_id if example_id is not None else {'doc': doc}
+
+    def fewshot_example_doc(self, example_id):
+        """ Returns the few-shot example of an id given by `fewshot_example_id`.
+        """
+        if isinstance(example_id, dict):
+            return example_id['doc']
+        pool, index = example_id.rsplit(':', 1)
+        return self.fewshot_pools()[pool][int(index)]
+
+    def select_fewshot_docs(self, doc, num_fewshot, rnd, prompt_mode):
+        """ Selects the `num_fewshot` few-shot examples of `doc`.
+        """
+        # for sets with no training docs, draw from other set *but ensure no overlap with current doc*
+        if self.has_training_docs():
+            return self.fewshot_examples(k=num_fewshot, rnd=rnd, doc=doc, prompt_mode=prompt_mode)
+
+        if self._fewshot_docs is None:
+            self._fewshot_docs = list(
+                self.validation_docs()
+                if self.has_validation_docs()
+                else self.test_docs()
+            )
+
+        fewshotex = rnd.sample(self._fewshot_docs, num_fewshot + 1)
+
+        # get rid of the doc that's the one we're evaluating, if it's in the fewshot
+        return [x for x in fewshotex if x != doc][:num_fewshot]
+
+    def reserved_tokens(self, doc, token_budget):
+        """ Returns the number of tokens the requests of `doc` need after the 
+        context: its longest continuation, or `max_gen_toks` if it generates.
+        """
+        reqs = self.construct_requests(doc, "")
+        if not isinstance(reqs, (list, tuple)):
+            reqs = [reqs]
+        reserved = 0
+        for req in reqs:
+            if req.request_type == 'greedy_until':
+                reserved = max(reserved, token_budget.max_gen_toks)
+            elif req.request_type == 'loglikelihood':
+                reserved = max(reserved, token_budget.count(req.args[1], cache=True))
+        return reserved
+
+    def fit_fewshot_context(self, token_budget, doc, num_fewshot, prompt_mode=None, rnd=None, fewshot_docs=None, **kwargs):
+        """ Returns the context of `doc` with as many of its few-shot examples as 
+        fit in `token_budget.max_length`, along with `reserved_tokens`. The 
+        examples are selected as usual, and the longest ones are dropped until the 
+        context fits. The token counts of the examples are cached in the budget, 
+        so only the contexts themselves are tokenized for each doc.
+
+        `last_fewshot_docs` is set to the examples selected before any is dropped,
+        so a few-shot manifest records the same examples for every model, and each
+        model fits them to its own budget when the manifest is replayed.
+        """
+        if fewshot_docs is not None:
+            fewshotex = list(fewshot_docs)
+        elif num_fewshot == 0:
+            fewshotex = []
+        else:
+            fewshotex = self.select_fewshot_docs(doc, num_fewshot, rnd, prompt_mode)
+        selected = fewshotex
+
+        reserved = self.reserved_tokens(doc, token_budget)
+        while True:
+            ctx = self.fewshot_context(
+                doc=doc, num_fewshot=len(fewshotex), prompt_mode=prompt_mode, rnd=rnd, fewshot_docs=fewshotex, **kwargs)
+            excess = token_budget.count(ctx) + reserved - token_budget.max_length
+            if excess <= 0 or not fewshotex:
+                self.last_fewshot_docs = selected
+                return ctx
+
+            # drop the longest examples worth the excess (at least one), keeping
+            # the order of the others, then check the actual length again
+            lengths = [
+                token_budget.count(self.doc_to_text(doc_ex) + self.doc_to_target(doc_ex), cache=True)
+                for doc_ex in fewshotex
+            ]
+            dropped = set()
+            for i in sorted(range(len(fewshotex)), key=lambda i: -lengths[i]):
+                dropped.add(i)
+                excess -= lengths[i]
+                if excess <= 0:
+                    break
+            fewshotex = [doc_ex for i, doc_ex in enumerate(fewshotex) if i not in dropped]
 
     def fewshot_examples(self, k, rnd, prompt_mode, doc):
         if self._training_docs is None:
@@ -728,9 +1046,7 @@ class PromptSelectionTask(Task):
                 # 2 - ensure that, until the position NUM_CLASSES * n, we will 
                 # have n for each class. 
                 # For now, we implemented the 1.
-                indices = [id for lst in self.indices_per_class.values() for id in lst[:k // self.NUM_CLASSES]]
-                examples = [self._training_docs[id] for id in indices]
-                return rnd.sample(examples, k)
+                return self.sample_fewshot_docs(k, rnd, self._training_docs, indices=self.balanced_fewshot_indices(k))
             else:
                 return rnd.sample(self._training_docs[:k], k)
 
@@ -743,9 +1059,8 @@ class PromptSelectionTask(Task):
                         f'num_fewshot={k}. Please, include more examples.')
 
                 # Similar to the implementation for `fixed`
-                indices = [id for lst in self.manual_indices_per_class.values() for id in lst[:k // self.NUM_CLASSES]]
-                examples = [self.manual_examples[id] for id in indices]
-                return rnd.sample(examples, k)
+                return self.sample_fewshot_docs(
+                    k, rnd, self.manual_examples, indices=self.balanced_fewshot_indices(k, manual=True))
             else:
                 assert k <= len(self.manual_examples), (
                     f'The number of manual_examples is not enough to satisfy '
@@ -757,7 +1072,8 @@ class PromptSelectionTask(Task):
 
     @utils.positional_deprecated
     def fewshot_context(
-        self, doc, num_fewshot, prompt_mode=None, provide_description=None, rnd=None, description=None, conversation_template=None, prompt_as_single_user_message=False
+        self, doc, num_fewshot, prompt_mode=None, provide_description=None, rnd=None, description=None, conversation_template=None, prompt_as_single_user_message=False,
+        fewshot_docs=None, token_budget=None
     ):
         """Returns a fewshot context string that is made up of a prepended description
         (if provided), the `num_fewshot` number of examples, and an appended prompt example.
@@ -772,6 +1088,14 @@ class PromptSelectionTask(Task):
             WARNING: This is currently a required arg although it's optionalized with a default `None`.
         :param description: str
             The task's description that will be prepended to the fewshot examples.
+        :param fewshot_docs: list, optional
+            The few-shot examples to use instead of selecting `num_fewshot` ones, e.g.
+            the ones of a few-shot manifest (see lm_eval.fewshot_manifest). The 
+            examples selected for the context, before `token_budget` drops any,
+            are kept in `last_fewshot_docs` either way.
+        :param token_budget: TokenBudget, optional
+            Token budget of the model. If the context does not fit, the longest 
+            examples are dropped, see `fit_fewshot_context`.
         :returns: str
             The fewshot context.
         """
@@ -789,6 +1113,13 @@ class PromptSelectionTask(Task):
                 "WARNING: provide_description is deprecated and will be removed in a future version in favor of description_dict"
             )
 
+        if token_budget is not None:
+            return self.fit_fewshot_context(
+                token_budget, doc=doc, num_fewshot=num_fewshot, prompt_mode=prompt_mode, rnd=rnd,
+                description=description, conversation_template=conversation_template,
+                prompt_as_single_user_message=prompt_as_single_user_message, fewshot_docs=fewshot_docs,
+            )
+
         # If description_complement is provided, replace variables in the description
         if self.description_complement:
             description = description.format(**self.description_complement)
@@ -806,7 +1137,11 @@ class PromptSelectionTask(Task):
             description = description + "\n\n" if description else ""
 
         example = self.doc_to_text(doc)
-        labeled_examples = ""
+        labeled_examples = []
+
+        if fewshot_docs is not None:
+            num_fewshot = len(fewshot_docs)
+        self.last_fewshot_docs = []
 
         if num_fewshot == 0:
             if conversation_template:
@@ -819,21 +1154,11 @@ class PromptSelectionTask(Task):
                     conversation.append_message(conversation.roles[0], description + " " + example)
                     conversation.append_message(conversation.roles[1], None)
         else:
-            # for sets with no training docs, draw from other set *but ensure no overlap with current doc*
-            if self.has_training_docs():
-                fewshotex = self.fewshot_examples(k=num_fewshot, rnd=rnd, doc=doc, prompt_mode=prompt_mode)
+            if fewshot_docs is not None:
+                fewshotex = fewshot_docs
             else:
-                if self._fewshot_docs is None:
-                    self._fewshot_docs = list(
-                        self.validation_docs()
-                        if self.has_validation_docs()
-                        else self.test_docs()
-                    )
-
-                fewshotex = rnd.sample(self._fewshot_docs, num_fewshot + 1)
-
-                # get rid of the doc that's the one we're evaluating, if it's in the fewshot
-                fewshotex = [x for x in fewshotex if x != doc][:num_fewshot]
+                fewshotex = self.select_fewshot_docs(doc, num_fewshot, rnd, prompt_mode)
+            self.last_fewshot_docs = fewshotex
 
             if conversation_template:
                 user_role, assistant_role = conversation.roles
@@ -853,11 +1178,12 @@ class PromptSelectionTask(Task):
                 conversation.append_message(user_role, example)
                 conversation.append_message(assistant_role, None)
             else:
+                # each example is a segment of the prompt, tokenized once by the LM
                 for i, doc_ex in enumerate(fewshotex):
-                    labeled_examples += f'{self.prompt_strings["example"][self.language]} {i+1}:\n'
-                    labeled_examples += self.doc_to_text(doc_ex) + self.doc_to_target(doc_ex)
-                    labeled_examples += '\n###\n'
-                labeled_examples += f'{self.prompt_strings["example"][self.language]} {len(fewshotex) + 1}:\n'
+                    labeled_examples.append(f'{self.prompt_strings["example"][self.language]} {i+1}:\n')
+                    labeled_examples.append(self.doc_to_text(doc_ex) + self.doc_to_target(doc_ex))
+                    labeled_examples.append('\n###\n')
+                labeled_examples.append(f'{self.prompt_strings["example"][self.language]} {len(fewshotex) + 1}:\n')
 
         if conversation_template:
             if prompt_as_single_user_message:
@@ -865,13 +1191,14 @@ class PromptSelectionTask(Task):
             else:
                 return json.dumps(conversation.to_openai_api_messages(), ensure_ascii=False)
         else:
-            return description + labeled_examples + example
+            return SegmentedPrompt([description, *labeled_examples, example])
 
 
 class PromptSelectionTaskES(PromptSelectionTask):
     @utils.positional_deprecated
     def fewshot_context(
-        self, doc, num_fewshot, prompt_mode=None, provide_description=None, rnd=None, description=None, conversation_template=None, prompt_as_single_user_message=False
+        self, doc, num_fewshot, prompt_mode=None, provide_description=None, rnd=None, description=None, conversation_template=None, prompt_as_single_user_message=False,
+        fewshot_docs=None, token_budget=None
     ):
         """Returns a fewshot context string that is made up of a prepended description
         (if provided), the `num_fewshot` number of examples, and an appended prompt example.
@@ -886,6 +1213,14 @@ class PromptSelectionTaskES(PromptSelectionTask):
             WARNING: This is currently a required arg although it's optionalized with a default `None`.
         :param description: str
             The task's description that will be prepended to the fewshot examples.
+        :param fewshot_docs: list, optional
+            The few-shot examples to use instead of selecting `num_fewshot` ones, e.g.
+            the ones of a few-shot manifest (see lm_eval.fewshot_manifest). The 
+            examples selected for the context, before `token_budget` drops any,
+            are kept in `last_fewshot_docs` either way.
+        :param token_budget: TokenBudget, optional
+            Token budget of the model. If the context does not fit, the longest 
+            examples are dropped, see `fit_fewshot_context`.
         :returns: str
             The fewshot context.
         """
@@ -903,6 +1238,13 @@ class PromptSelectionTaskES(PromptSelectionTask):
                 "WARNING: provide_description is deprecated and will be removed in a future version in favor of description_dict"
             )
 
+        if token_budget is not None:
+            return self.fit_fewshot_context(
+                token_budget, doc=doc, num_fewshot=num_fewshot, prompt_mode=prompt_mode, rnd=rnd,
+                description=description, conversation_template=conversation_template,
+                prompt_as_single_user_message=prompt_as_single_user_message, fewshot_docs=fewshot_docs,
+            )
+
         def adapt_text_to_conversation(text):
             # Remove '\nReponse: ', '\nSentiment: ', '\nScore:', etc. at the end of text
             if text[-1] == ':':
@@ -916,6 +1258,11 @@ class PromptSelectionTaskES(PromptSelectionTask):
             description = description + "\n\n" if description else ""
 
         example = self.doc_to_text(doc)
+        labeled_examples = []
+
+        if fewshot_docs is not None:
+            num_fewshot = len(fewshot_docs)
+        self.last_fewshot_docs = []
 
         if num_fewshot == 0:
             if conversation_template:
@@ -923,23 +1270,12 @@ class PromptSelectionTaskES(PromptSelectionTask):
                 conversation.append_message(conversation.roles[0], description + " " + example)
                 conversation.append_message(conversation.roles[1], None)
         else:
-            # for sets with no training docs, draw from other set *but ensure no overlap with current doc*
-            if self.has_training_docs():
-                fewshotex = self.fewshot_examples(k=num_fewshot, rnd=rnd, doc=doc, prompt_mode=prompt_mode)
+            if fewshot_docs is not None:
+                fewshotex = fewshot_docs
             else:
-                if self._fewshot_docs is None:
-                    self._fewshot_docs = list(
-                        self.validation_docs()
-                        if self.has_validation_docs()
-                        else self.test_docs()
-                    )
-
-                fewshotex = rnd.sample(self._fewshot_docs, num_fewshot + 1)
+                fewshotex = self.select_fewshot_docs(doc, num_fewshot, rnd, prompt_mode)
+            self.last_fewshot_docs = fewshotex
 
-                # get rid of the doc that's the one we're evaluating, if it's in the fewshot
-                fewshotex = [x for x in fewshotex if x != doc][:num_fewshot]
-
-            labeled_examples = ''
             if conversation_template:
                 user_role, assistant_role = conversation.roles
                 conversation.append_message(user_role, description)
@@ -954,11 +1290,12 @@ class PromptSelectionTaskES(PromptSelectionTask):
                 conversation.append_message(user_role, example)
                 conversation.append_message(assistant_role, None)
             else:
+                # each example is a segment of the prompt, tokenized once by the LM
                 for i, doc_ex in enumerate(fewshotex):
-                    labeled_examples += f'Ejemplo {i+1}:\n'
-                    labeled_examples += self.doc_to_text(doc_ex) + self.doc_to_target(doc_ex)
-                    labeled_examples += '\n###\n'
-                labeled_examples += f'Ejemplo {len(fewshotex) + 1}:\n'
+                    labeled_examples.append(f'Ejemplo {i+1}:\n')
+                    labeled_examples.append(self.doc_to_text(doc_ex) + self.doc_to_target(doc_ex))
+                    labeled_examples.append('\n###\n')
+                labeled_examples.append(f'Ejemplo {len(fewshotex) + 1}:\n')
 
         if conversation_template:
             if prompt_as_single_user_message:
@@ -966,7 +1303,7 @@ class PromptSelectionTaskES(PromptSelectionTask):
             else:
                 return json.dumps(conversation.to_openai_api_messages(), ensure_ascii=False)
         else:
-            return description + labeled_examples + example
+            return SegmentedPrompt([description, *labeled_examples, example])
 
 
 class MultipleChoiceTask(Task):
@@ -1184,6 +1521,9 @@ class CachingLM:
                     res.append(None)
                     remaining_reqs.append(req)
             
+            profiling.count("cache_hits", len(requests) - len(remaining_reqs))
+            profiling.count("cache_misses", len(remaining_reqs))
+
             # actually run the LM on the requests that do not have cached results
             rem_res = getattr(self.lm, attr)(remaining_reqs)
 
@@ -0,0 +1,345 @@
+"""In-process BM25 retrieval, used to select the few-shot examples of the
+`dynamic-similar` prompt mode.
+
+It reproduces what pyserini did with `--language pt` (see scripts/validate_bm25.py):
+Lucene's PortugueseAnalyzer (standard tokenization, lowercasing, Snowball Portuguese
+stopwords, Portuguese light stemming), and Lucene's BM25 with pyserini's defaults
+(k1=0.9, b=0.4), including the lossy one-byte encoding of document lengths. Repeated
+query terms are weighted by their count, like pyserini's bag-of-words queries, and
+ties are ranked by position in the collection, like Lucene's doc ids.
+
+Scores are computed as a sparse matrix product of the queries and the documents, so
+the queries of all the docs of a task are answered at once.
+
+With LM_EVAL_BM25=pyserini, the searches are done by pyserini itself (`PyseriniIndex`),
+the reference implementation. It needs pyserini and a Java runtime.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+
+# bump when the analysis or the scoring changes, to invalidate the cached indexes
+VERSION = 2
+
+# "lm_eval" for `BM25Index`, or "pyserini" for `PyseriniIndex`
+BACKEND = os.environ.get("LM_EVAL_BM25", "lm_eval")
+
+# Snowball Portuguese stop words, the default of Lucene's PortugueseAnalyzer
+PORTUGUESE_STOPWORDS = frozenset("""
+de a o que e do da em um para com não uma os no se na por mais as dos como mas ao ele
+das à seu sua ou quando muito nos já eu também só pelo pela até isso ela entre depois
+sem mesmo aos seus quem nas me esse eles você essa num nem suas meu às minha numa pelos
+elas qual nós lhe deles essas esses pelas este dele tu te vocês vos lhes meus minhas
+teu tua teus tuas nosso nossa nossos nossas dela delas esta estes estas aquele aquela
+aqueles aquelas isto aquilo estou está estamos estão estive esteve estivemos estiveram
+estava estávamos estavam estivera estivéramos esteja estejamos estejam estivesse
+estivéssemos estivessem estiver estivermos estiverem hei há havemos hão houve houvemos
+houveram houvera houvéramos haja hajamos hajam houvesse houvéssemos houvessem houver
+houvermos houverem houverei houverá houveremos houverão houveria houveríamos
+houveriam sou somos são era éramos eram fui foi fomos foram fora fôramos seja sejamos
+sejam fosse fôssemos fossem for formos forem serei será seremos serão seria seríamos
+seriam tenho tem temos tém tinha tínhamos tinham tive teve tivemos tiveram tivera
+tivéramos tenha tenhamos tenham tivesse tivéssemos tivessem tiver tivermos tiverem
+terei terá teremos terão teria teríamos teriam
+""".split())
+
+# Approximation of Lucene's StandardTokenizer (Unicode word boundaries): words and
+# numbers, keeping apostrophes and periods between letters (e.g. "d'água", "e.g")
+# and periods, commas, semicolons and apostrophes between digits (e.g. "3,50", "1.000")
+TOKEN_REGEX = re.compile(r"\w+(?:(?:(?<=[^\W\d_])['’.](?=[^\W\d_])|(?<=\d)[.,;'’](?=\d))\w+)*")
+
+_ACCENTS = str.maketrans("àáâäãòóôöõèéêëùúûüìíîïç", "aaaaaoooooeeeeuuuuiiiic")
+
+
+def _remove_suffix(s):
+    n = len(s)
+    if n > 4 and s.endswith("es") and s[-3] in "rslz":
+        return s[:-2]
+    if n > 3 and s.endswith("ns"):
+        return s[:-2] + "m"
+    if n > 4 and (s.endswith("eis") or s.endswith("éis")):
+        return s[:-3] + "el"
+    if n > 4 and s.endswith("ais"):
+        return s[:-2] + "l"
+    if n > 4 and s.endswith("óis"):
+        return s[:-3] + "ol"
+    if n > 4 and s.endswith("is"):
+        return s[:-1] + "l"
+    if n > 3 and (s.endswith("ões") or s.endswith("ães")):
+        return s[:-3] + "ão"
+    if n > 6 and s.endswith("mente"):
+        return s[:-5]
+    if n > 3 and s.endswith("s"):
+        return s[:-1]
+    return s
+
+
+def _norm_feminine(s):
+    n = len(s)
+    if n > 7 and (s.endswith("inha") or s.endswith("iaca") or s.endswith("eira")):
+        return s[:-1] + "o"
+    if n > 6:
+        if s.endswith(("osa", "ica", "ida", "ada", "iva", "ama")):
+            return s[:-1] + "o"
+        if s.endswith("ona"):
+            return s[:-3] + "ão"
+        if s.endswith("ora"):
+            return s[:-1]
+        if s.endswith("esa"):
+            return s[:-3] + "ês"
+        if s.endswith("na"):
+            return s[:-1] + "o"
+    return s
+
+
+def portuguese_light_stem(token):
+    """Lucene's PortugueseLightStemmer (Savoy's light stemmer for Portuguese)."""
+    if len(token) < 4:
+        return token
+    token = _remove_suffix(token)
+    if len(token) > 3 and token[-1] == "a":
+        token = _norm_feminine(token)
+    if len(token) > 4 and token[-1] in "eao":
+        token = token[:-1]
+    return token.translate(_ACCENTS)
+
+
+def analyze(text, language="pt"):
+    """Returns the terms of `text`, as Lucene's analyzer of `language` would."""
+    tokens = (token.lower() for token in TOKEN_REGEX.findall(text))
+    if language == "pt":
+        return [portuguese_light_stem(token) for token in tokens if token not in PORTUGUESE_STOPWORDS]
+    return list(tokens)
+
+
+def _int_to_int4(i):
+    num_bits = int(i).bit_length()
+    if num_bits < 4:
+        return i
+    shift = num_bits - 4
+    return ((i >> shift) & 0x07) | ((shift + 1) << 3)
+
+
+def _int4_to_int(i):
+    bits, shift = i & 0x07, (i >> 3) - 1
+    return bits if shift == -1 else (bits | 0x08) << shift
+
+
+# Lucene's SmallFloat.intToByte4 / byte4ToInt: document lengths are stored in a byte,
+# exactly up to 23 and approximately above
+_NUM_FREE_VALUES = 255 - _int_to_int4(2 ** 31 - 1)
+
+
+def quantize_length(length):
+    if length < _NUM_FREE_VALUES:
+        return length
+    return _NUM_FREE_VALUES + _int4_to_int(_int_to_int4(length - _NUM_FREE_VALUES))
+
+
+class BM25Index:
+    """BM25 index of a collection of texts, searched with batches of queries."""
+
+    def __init__(self, term_ids, idf, doc_weights, k1=0.9, b=0.4, language="pt"):
+        """Use `BM25Index.build` or `BM25Index.load`.
+
+        :param term_ids: dict[str, int]
+        :param idf: np.ndarray
+            IDF of each term
+        :param doc_weights: scipy.sparse.csr_matrix
+            [terms, docs] matrix of the BM25 term frequency weights, tf / (tf + K_doc)
+        """
+        self.term_ids = term_ids
+        self.idf = idf
+        self.doc_weights = doc_weights
+        self.k1 = k1
+        self.b = b
+        self.language = language
+
+    @property
+    def num_docs(self):
+        return self.doc_weights.shape[1]
+
+    @classmethod
+    def build(cls, texts, k1=0.9, b=0.4, language="pt"):
+        import scipy.sparse
+
+        term_ids = {}
+        rows, cols, lengths = [], [], []
+        for doc_id, text in enumerate(texts):
+            terms = analyze(text, language)
+            lengths.append(len(terms))
+            for term in terms:
+                rows.append(term_ids.setdefault(term, len(term_ids)))
+            cols.extend([doc_id] * len(terms))
+
+        # duplicated (term, doc) entries are summed into the term frequencies
+        tf = scipy.sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(term_ids), len(texts))
+        )
+        tf.sum_duplicates()
+
+        # same computations, in float32, as Lucene's BM25Similarity
+        lengths = np.array(lengths)
+        doc_count = max(1, np.count_nonzero(lengths))
+        avgdl = np.float32(lengths.sum() / doc_count) if lengths.sum() else np.float32(1)
+        doc_freq = np.diff(tf.indptr)
+        idf = np.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        quantized = np.array([quantize_length(length) for length in lengths], dtype=np.float32)
+        norm_inverse = np.float32(1) / (np.float32(k1) * ((np.float32(1) - np.float32(b)) + np.float32(b) * quantized / avgdl))
+        freq_norm = tf.data * norm_inverse[tf.indices]
+        tf.data = (np.float32(1) - np.float32(1) / (np.float32(1) + freq_norm)).astype(np.float32)
+        return cls(term_ids, idf, tf, k1=k1, b=b, language=language)
+
+    def query_matrix(self, queries):
+        """[queries, terms] matrix of the IDFs of the query terms, weighted by their count."""
+        import scipy.sparse
+
+        rows, cols = [], []
+        for query_id, query in enumerate(queries):
+            for term in analyze(query, self.language):
+                term_id = self.term_ids.get(term)
+                if term_id is not None:
+                    rows.append(query_id)
+                    cols.append(term_id)
+        counts = scipy.sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(queries), len(self.term_ids))
+        )
+        counts.sum_duplicates()
+        return counts.multiply(self.idf[np.newaxis, :]).tocsr().astype(np.float32)
+
+    def search(self, queries, k, batch_size=512):
+        """Returns, for each query, the indexes of its top `k` documents (those that
+        contain at least one query term), best first.
+
+        :return: list[np.ndarray]
+        """
+        results = []
+        for start in range(0, len(queries), batch_size):
+            scores = self.query_matrix(queries[start:start + batch_size]) @ self.doc_weights
+            for i in range(scores.shape[0]):
+                row = slice(scores.indptr[i], scores.indptr[i + 1])
+                doc_ids, doc_scores = scores.indices[row], scores.data[row]
+                # by decreasing score, then by position in the collection
+                order = np.lexsort((doc_ids, -doc_scores))[:k]
+                results.append(doc_ids[order])
+        return results
+
+    def save(self, path):
+        """Saves the index to a .npz file, atomically."""
+        dirname = os.path.dirname(path) or "."
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".bm25_", suffix=".npz")
+        terms = sorted(self.term_ids, key=self.term_ids.get)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                # terms are made of word characters, so they never contain newlines
+                terms=np.array(["\n".join(terms)]),
+                idf=self.idf,
+                data=self.doc_weights.data,
+                indices=self.doc_weights.indices,
+                indptr=self.doc_weights.indptr,
+                shape=np.array(self.doc_weights.shape),
+                params=np.array([json.dumps({"k1": self.k1, "b": self.b, "language": self.language})]),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        import scipy.sparse
+
+        with np.load(path) as arrays:
+            terms = str(arrays["terms"][0]).split("\n") if arrays["terms"][0] else []
+            doc_weights = scipy.sparse.csr_matrix(
+                (arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(arrays["shape"])
+            )
+            params = json.loads(str(arrays["params"][0]))
+            return cls({term: i for i, term in enumerate(terms)}, arrays["idf"], doc_weights, **params)
+
+
+def cache_key(texts, k1=0.9, b=0.4, language="pt"):
+    hsh = hashlib.sha256(f"{VERSION}:{k1}:{b}:{language}".encode("utf-8"))
+    for text in texts:
+        hsh.update(text.encode("utf-8"))
+        hsh.update(b"\0")
+    return hsh.hexdigest()[:16]
+
+
+class PyseriniIndex:
+    """pyserini (Lucene) index of a collection of texts, with the `search` of
+    `BM25Index`. It is how the `dynamic-similar` examples were selected before
+    `BM25Index`, and the reference it is validated against (scripts/validate_bm25.py).
+    """
+
+    def __init__(self, path, k1=0.9, b=0.4, language="pt"):
+        """Use `PyseriniIndex.build` or `PyseriniIndex.load`."""
+        from pyserini.search.lucene import LuceneSearcher
+
+        self.searcher = LuceneSearcher(path)
+        self.searcher.set_language(language)
+        self.searcher.set_bm25(k1, b)
+
+    @classmethod
+    def build(cls, texts, path, k1=0.9, b=0.4, language="pt"):
+        """Indexes `texts` in the directory `path` with pyserini, whose doc ids are
+        the positions of the texts."""
+        dirname = os.path.dirname(path) or "."
+        os.makedirs(dirname, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=dirname, prefix=".pyserini_")
+        try:
+            collection_dir = os.path.join(tmp_dir, "collection")
+            os.makedirs(collection_dir)
+            with open(os.path.join(collection_dir, "documents.json"), "w") as f:
+                json.dump([{"id": str(i), "contents": text} for i, text in enumerate(texts)], f)
+            subprocess.run(
+                [
+                    sys.executable, "-m", "pyserini.index.lucene",
+                    "--collection", "JsonCollection",
+                    "--input", collection_dir,
+                    "--language", language,
+                    "--index", os.path.join(tmp_dir, "index"),
+                    "--generator", "DefaultLuceneDocumentGenerator",
+                    "--threads", "1",
+                ],
+                check=True,
+            )
+            os.replace(os.path.join(tmp_dir, "index"), path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return cls(path, k1=k1, b=b, language=language)
+
+    @classmethod
+    def load(cls, path, k1=0.9, b=0.4, language="pt"):
+        return cls(path, k1=k1, b=b, language=language)
+
+    def search(self, queries, k, batch_size=None):
+        """Returns, for each query, the indexes of its top `k` documents, best first.
+
+        :return: list[list[int]]
+        """
+        return [[int(hit.docid) for hit in self.searcher.search(query, k=k)] for query in queries]
+
+
+def load_or_build(texts, index_dir, k1=0.9, b=0.4, language="pt"):
+    """Returns the index of `texts`, from `index_dir` if it was already built there.
+    A `PyseriniIndex` when `BACKEND` is "pyserini", a `BM25Index` otherwise."""
+    if BACKEND == "pyserini":
+        path = os.path.join(index_dir, f"pyserini_{cache_key(texts, k1, b, language)}")
+        if os.path.exists(path):
+            return PyseriniIndex.load(path, k1=k1, b=b, language=language)
+        return PyseriniIndex.build(texts, path, k1=k1, b=b, language=language)
+    path = os.path.join(index_dir, f"bm25_{cache_key(texts, k1, b, language)}.npz")
+    if os.path.exists(path):
+        return BM25Index.load(path)
+    index = BM25Index.build(texts, k1=k1, b=b, language=language)
+    index.save(path)
+    return index
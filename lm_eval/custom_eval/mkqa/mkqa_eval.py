@@ -12,6 +12,8 @@
 # 2 - small changes to get example_ids from predictions intead of getting from 
 # gold_annotations. This is necessary for evaluating with limit.
 # 3 - remove main function and out_dir evaluate argument.
+# 4 - add the languages argument of read_annotations, and evaluate_single_pass,
+# which computes the same metrics as evaluate in a single vectorized pass.
 
 import argparse
 import collections
@@ -117,11 +119,12 @@ def parse_args():
     return parser.parse_args()
 
 
-def read_annotations(gold_path: str) -> Dict[str, Any]:
+def read_annotations(gold_path: str, languages: List[str] = MKQA_LANGUAGES) -> Dict[str, Any]:
     """Read mkqa gold annotation for all languages
 
     Args:
         gold_path: path to mkqa annotation file, such as mkqa.jsonl.gz
+        languages: (Optional) languages to read, all of them by default
 
     Returns:
         A mapping from example id to MKQAAnnotation for all languages
@@ -134,7 +137,7 @@ def read_annotations(gold_path: str) -> Dict[str, Any]:
         for line in input_file:
             example = json.loads(line)
 
-            for language in MKQA_LANGUAGES:
+            for language in languages:
                 valid_answers, answer_types = [], []
                 for answer in example["answers"][language]:
                     # Binary (Yes/No) answer text is always "yes" / "no"
@@ -348,3 +351,90 @@ def evaluate(
         print(json.dumps(metrics, indent=4))
 
     return metrics
+
+
+def normalize_annotations(
+    annotations: Dict[str, MKQAAnnotation], language: str
+) -> Dict[str, List]:
+    """Normalizes the gold answers of every example once, for evaluate_single_pass.
+
+    Returns:
+        A mapping from example id to the output of eval_util.normalize_gold_answers
+    """
+    return {
+        ex_id: eval_util.normalize_gold_answers(annotation.answers, language)
+        for ex_id, annotation in annotations.items()
+    }
+
+
+def _mean_percent(scores: np.ndarray) -> float:
+    # same as round(100.0 * np.mean(...), 2), which is nan for no scores
+    if len(scores) == 0:
+        return float("nan")
+    return float(round(100.0 * np.mean(scores), 2))
+
+
+def evaluate_single_pass(
+    annotations: Dict[str, MKQAAnnotation],
+    predictions: Dict[str, MKQAPrediction],
+    language: str,
+    normalized_answers: Optional[Dict[str, List]] = None,
+) -> Dict[str, float]:
+    """Computes the same metrics as `evaluate`, in a single pass: each prediction is
+    normalized once for both EM and F1, and the best threshold and all the metrics at
+    that threshold are computed with numpy.
+
+    Args:
+        annotations: a mapping from example id to corresponding MKQAAnnotation
+        predictions: a mapping from example id to corresponding MKQAPrediction
+        language: language code in MKQA_LANGUAGES
+        normalized_answers: (Optional) output of normalize_annotations, to reuse
+            the normalized gold answers across evaluations
+
+    Returns:
+        best_em, best_f1, best_answerable_em, best_answerable_f1,
+        best_unanswerable_em and best_f1_threshold
+    """
+    assert language in MKQA_LANGUAGES
+    if normalized_answers is None:
+        normalized_answers = normalize_annotations(annotations, language)
+
+    num_examples = len(predictions)
+    em = np.empty(num_examples)
+    f1 = np.empty(num_examples)
+    has_prediction = np.empty(num_examples, dtype=bool)
+    no_answer_probs = np.empty(num_examples)
+    answerable = np.empty(num_examples, dtype=bool)
+    for i, (ex_id, prediction) in enumerate(predictions.items()):
+        predict_text = prediction.binary_answer or prediction.prediction
+        em[i], f1[i] = eval_util.compute_em_f1(predict_text, normalized_answers[ex_id], language)
+        has_prediction[i] = bool(predict_text)
+        no_answer_probs[i] = prediction.no_answer_prob
+        answerable[i] = annotations[ex_id].answers != [""]
+
+    # Same as eval_util.compute_best_score_and_threshold: starting with every example
+    # predicted as No Answer, answer the examples by increasing no answer probability.
+    # The scores are accumulated in the same order, so they match to the last bit.
+    order = np.argsort(no_answer_probs, kind="stable")
+    score_diffs = np.where(answerable, f1, np.where(has_prediction, -1.0, 0.0))[order]
+    start_score = np.count_nonzero(~answerable)
+    cumulative_scores = np.cumsum(np.concatenate([[float(start_score)], score_diffs]))[1:]
+    best = int(np.argmax(cumulative_scores)) if num_examples else 0
+    if num_examples and cumulative_scores[best] > start_score:
+        best_score, f1_threshold = cumulative_scores[best], no_answer_probs[order][best]
+    else:
+        best_score, f1_threshold = start_score, 0.0
+
+    # Same as eval_util.apply_no_answer_threshold
+    pred_no_answer = no_answer_probs > f1_threshold
+    best_em = np.where(pred_no_answer, (~answerable).astype(float), em)
+    best_f1 = np.where(pred_no_answer, (~answerable).astype(float), f1)
+
+    return {
+        "best_em": _mean_percent(best_em),
+        "best_f1": float(round(100.0 * best_score / num_examples, 2)),
+        "best_answerable_em": _mean_percent(best_em[answerable]),
+        "best_answerable_f1": _mean_percent(best_f1[answerable]),
+        "best_unanswerable_em": _mean_percent(best_em[~answerable]),
+        "best_f1_threshold": float(round(f1_threshold, 2)),
+    }
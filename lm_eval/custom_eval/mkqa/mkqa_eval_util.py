@@ -9,6 +9,8 @@
 #
 # We just did small changes:
 # 1 - remove plots
+# 2 - add normalize_gold_answers and compute_em_f1, which give the same scores as
+# map_em_value and map_f1_value normalizing each text only once
 
 import collections
 import os
@@ -196,6 +198,42 @@ def compute_max_score_over_answers(metric_fn, prediction, ground_truths, languag
     return max(scores_by_answer)
 
 
+def normalize_gold_answers(gold_answers, lang):
+    """Normalizes the gold answers of an example, for compute_em_f1."""
+    normalized = []
+    for gold_answer in gold_answers:
+        norm_answer = normalize_answer_by_language(gold_answer, lang)
+        gold_toks = norm_answer.split()
+        normalized.append((norm_answer, gold_toks, Counter(gold_toks)))
+    return normalized
+
+
+def compute_em_f1(prediction, normalized_gold_answers, lang):
+    """Same as (map_em_value, map_f1_value), with the gold answers normalized by
+    normalize_gold_answers, and the prediction normalized once for both metrics."""
+    assert len(normalized_gold_answers) > 0, "Gold truth answers list should never be empty."
+    norm_pred = normalize_answer_by_language(prediction, lang)
+    pred_toks = norm_pred.split()
+    pred_counter = Counter(pred_toks)
+
+    em_value, f1_value = 0, 0
+    for norm_answer, gold_toks, gold_counter in normalized_gold_answers:
+        em_value = max(em_value, int(norm_pred == norm_answer))
+
+        # same as calculate_f1
+        num_common = sum((gold_counter & pred_counter).values())
+        if len(gold_toks) == 0 or len(pred_toks) == 0:
+            f1 = int(gold_toks == pred_toks)
+        elif num_common == 0:
+            f1 = 0.0
+        else:
+            recall = 1.0 * num_common / len(gold_toks)
+            precision = 1.0 * num_common / len(pred_toks)
+            f1 = (2.0 * precision * recall) / (precision + recall)
+        f1_value = max(f1_value, f1)
+    return float(em_value), float(f1_value)
+
+
 def compute_best_score_and_threshold(
     predictions, scores, no_answer_probs, qid_has_answer
 ) -> Dict[str, float]:
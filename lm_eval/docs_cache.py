@@ -0,0 +1,223 @@
+"""Persistent cache of the preprocessed docs of the tasks.
+
+Tasks with `CACHE_DOCS = True` save the splits of `self.dataset`, as built by their
+`download`, to Arrow files. Later runs load them from there, instead of downloading,
+parsing and filtering the source data again. An entry is keyed by the task class,
+its VERSION, the source code of the task, the contents of its source files (see
+`Task.docs_cache_sources`) and the version of its remote data, e.g. the commit of a
+Hugging Face Hub dataset (see `Task.docs_cache_version`), so it is rebuilt whenever
+any of them changes.
+
+Splits that were `datasets.Dataset`s are memory-mapped from the cache. Splits that
+were lists of docs are loaded back as lists: docs with a regular structure are stored
+as Arrow columns, the others as one JSON document per row.
+"""
+import collections
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+
+
+DOCS_CACHE_DIR = os.environ.get("LM_EVAL_DOCS_CACHE_DIR", os.path.join("data", "docs_cache"))
+# set LM_EVAL_DOCS_CACHE=0 to always rebuild the docs
+ENABLED = os.environ.get("LM_EVAL_DOCS_CACHE", "1") != "0"
+# set LM_EVAL_DOCS_CACHE_REFRESH=1 to ask the Hub for the latest commit of the datasets
+# already downloaded, see `hub_revision`
+REFRESH = os.environ.get("LM_EVAL_DOCS_CACHE_REFRESH", "0") == "1"
+
+METADATA_FILE = "docs_cache.json"
+
+
+def _hash_file(hsh, path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hsh.update(chunk)
+
+
+def _source_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.exists(path):
+            yield path
+
+
+def hub_revision(path, revision=None, refresh=None):
+    """Returns the commit of a dataset of the Hugging Face Hub: the one of its local
+    copy, or when there is none (or when refreshing), the one from the Hub. None if it
+    can't be known.
+
+    :param revision: str, optional
+        Branch, tag or commit of the dataset, "main" by default
+    :param refresh: bool, optional
+        Whether to ask the Hub even if the dataset was downloaded. `REFRESH` by default
+    """
+    from huggingface_hub import HfApi, constants
+
+    revision = revision or "main"
+    if refresh is None:
+        refresh = REFRESH
+    ref_path = os.path.join(
+        constants.HF_HUB_CACHE, f"datasets--{path.replace('/', '--')}", "refs", revision
+    )
+    if not refresh and os.path.exists(ref_path):
+        with open(ref_path) as f:
+            return f.read().strip()
+    if not constants.HF_HUB_OFFLINE:
+        try:
+            return HfApi().dataset_info(path, revision=revision).sha
+        except Exception as e:
+            print(f"WARNING: unable to get the revision of the dataset {path} from the Hub: {e!r}")
+    if os.path.exists(ref_path):
+        with open(ref_path) as f:
+            return f.read().strip()
+    return None
+
+
+def cache_key(task, data_dir=None, version=""):
+    """Hash of everything the preprocessed docs of `task` depend on.
+
+    :param version: str
+        Version of the remote data of the task, see `Task.docs_cache_version`
+    """
+    hsh = hashlib.sha256()
+    hsh.update(
+        f"{type(task).__module__}.{type(task).__qualname__}:{task.VERSION}:{data_dir}:"
+        f"{task.DATASET_PATH}:{task.DATASET_NAME}:{version}".encode("utf-8")
+    )
+    # code of the task, including the classes it inherits from
+    for cls in type(task).__mro__:
+        if cls.__module__.startswith("lm_eval"):
+            try:
+                hsh.update(inspect.getsource(cls).encode("utf-8"))
+            except (OSError, TypeError):
+                # no source available, e.g. classes created at runtime
+                hsh.update(cls.__qualname__.encode("utf-8"))
+    for path in _source_files(task.docs_cache_sources()):
+        hsh.update(path.encode("utf-8"))
+        _hash_file(hsh, path)
+    return hsh.hexdigest()[:16]
+
+
+def _entry_dir(task, key):
+    return os.path.join(DOCS_CACHE_DIR, f"{type(task).__name__}_{key}")
+
+
+def load(task, key):
+    """Returns the cached `dataset` of the task, or None if it is not cached."""
+    import datasets
+
+    entry_dir = _entry_dir(task, key)
+    metadata_path = os.path.join(entry_dir, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+
+    splits = {}
+    for split, kind in metadata["splits"].items():
+        dataset = datasets.load_from_disk(os.path.join(entry_dir, split))
+        if kind == "dataset":
+            splits[split] = dataset
+        elif kind == "list":
+            splits[split] = dataset.to_list()
+        else:
+            splits[split] = [json.loads(doc) for doc in dataset["doc"]]
+
+    if metadata["container"] == "DatasetDict":
+        return datasets.DatasetDict(splits)
+    return collections.defaultdict(list, splits)
+
+
+def _to_arrow(docs):
+    """Converts a list of docs to a Dataset, returning (dataset, kind), or (None,
+    None) if the docs can't be stored exactly."""
+    import datasets
+
+    try:
+        dataset = datasets.Dataset.from_list(docs)
+        # Arrow needs a single schema: e.g. keys missing from some docs come back as
+        # None, so docs are only stored as columns if they come back unchanged
+        if dataset.to_list() == docs:
+            return dataset, "list"
+    except Exception:
+        pass
+
+    try:
+        rows = [json.dumps(doc, ensure_ascii=False) for doc in docs]
+        if [json.loads(row) for row in rows] == docs:
+            return datasets.Dataset.from_dict({"doc": rows}), "json"
+    except (TypeError, ValueError):
+        pass
+    return None, None
+
+
+def save(task, key, dataset):
+    """Saves the `dataset` of the task. Returns whether it could be cached."""
+    import datasets
+
+    entry_dir = _entry_dir(task, key)
+    if os.path.exists(os.path.join(entry_dir, METADATA_FILE)):
+        return True
+
+    os.makedirs(DOCS_CACHE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=DOCS_CACHE_DIR, prefix=".tmp_")
+    try:
+        metadata = {
+            "task": type(task).__name__,
+            "version": task.VERSION,
+            "container": "DatasetDict" if isinstance(dataset, datasets.DatasetDict) else "dict",
+            "splits": {},
+        }
+        for split, docs in dataset.items():
+            if isinstance(docs, datasets.Dataset):
+                kind = "dataset"
+            else:
+                docs, kind = _to_arrow(list(docs))
+                if docs is None:
+                    print(f"WARNING: the {split} docs of {type(task).__name__} can't be stored as Arrow, they are not cached")
+                    return False
+            docs.save_to_disk(os.path.join(tmp_dir, split))
+            metadata["splits"][split] = kind
+
+        with open(os.path.join(tmp_dir, METADATA_FILE), "w") as f:
+            json.dump(metadata, f, indent=2)
+        try:
+            # atomic, so other processes never see a partial entry
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # saved at the same time by another process
+            pass
+        return True
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def download_cached(task, data_dir=None, cache_dir=None, download_mode=None):
+    """Sets `task.dataset` from the cache, or calls `task.download` and caches the result."""
+    if not ENABLED:
+        task.download(data_dir, cache_dir, download_mode)
+        return
+
+    version = task.docs_cache_version()
+    if version is None:
+        print(f"WARNING: unknown version of the data of {type(task).__name__}, its docs are not cached")
+        task.download(data_dir, cache_dir, download_mode)
+        return
+
+    # the source files may only exist once downloaded
+    key = cache_key(task, data_dir, version)
+    dataset = load(task, key)
+    if dataset is not None:
+        print(f"Loading the preprocessed docs of {type(task).__name__} from {_entry_dir(task, key)}")
+        task.dataset = dataset
+        return
+
+    task.download(data_dir, cache_dir, download_mode)
+    save(task, cache_key(task, data_dir, version), task.dataset)
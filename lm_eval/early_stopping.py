@@ -0,0 +1,99 @@
+import lm_eval.metrics
+
+
+# z-score of the confidence interval checked against the targets (95%)
+Z_95 = 1.96
+
+
+class EarlyStopper:
+    """Decides when the evaluation of a (task, prompt_mode) can stop because its
+    metrics are known precisely enough.
+
+    Docs are evaluated in rounds, in the (seeded, shuffled) doc order of the
+    evaluator. After each round, the half-width of the 95% confidence interval of
+    every metric that has a stderr is compared with the target of the task; once
+    all of them are within the target, the remaining docs are not evaluated.
+
+    No task stops before `min_docs` docs: the stderr of the first rounds is itself a
+    noisy estimate, and is 0 when all their docs got the same score (e.g. a first
+    round answered all right or all wrong), which would meet any target.
+
+    Checking the interval after every round and stopping at the first round that
+    meets the target (optional stopping) makes the final interval narrower than it
+    really is: the runs that stop are more likely the ones whose variance happened
+    to be underestimated, so the actual coverage of the reported ±target is below
+    95%, and it drops as the number of checks grows. Use a larger `round_size`
+    (fewer checks) or a smaller target when the interval must hold at 95%.
+    """
+
+    # bootstrap iterations used to estimate the stderr of bootstrapped metrics
+    # after each round; the final results use the evaluator's bootstrap_iters
+    CHECK_BOOTSTRAP_ITERS = 1000
+
+    def __init__(self, task_dict, target, round_size=100, min_docs=200):
+        """
+        :param task_dict: dict[str, Task]
+        :param target: Union[float, dict[str, float]]
+            Target half-width of the confidence interval, in metric units (e.g. 0.01
+            for ±1 point of accuracy). A dict gives the target of each task; tasks
+            missing from it are evaluated entirely
+        :param round_size: int
+            Number of docs evaluated between two checks
+        :param min_docs: int
+            Number of docs a task is evaluated on before it can be stopped
+        """
+        self.task_dict = task_dict
+        self.target = target
+        self.round_size = round_size
+        self.min_docs = min_docs
+        self.stopped = set()
+        # (task, prompt_mode) pairs without any metric to check
+        self.unchecked = set()
+
+    def get_target(self, task_name):
+        if isinstance(self.target, dict):
+            return self.target.get(task_name)
+        return self.target
+
+    def is_stopped(self, task_name, prompt_mode):
+        return (task_name, prompt_mode) in self.stopped
+
+    def check(self, task_name, prompt_mode, store):
+        """Checks the confidence intervals of the metric items evaluated so far,
+        marking the (task, prompt_mode) as stopped if all of them meet the target.
+
+        :param store: lm_eval.spill.SpillingItemStore
+            Per-doc metric items of the run
+        """
+        target = self.get_target(task_name)
+        if target is None or self.is_stopped(task_name, prompt_mode) or (task_name, prompt_mode) in self.unchecked:
+            return
+
+        aggregations = self.task_dict[task_name].aggregation()
+        half_widths = {}
+        num_docs = 0
+        for key in store.keys:
+            if key[:2] != (task_name, prompt_mode) or key[2] not in aggregations:
+                continue
+            stderr = lm_eval.metrics.stderr_for_metric(
+                metric=aggregations[key[2]], bootstrap_iters=self.CHECK_BOOTSTRAP_ITERS,
+            )
+            if stderr is None:
+                continue
+            items = store.items(key)
+            num_docs = len(items)
+            half_widths[key[2]] = Z_95 * stderr(items)
+
+        if not half_widths:
+            print(f"WARNING: {task_name} ({prompt_mode}) has no metric with a stderr, it will not be stopped early")
+            self.unchecked.add((task_name, prompt_mode))
+            return
+
+        status = ", ".join(f"{metric} ±{half_width:.4f}" for metric, half_width in half_widths.items())
+        if num_docs < self.min_docs:
+            print(f"{task_name} ({prompt_mode}): {num_docs} docs, {status} (at least {self.min_docs} docs before stopping)")
+        elif all(half_width <= target for half_width in half_widths.values()):
+            print(f"{task_name} ({prompt_mode}): target ±{target} met after {num_docs} docs ({status}), stopping")
+            self.stopped.add((task_name, prompt_mode))
+        else:
+            print(f"{task_name} ({prompt_mode}): {num_docs} docs, {status}")
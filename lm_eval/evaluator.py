@@ -1,14 +1,25 @@
 import collections
+import hashlib
 import itertools
+import multiprocessing
 import pathlib
+import pickle
 import random
 import lm_eval.metrics
 import lm_eval.models
+import lm_eval.models.replay
 import lm_eval.tasks
 import lm_eval.base
+import lm_eval.spill
+import lm_eval.journal
+import lm_eval.early_stopping
+import lm_eval.anchors
+import lm_eval.pipeline
+import lm_eval.sample_logger
+import lm_eval.fewshot_manifest
+from lm_eval import profiling
 import numpy as np
-import os
-import json
+from lm_eval import utils
 from lm_eval.utils import positional_deprecated, run_task_tests
 from tqdm import tqdm
 
@@ -19,7 +30,11 @@ def simple_evaluate(model, model_args=None, tasks=[],
                     limit=None, bootstrap_iters=100000,
                     description_dict=None, conversation_template=None,
                     prompt_as_single_user_message=False,
-                    check_integrity=False, output_dir=None):
+                    check_integrity=False, output_dir=None,
+                    stream_window=None, max_memory_mb=None, spill_dir=None,
+                    run_dir=None, pipeline_depth=None, fewshot_seed=None, context_workers=None,
+                    shard=None, partial_output=None, ci_target=None, ci_round_size=100, ci_min_docs=200, anchors=None,
+                    task_workers=1, fewshot_manifest=None, fit_fewshot=False):
     """Instantiate and evaluate a model on a list of tasks.
 
     :param model: Union[str, LM]
@@ -47,6 +62,43 @@ def simple_evaluate(model, model_args=None, tasks=[],
         Whether to run the relevant part of the test suite for the tasks
     :param output_dir: str
         Directory to save results to
+    :param stream_window: int, optional
+        Number of docs sent to the LM at a time. See `evaluate`
+    :param max_memory_mb: float, optional
+        Memory threshold above which metric items are spilled to disk. See `evaluate`
+    :param spill_dir: str, optional
+        Directory used to spill metric items
+    :param run_dir: str, optional
+        Directory of the run journal. Requests and docs already recorded there for
+        the same run config are not evaluated again
+    :param pipeline_depth: int, optional
+        If set, tasks are loaded and contexts are built in the background while the
+        LM runs the previous task. See `evaluate`
+    :param fewshot_seed: int, optional
+        Seed of the per-doc few-shot generators. See `evaluate`
+    :param context_workers: int, optional
+        Number of processes used to build the contexts. Requires `fewshot_seed`
+    :param shard: tuple[int, int], optional
+        (shard index, number of shards) of the docs to evaluate. See `evaluate`
+    :param partial_output: str, optional
+        File where the partial results of the shard are saved. See `evaluate`
+    :param ci_target: Union[float, dict[str, float]], optional
+        Target half-width of the confidence interval of the metrics, for early stopping. See `evaluate`
+    :param ci_round_size: int
+        Number of docs of a task evaluated between two early stopping checks
+    :param ci_min_docs: int
+        Number of docs of a task evaluated before it can be stopped early
+    :param anchors: dict, optional
+        Anchor docs to evaluate instead of all the docs, for a quick estimate. See `evaluate`
+    :param task_workers: int
+        Number of tasks instantiated concurrently, see lm_eval.tasks.get_task_dict and
+        lm_eval.pipeline.TaskPrefetcher
+    :param fewshot_manifest: str, optional
+        Few-shot manifest file, read if it exists and completed with the examples
+        selected during the run. See lm_eval.fewshot_manifest
+    :param fit_fewshot: bool
+        Whether to drop the few-shot examples of the contexts that don't fit in the
+        max length of the model. See `evaluate`
     :return
         Dictionary of results
     """
@@ -67,7 +119,10 @@ def simple_evaluate(model, model_args=None, tasks=[],
         assert isinstance(model, lm_eval.base.LM)
         lm = model
 
-    if not no_cache:
+    token_budget = lm_eval.base.TokenBudget.from_lm(lm) if fit_fewshot else None
+
+    # replayed responses are already stored, there is nothing to cache
+    if not no_cache and not isinstance(lm, lm_eval.models.replay.ReplayLM):
         lm = lm_eval.base.CachingLM(
             lm, 'lm_cache/' + model + '_' + model_args.replace('=', '-').replace(',', '_').replace('/', '-') + '.db'
         )
@@ -79,15 +134,57 @@ def simple_evaluate(model, model_args=None, tasks=[],
     
     print(f"Selected Model is a {model_category}")
 
-    task_dict = lm_eval.tasks.get_task_dict(tasks)
-    
-    # let each task know what kind of model we are using for inference
-    for task in task_dict.values():
-        task.set_inference_model_category(model_category)
+    # tasks that failed to load, the others are evaluated anyway
+    task_load_errors = {}
+    if pipeline_depth:
+        # tasks are instantiated in the background, a couple of tasks ahead of the evaluation
+        task_dict = lm_eval.pipeline.TaskPrefetcher(
+            lm_eval.tasks.get_task_loaders(tasks),
+            on_load=lambda task: task.set_inference_model_category(model_category),
+            # enough tasks scheduled ahead to keep the `task_workers` busy
+            ahead=max(2, task_workers - 1),
+            num_workers=task_workers,
+            errors=task_load_errors,
+        )
+        # iterating would wait for every task to load
+        task_names = list(task_dict.names)
+    else:
+        with profiling.span("load_tasks"):
+            task_dict = lm_eval.tasks.get_task_dict(tasks, num_workers=task_workers, errors=task_load_errors)
+
+        # let each task know what kind of model we are using for inference
+        for task in task_dict.values():
+            task.set_inference_model_category(model_category)
+        task_names = list(task_dict.keys())
 
     if check_integrity:
         run_task_tests(task_list=tasks)
 
+    journal = None
+    if run_dir:
+        journal = lm_eval.journal.RunJournal(run_dir, config={
+            "model": model if isinstance(model, str) else type(model).__name__,
+            "model_args": model_args,
+            "tasks": task_names,
+            "num_fewshot": num_fewshot,
+            "prompt_modes": prompt_modes,
+            "limit": limit,
+            "description_dict": description_dict,
+            "conversation_template": conversation_template,
+            "prompt_as_single_user_message": prompt_as_single_user_message,
+            "fewshot_seed": fewshot_seed,
+            "shard": shard,
+            "ci_target": ci_target,
+            "ci_round_size": ci_round_size,
+            "ci_min_docs": ci_min_docs,
+            "anchors": anchors,
+            "fit_fewshot": fit_fewshot,
+        })
+
+    manifest = None
+    if fewshot_manifest:
+        manifest = lm_eval.fewshot_manifest.FewShotManifest(fewshot_manifest, num_fewshot)
+
     results = evaluate(
         lm=lm,
         task_dict=task_dict,
@@ -98,8 +195,28 @@ def simple_evaluate(model, model_args=None, tasks=[],
         conversation_template=conversation_template,
         prompt_as_single_user_message=prompt_as_single_user_message,
         output_dir=output_dir,
+        stream_window=stream_window,
+        max_memory_mb=max_memory_mb,
+        spill_dir=spill_dir,
+        journal=journal,
+        pipeline_depth=pipeline_depth,
+        fewshot_seed=fewshot_seed,
+        context_workers=context_workers,
+        shard=shard,
+        partial_output=partial_output,
+        ci_target=ci_target,
+        ci_round_size=ci_round_size,
+        ci_min_docs=ci_min_docs,
+        anchors=anchors,
+        fewshot_manifest=manifest,
+        token_budget=token_budget,
     )
 
+    if journal is not None:
+        journal.close()
+    if pipeline_depth:
+        task_dict.close()
+
     # add info about the model and few shot config
     results["config"] = {
         "model": model,
@@ -110,30 +227,454 @@ def simple_evaluate(model, model_args=None, tasks=[],
         "no_cache": no_cache,
         "limit": limit,
         "bootstrap_iters": bootstrap_iters,
+        "stream_window": stream_window,
+        "pipeline_depth": pipeline_depth,
+        "fewshot_seed": fewshot_seed,
+        "shard": shard,
+        "ci_target": ci_target,
+        "ci_round_size": ci_round_size,
+        "ci_min_docs": ci_min_docs,
+        "quick": anchors is not None,
+        "fewshot_manifest": fewshot_manifest,
+        "fit_fewshot": fit_fewshot,
     }
+    if task_load_errors:
+        results["task_load_errors"] = {task_name: repr(e) for task_name, e in task_load_errors.items()}
 
     return results
 
 
-def write_sample(output_dir, task_name, prompt_mode, doc_id, pred, req_obj, metrics):
-    with open(os.path.join(output_dir, f"{task_name}_{prompt_mode}_samples.txt"), "a", encoding="utf-8") as f:
-        f.write("*" * 50)
-        f.write(f"doc_id: {doc_id}\n")
-        f.write("------------------------prompt------------------------------------\n")
+def get_description(task_name, description_dict):
+    description = ""
+    if description_dict:
+        if task_name in description_dict:
+            description = description_dict[task_name]
+        elif task_name.replace("_greedy", "") in description_dict:
+            description = description_dict[task_name.replace("_greedy", "")]
+    return description
+
+
+def get_task_docs(task, limit=None):
+    """Returns the docs that will be evaluated for `task`, deterministically shuffled
+    and chopped to `limit`, along with the random generator used to shuffle them.
+    The generator is later used to build the few-shot contexts, so its state must
+    be kept between docs.
+    """
+    # default to test doc, fall back to val doc if validation unavailable
+    # TODO: the test-fallback-to-val system isn't final, we should revisit it at some point
+    if task.has_test_docs():
+        task_doc_func = task.test_docs
+    elif task.has_validation_docs():
+        task_doc_func = task.validation_docs
+    else:
+        raise RuntimeError("Task has neither test_docs nor validation_docs")
+
+    # deterministically shuffle docs and chop off the first `limit` because sometimes docs are in some kind of order
+    task_docs = list(task_doc_func())
+    rnd = random.Random()
+    rnd.seed(42)
+    rnd.shuffle(task_docs)
+
+    return task_docs[:limit], rnd
+
+
+def iter_evaluable_tasks(task_dict, versions):
+    """Yields the (name, task) pairs of the tasks that have docs to evaluate, recording
+    their versions. Tasks are only accessed when reached, so a lazily loaded task dict
+    is not waited for upfront.
+    """
+    for task_name, task in task_dict.items():
+        if task.has_validation_docs() or task.has_test_docs():
+            versions[task_name] = task.VERSION
+            yield task_name, task
+
+
+def doc_rng(task_name, prompt_mode, doc_id, seed):
+    """Returns the few-shot random generator of a single doc. It only depends on the
+    doc identity and `seed`, so the context of a doc does not depend on which other
+    docs are evaluated, nor on their order.
+    """
+    digest = hashlib.sha256(f"{task_name}|{prompt_mode}|{doc_id}|{seed}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+# state of the context building processes, inherited from the parent process on fork
+_context_worker_state = {}
+
+
+def build_context(task, task_name, prompt_mode, doc_id, doc, rnd, context_kwargs, manifest=None):
+    """Builds the few-shot context of a doc, with its examples in `manifest` if they
+    are recorded there.
+
+    :return: (ctx, example_ids). `example_ids` are the ids of the selected examples
+        to add to `manifest`, None if there is no manifest or they were recorded
+    """
+    key = (task_name, prompt_mode, doc_id)
+    example_ids = manifest.get(key) if manifest is not None else None
+    with profiling.span("build_context", task=task_name):
+        if example_ids is not None:
+            fewshot_docs = [task.fewshot_example_doc(example_id) for example_id in example_ids]
+            ctx = task.fewshot_context(doc=doc, rnd=rnd, prompt_mode=prompt_mode, fewshot_docs=fewshot_docs, **context_kwargs)
+            return ctx, None
+        ctx = task.fewshot_context(doc=doc, rnd=rnd, prompt_mode=prompt_mode, **context_kwargs)
+    if manifest is None:
+        return ctx, None
+    return ctx, [task.fewshot_example_id(doc_ex) for doc_ex in task.last_fewshot_docs]
+
+
+def _build_context(job):
+    doc_id, doc = job
+    state = _context_worker_state
+    return build_context(
+        state["task"], state["task_name"], state["prompt_mode"], doc_id, doc,
+        doc_rng(state["task_name"], state["prompt_mode"], doc_id, state["fewshot_seed"]),
+        state["context_kwargs"], state["manifest"],
+    )
+
+
+def iter_contexts(task, task_name, prompt_mode, task_docs, rnd, context_kwargs, fewshot_seed=None,
+        context_workers=None, skip_doc=None, is_done=None, manifest=None):
+    """Builds the few-shot context of each doc in `task_docs`.
+
+    :param manifest: lm_eval.fewshot_manifest.FewShotManifest, optional
+        Few-shot manifest the examples are read from, and the selected ones added to
+    :yield: (doc_id, doc, ctx). `ctx` is None for the docs for which `skip_doc(key)` is
+        true. Stops as soon as `is_done()` is true
+    """
+    skip_doc = skip_doc or (lambda key: False)
+    is_done = is_done or (lambda: False)
+
+    def record(doc_id, example_ids):
+        if example_ids is not None:
+            manifest.add((task_name, prompt_mode, doc_id), example_ids)
+
+    if manifest is not None:
+        # built before forking the workers, so it is not built again in each of them
+        task.fewshot_pools()
+
+    if fewshot_seed is None:
+        # a single generator goes through all the docs in order, so the contexts
+        # of skipped docs must still be built to leave it in the right state
+        for doc_id, doc in enumerate(task_docs):
+            if is_done():
+                return
+            ctx, example_ids = build_context(task, task_name, prompt_mode, doc_id, doc, rnd, context_kwargs, manifest)
+            record(doc_id, example_ids)
+            yield doc_id, doc, (None if skip_doc((task_name, prompt_mode, doc_id)) else ctx)
+        return
+
+    jobs = [
+        (doc_id, doc) for doc_id, doc in enumerate(task_docs)
+        if not skip_doc((task_name, prompt_mode, doc_id))
+    ]
+
+    _context_worker_state.update(
+        task=task, task_name=task_name, prompt_mode=prompt_mode,
+        fewshot_seed=fewshot_seed, context_kwargs=context_kwargs, manifest=manifest,
+    )
+
+    def iter_jobs_contexts():
+        if not context_workers or len(jobs) < 2:
+            yield from map(_build_context, jobs)
+            return
+
+        # workers are forked, so they get the task (datasets, indexes) without pickling it
+        with multiprocessing.get_context("fork").Pool(context_workers) as pool:
+            chunksize = max(1, min(64, len(jobs) // (context_workers * 4)))
+            yield from pool.imap(_build_context, jobs, chunksize=chunksize)
+
+    contexts = iter_jobs_contexts()
+    next_job = 0
+    for doc_id, doc in enumerate(task_docs):
+        if is_done():
+            contexts.close()
+            return
+        if next_job < len(jobs) and jobs[next_job][0] == doc_id:
+            next_job += 1
+            ctx, example_ids = next(contexts)
+            record(doc_id, example_ids)
+            yield doc_id, doc, ctx
+        else:
+            yield doc_id, doc, None
+
+
+def iter_doc_requests(task_dict_items, prompt_modes, num_fewshot=0, limit=None, description_dict=None,
+        conversation_template=None, prompt_as_single_user_message=False, fewshot_seed=None,
+        context_workers=None, skip_doc=None, task_done=None, fewshot_manifest=None, token_budget=None):
+    """Lazily builds the few-shot context and the requests of each document.
+
+    :param fewshot_seed: int, optional
+        If set, the few-shot examples of each doc are drawn with a generator seeded
+        from (task, prompt_mode, doc_id, fewshot_seed), see `doc_rng`. Otherwise a
+        single generator is shared by all the docs of a task, in order
+    :param context_workers: int, optional
+        Number of processes building the contexts. Requires `fewshot_seed`
+    :param skip_doc: Callable[[tuple], bool], optional
+        Docs whose key it returns True for are yielded with `reqs=None`. Their
+        contexts are not built, unless required by the shared generator
+    :param task_done: Callable[[str, str], bool], optional
+        Called with (task_name, prompt_mode) before each doc. Once it returns True,
+        the remaining docs of that task and prompt mode are not yielded
+    :param fewshot_manifest: lm_eval.fewshot_manifest.FewShotManifest, optional
+        Few-shot examples of the docs. The examples of the docs missing from it are
+        selected and added to it
+    :param token_budget: lm_eval.base.TokenBudget, optional
+        If set, the contexts are fitted to this budget, see
+        PromptSelectionTask.fit_fewshot_context
+    :yield: ((task_name, prompt_mode, doc_id), doc, reqs)
+    """
+    assert not context_workers or fewshot_seed is not None, \
+        "building contexts in parallel requires a per-doc few-shot generator (fewshot_seed)"
+
+    for task_name, task in task_dict_items:
+        context_kwargs = dict(
+            num_fewshot=num_fewshot,
+            description=get_description(task_name, description_dict),
+            conversation_template=conversation_template,
+            prompt_as_single_user_message=prompt_as_single_user_message,
+        )
+        if token_budget is not None:
+            context_kwargs["token_budget"] = token_budget
+        if fewshot_manifest is not None:
+            fewshot_manifest.check_task(task_name, task.VERSION)
+
+        # the requests will be separated for each prompt_mode
+        for prompt_mode in prompt_modes:
+            task_docs, rnd = get_task_docs(task, limit)
+
+            contexts = iter_contexts(
+                task, task_name, prompt_mode, task_docs, rnd, context_kwargs,
+                fewshot_seed=fewshot_seed, context_workers=context_workers, skip_doc=skip_doc,
+                is_done=(lambda: task_done(task_name, prompt_mode)) if task_done else None,
+                manifest=fewshot_manifest,
+            )
+            for doc_id, doc, ctx in contexts:
+                if ctx is None:
+                    yield (task_name, prompt_mode, doc_id), doc, None
+                    continue
+                reqs = task.construct_requests(doc, ctx)
+                if not isinstance(reqs, (list, tuple)):
+                    reqs = [reqs]
+                yield (task_name, prompt_mode, doc_id), doc, reqs
+
+
+def iter_windows(doc_requests, window_size=None, split_tasks=False):
+    """Groups `doc_requests` into the windows of docs sent to the LM together.
+
+    :param window_size: int, optional
+        Maximum number of docs in a window. If None, windows are only bounded by
+        `split_tasks`
+    :param split_tasks: bool
+        If True, a window never mixes docs of different (task, prompt_mode) pairs
+    """
+    if split_tasks:
+        for _, task_doc_requests in itertools.groupby(doc_requests, key=lambda x: x[0][:2]):
+            yield from iter_windows(task_doc_requests, window_size)
+    elif window_size:
+        yield from utils.chunks(doc_requests, window_size)
+    else:
+        yield list(doc_requests)
+
+
+def run_requests(lm, doc_requests, on_doc_done, window_size=None, split_tasks=False, on_window_done=None):
+    """Sends the requests of `doc_requests` to the LM, `window_size` docs at a time,
+    and calls `on_doc_done(key, doc, resps, reqs)` as soon as all the requests of
+    a doc are back, and `on_window_done(window)` once all the docs of a window are done.
+
+    With `window_size=None` every request is collected before running anything,
+    which gives the LM the largest possible batches to sort and group. With
+    `split_tasks`, each (task, prompt_mode) is run separately, so that `doc_requests`
+    can keep building the next task while the LM runs.
+    """
+    for window in iter_windows(doc_requests, window_size, split_tasks=split_tasks):
+        requests = collections.defaultdict(list)
+        requests_origin = collections.defaultdict(list)
+        # key -> [doc, responses, reqs, number of missing responses]
+        pending = {}
+
+        for key, doc, reqs in window:
+            pending[key] = [doc, [None] * len(reqs), reqs, len(reqs)]
+            for i, req in enumerate(reqs):
+                requests[req.request_type].append(req)
+                # i: index in requests for a single task instance
+                requests_origin[req.request_type].append((key, i))
+
+        # execute each type of request
+        for reqtype, reqs in requests.items():
+            # TODO: right now, this code runs multiple separate LM requests for multiple Requests differing
+            #       only in index. We could implement some kind of caching, but that would be more of a band-aid
+            #       solution. we could also implement some kind of auto-grouping here;
+            #       they should end up next to each other.
+
+            task_name = None
+            if split_tasks:
+                task_name, prompt_mode, _ = window[0][0]
+                print(f"Running {reqtype} requests of {task_name} ({prompt_mode})")
+            else:
+                print("Running", reqtype, "requests")
+            for (key, _) in requests_origin[reqtype]:
+                profiling.count("requests", task=key[0])
+
+            with profiling.task_scope(task_name), profiling.span(f"lm.{reqtype}", requests=len(reqs)):
+                resps = getattr(lm, reqtype)([req.args for req in reqs])
+            resps = [x if req.index is None else x[req.index] for x, req in zip(resps, reqs)]
+
+            for resp, (key, i) in zip(resps, requests_origin[reqtype]):
+                state = pending[key]
+                state[1][i] = resp
+                state[3] -= 1
+                if state[3] == 0:
+                    doc, doc_resps, doc_reqs, _ = pending.pop(key)
+                    on_doc_done(key, doc, doc_resps, doc_reqs)
+
+        if on_window_done is not None:
+            on_window_done(window)
+
+
+def in_shard(doc_id, shard):
+    """Whether the doc belongs to `shard`, a (shard index, number of shards) tuple.
+
+    Docs are assigned by their position in the deterministically shuffled doc list,
+    so the partition is the same across runs and prompt modes.
+    """
+    if shard is None:
+        return True
+    shard_index, num_shards = shard
+    return doc_id % num_shards == shard_index
+
+
+def parse_shard(shard):
+    """Parses a shard spec of the form "i/N" into an (i, N) tuple."""
+    try:
+        shard_index, num_shards = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {shard!r}, expected the form i/N (e.g. 0/4)")
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Invalid shard {shard!r}, the shard index must be in [0, {num_shards})")
+    return shard_index, num_shards
+
+
+def skip_docs(doc_requests, journal, add_metrics, task_done=None):
+    """Filters out the docs `doc_requests` yields without requests (see `iter_doc_requests`),
+    and the docs of the tasks for which `task_done(task_name, prompt_mode)` is true.
+    The metrics of the ones already scored in the journal are restored.
+    """
+    for key, doc, reqs in doc_requests:
+        if task_done is not None and task_done(*key[:2]):
+            # e.g. built ahead by the pipeline before the task was stopped
+            continue
+        if reqs is None:
+            if journal is not None and journal.has_doc(key):
+                add_metrics(key, journal.get_doc(key))
+            continue
+        yield key, doc, reqs
+
+
+def save_partial_results(path, store, task_doc_counts, versions, prompt_modes, shard):
+    """Saves the per-doc metric items of a sharded run, to be merged with
+    `merge_partial_results`.
+    """
+    partial = {
+        "shard": shard,
+        "prompt_modes": prompt_modes,
+        "versions": dict(versions),
+        "doc_counts": dict(task_doc_counts),
+        "items": {key: store.doc_items(key) for key in store.keys},
+    }
+    with open(path, "wb") as f:
+        pickle.dump(partial, f)
+
+
+def merge_partial_results(partials, task_dict, bootstrap_iters=100000):
+    """Merges the partial results of the shards of a run (see `save_partial_results`)
+    into the results of the whole run, as if it had run in a single process.
+
+    :param partials: list[dict]
+        Partial results of every shard
+    :param task_dict: dict[str, Task]
+        Tasks of the run, used for their aggregation functions
+    """
+    num_shards = partials[0]["shard"][1]
+    shard_indexes = sorted(partial["shard"][0] for partial in partials)
+    if any(partial["shard"][1] != num_shards for partial in partials) or shard_indexes != list(range(num_shards)):
+        raise ValueError(f"Expected exactly one partial result for each of the {num_shards} shards, got shards {shard_indexes}")
+
+    store = lm_eval.spill.SpillingItemStore()
+    task_doc_counts = collections.Counter()
+    versions = {}
+    for partial in partials:
+        for key, doc_items in partial["items"].items():
+            for doc_id, value in doc_items:
+                store.add(key, doc_id, value)
+        task_doc_counts.update(partial["doc_counts"])
+        versions.update(partial["versions"])
+
+    results = aggregate_results(task_dict, store, bootstrap_iters=bootstrap_iters)
+    for task_name in task_dict:
+        for prompt_mode in partials[0]["prompt_modes"]:
+            results[task_name][prompt_mode]["num_examples"] = task_doc_counts[task_name]
+
+    return {
+        "results": {task_name: dict(res) for task_name, res in results.items()},
+        "versions": versions,
+    }
+
+
+def aggregate_results(task_dict, store, bootstrap_iters=100000):
+    """Aggregates the per-document metric items kept in `store` into the results dict."""
+    results = collections.defaultdict(lambda: collections.defaultdict(dict))
+
+    for (task_name, prompt_mode, metric) in store.keys:
+        task = task_dict[task_name]
+        try:
+            aggregation = task.aggregation()[metric]
+        except KeyError:
+            # allows tasks to not define an aggregation method for a metric
+            # useful for logging extra metrics that don't need aggregation
+            continue
+        items = store.items((task_name, prompt_mode, metric))
+        with profiling.span("aggregate", task=task_name, metric=metric):
+            results[task_name][prompt_mode][metric] = aggregation(items)
+
+        # hotfix: bleu, chrf, ter seem to be really expensive to bootstrap
+        # so we run them less iterations. still looking for a cleaner way to do this
+        stderr = lm_eval.metrics.stderr_for_metric(
+            metric=aggregation,
+            bootstrap_iters=min(bootstrap_iters, 1000) if metric in ["bleu", "chrf", "ter"] else bootstrap_iters,
+        )
+        if stderr is not None:
+            with profiling.span("stderr", task=task_name, metric=metric):
+                results[task_name][prompt_mode][metric + "_stderr"] = stderr(items)
+
+    return results
 
-        f.write(f"{req_obj.args[0]}\n")
-        f.write("--" * 10 + "Prediction" + "--" * 10 + "\n")
 
-        f.write(f"{pred}\n")
-        f.write("##" * 50 + "\n")
-        pretty_print_metrics=json.dumps(metrics, indent=4, ensure_ascii=False)
-        f.write(f"Metrics: {pretty_print_metrics}\n")
+def add_anchor_estimates(results, task_dict, store, anchors):
+    """Adds to `results` the estimates of the scores on all the docs computed from
+    the weighted results of the anchor docs."""
+    for (task_name, prompt_mode, metric) in store.keys:
+        task_anchors = anchors["tasks"].get(task_name)
+        if task_anchors is None or metric != task_anchors["metric"]:
+            continue
+        anchor_weights = dict(zip(task_anchors["anchors"], task_anchors["weights"]))
+        doc_items = store.doc_items((task_name, prompt_mode, metric))
+        results[task_name][prompt_mode][metric + "_estimate"] = lm_eval.anchors.estimate(
+            task_dict[task_name].aggregation()[metric],
+            [value for _, value in doc_items],
+            [anchor_weights[doc_id] for doc_id, _ in doc_items],
+            task_anchors["num_docs"],
+        )
+        if task_anchors.get("rmse") is not None:
+            results[task_name][prompt_mode][metric + "_estimate_error"] = task_anchors["rmse"]
 
 
 @positional_deprecated
 def evaluate(lm, task_dict, provide_description=None, num_fewshot=0, 
         prompt_modes=['dynamic-random'], limit=None, bootstrap_iters=100000, 
-        description_dict=None, conversation_template=None, prompt_as_single_user_message=False, output_dir=None
+        description_dict=None, conversation_template=None, prompt_as_single_user_message=False, output_dir=None,
+        stream_window=None, max_memory_mb=None, spill_dir=None, journal=None,
+        pipeline_depth=None, fewshot_seed=None, context_workers=None, shard=None, partial_output=None,
+        ci_target=None, ci_round_size=100, ci_min_docs=200, anchors=None, fewshot_manifest=None, token_budget=None,
     ):
     """Instantiate and evaluate a model on a list of tasks.
 
@@ -151,180 +692,175 @@ def evaluate(lm, task_dict, provide_description=None, num_fewshot=0,
         Number of iterations for bootstrap statistics
     :param description_dict: dict[str, str]
         Dictionary of custom task descriptions of the form: `task_name: description` 
+    :param output_dir: str, optional
+        Directory where the requests, responses and metrics of every doc are logged.
+        See lm_eval.sample_logger.SampleLogger
+    :param stream_window: int, optional
+        If set, requests are generated lazily and sent to the LM `stream_window` docs 
+        at a time, and each doc is scored and released as soon as its responses are back.
+        If None, all the requests are built before running the LM.
+    :param max_memory_mb: float, optional
+        Process memory (in MB) above which the per-doc metric items are spilled to disk
+    :param spill_dir: str, optional
+        Directory used to spill metric items. Defaults to the system temp dir
+    :param journal: lm_eval.journal.RunJournal, optional
+        Journal of the run. Docs already scored in the journal are not evaluated
+        again, requests already answered are not sent to the LM, and everything new
+        is recorded as soon as it completes
+    :param pipeline_depth: int, optional
+        If set, contexts and requests are built in a background thread, up to
+        `pipeline_depth` docs ahead of the LM, and the requests of each task and
+        prompt mode are run separately, so the next task is prepared while the LM
+        runs the current one. `task_dict` may then be a lm_eval.pipeline.TaskPrefetcher
+    :param fewshot_seed: int, optional
+        If set, the few-shot examples of each doc are sampled with a generator derived
+        from (task, prompt_mode, doc_id, fewshot_seed), so contexts do not depend on
+        the other docs. By default a single generator goes through the docs in order
+    :param context_workers: int, optional
+        Number of processes used to build the contexts. Requires `fewshot_seed`
+    :param shard: tuple[int, int], optional
+        (shard index, number of shards). Only the docs of this shard are evaluated,
+        see `in_shard`
+    :param partial_output: str, optional
+        File where the per-doc metric items are saved, so the results of all the
+        shards can be merged with `merge_partial_results`
+    :param ci_target: Union[float, dict[str, float]], optional
+        If set, docs are evaluated in rounds of `ci_round_size` docs, and a task stops
+        once the 95% confidence intervals of its metrics are narrower than ±ci_target
+        (a dict gives the target of each task). See lm_eval.early_stopping.EarlyStopper
+    :param ci_round_size: int
+        Number of docs of a task evaluated between two checks of `ci_target`
+    :param ci_min_docs: int
+        Number of docs of a task evaluated before it can be stopped by `ci_target`
+    :param anchors: dict, optional
+        Anchor docs of the tasks (see lm_eval.anchors and scripts/select_anchors.py).
+        Only the anchors of the tasks listed there are evaluated, and the estimate of
+        the score on all the docs is added as `<metric>_estimate`, with the error
+        measured when the anchors were selected as `<metric>_estimate_error`
+    :param fewshot_manifest: lm_eval.fewshot_manifest.FewShotManifest, optional
+        Few-shot examples of the docs, recorded by a previous run. The contexts of the
+        docs in the manifest are built with their recorded examples, without selecting
+        them, and the examples selected for the other docs are saved to it. With a
+        shared generator (no `fewshot_seed`), the docs of the manifest don't draw from
+        it, so new docs may get other examples than in a run without the manifest
+    :param token_budget: lm_eval.base.TokenBudget, optional
+        Context window of the model. The longest few-shot examples of the contexts
+        that don't fit in it, with room for their continuations or generations, are
+        dropped, instead of the contexts being truncated by the model
     :return
         Dictionary of results
     """
-    # TODO: completely refactor this entire function to not be a huge mess, ideally breaking it down into smaller pieces
-
     # TODO: todo: implement proper description-providing system
     assert not provide_description  # not implemented.
     if provide_description is not None:
         # nudge people to not specify it at all
         print("WARNING: provide_description is deprecated and will be removed in a future version in favor of description_dict")
+    sample_logger = None
     if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        for task_name in task_dict:
-            for prompt_mode in prompt_modes:
-                # remove old samples
-                if os.path.isfile(os.path.join(output_dir, f"{task_name}_{prompt_mode}_samples.txt")):
-                    os.remove(os.path.join(output_dir, f"{task_name}_{prompt_mode}_samples.txt"))
-
-    task_dict_items = [
-        (name, task)
-        for name, task in task_dict.items()
-        if(task.has_validation_docs() or task.has_test_docs())
-    ]
+        # samples of a resumed run are appended to the ones logged before the interruption
+        sample_logger = lm_eval.sample_logger.SampleLogger(
+            output_dir, append=journal is not None and bool(journal.docs)
+        )
 
-    results = collections.defaultdict(dict)
-    versions = collections.defaultdict(dict)
+    stopper = None
+    if ci_target is not None:
+        assert shard is None, "early stopping can't be used with a sharded evaluation"
+        stopper = lm_eval.early_stopping.EarlyStopper(
+            task_dict, ci_target, round_size=ci_round_size, min_docs=ci_min_docs
+        )
 
-    requests = collections.defaultdict(list)
-    requests_origin = collections.defaultdict(list)
+    anchor_docs = lm_eval.anchors.doc_filter(anchors) if anchors is not None else None
 
-    # If we ever run into issues where the eval tasks don't fit in memory and we can't afford a machine with bigger
-    # memory, we can always modify this plumbing to support that, but I didn't want to include it just yet because
-    # over-engineering is bad (or we could make it write the requests to disk and then read them back out again
-    #  - probably using an sqlite db because of all the moving parts we have
+    versions = collections.defaultdict(dict)
+    task_dict_items = iter_evaluable_tasks(task_dict, versions)
 
     # TODO: we need unit tests & sanity checks or something to ensure that the return of `validation_docs` is stable
-    docs = {}
+    doc_requests = iter_doc_requests(
+        task_dict_items,
+        prompt_modes=prompt_modes,
+        num_fewshot=num_fewshot,
+        limit=limit,
+        description_dict=description_dict,
+        conversation_template=conversation_template,
+        prompt_as_single_user_message=prompt_as_single_user_message,
+        fewshot_seed=fewshot_seed,
+        context_workers=context_workers,
+        skip_doc=lambda key: (
+            not in_shard(key[2], shard)
+            or (journal is not None and journal.has_doc(key))
+            or (anchor_docs is not None and key[0] in anchor_docs and key[2] not in anchor_docs[key[0]])
+        ),
+        task_done=stopper.is_stopped if stopper is not None else None,
+        fewshot_manifest=fewshot_manifest,
+        token_budget=token_budget,
+    )
 
-    # get lists of each type of request
-    for task_name, task in task_dict_items:
-        versions[task_name] = task.VERSION
-        # default to test doc, fall back to val doc if validation unavailable
-        # TODO: the test-fallback-to-val system isn't final, we should revisit it at some point
-        if task.has_test_docs():
-            task_doc_func = task.test_docs
-        elif task.has_validation_docs():
-            task_doc_func = task.validation_docs
-        else:
-            raise RuntimeError("Task has neither test_docs nor validation_docs")
+    store = lm_eval.spill.SpillingItemStore(max_memory_mb=max_memory_mb, spill_dir=spill_dir)
+    # number of evaluated docs for each task
+    task_doc_counts = collections.Counter()
 
-        description = ""
-        if description_dict:
-            if task_name in description_dict:
-                description = description_dict[task_name]
-            elif task_name.replace("_greedy", "") in description_dict:
-                description = description_dict[task_name.replace("_greedy", "")]
+    def add_metrics(key, metrics):
+        task_name, prompt_mode, doc_id = key
+        for metric, value in metrics.items():
+            store.add((task_name, prompt_mode, metric), doc_id, value)
+        task_doc_counts[task_name] += 1
 
-        results[task_name] = collections.defaultdict(dict)
+    def process_doc(key, doc, resps, reqs):
+        task_name, prompt_mode, doc_id = key
+        task = task_dict[task_name]
 
-        # the requests will be separated for each prompt_mode
-        for prompt_mode in prompt_modes:
+        with profiling.span("process_results", task=task_name):
+            metrics = task.process_results(doc, resps)
 
-            # deterministically shuffle docs and chop off the first `limit` because sometimes docs are in some kind of order
-            task_docs = list(task_doc_func())
-            rnd = random.Random()
-            rnd.seed(42)
-            rnd.shuffle(task_docs)
-
-            for doc_id, doc in enumerate(itertools.islice(task_docs, 0, limit)):
-                docs[(task_name, prompt_mode, doc_id)] = doc
-                ctx = task.fewshot_context(
-                    doc=doc,
-                    num_fewshot=num_fewshot,
-                    prompt_mode=prompt_mode,
-                    rnd=rnd,
-                    description=description,
-                    conversation_template=conversation_template,
-                    prompt_as_single_user_message=prompt_as_single_user_message
-                )
-                reqs = task.construct_requests(doc, ctx)
-                if not isinstance(reqs, (list, tuple)):
-                    reqs = [reqs]
-                for i, req in enumerate(reqs):
-                    requests[req.request_type].append(req)
-                    # i: index in requests for a single task instance
-                    # doc_id: unique id that we can get back to a doc using `docs`
-                    requests_origin[req.request_type].append((i, task_name, prompt_mode, doc, doc_id))
-
-    # all responses for each (task, doc)
-    process_res_queue = collections.defaultdict(list)
-    
-    # execute each type of request
-    for reqtype, reqs in requests.items():
-        # TODO: right now, this code runs multiple separate LM requests for multiple Requests differing
-        #       only in index. We could implement some kind of caching, but that would be more of a band-aid
-        #       solution. we could also implement some kind of auto-grouping here;
-        #       they should end up next to each other.
-
-        print("Running", reqtype, "requests")
-        resps = getattr(lm, reqtype)([req.args for req in reqs])
-        resps = [x if req.index is None else x[req.index] for x, req in zip(resps, reqs)]
-        
+        if sample_logger is not None:
+            sample_logger.log(task_name, prompt_mode, doc_id, reqs, resps, metrics)
 
-        for (resp, (i, task_name, prompt_mode, doc, doc_id), req) in zip(resps, requests_origin[reqtype], reqs):
-            if output_dir and reqtype == "greedy_until":
-                process_res_queue[(task_name, prompt_mode, doc_id)].append((i, resp, req, reqtype))
-            else:
-                # if output_dir is not defined or if the request is not greedy_until, we don't need to record the request object, since we are not logging it
-                process_res_queue[(task_name, prompt_mode, doc_id)].append((i, resp, None, reqtype))
-    
-    vals = collections.defaultdict(list)
+        if journal is not None:
+            journal.record_doc(key, metrics)
+        add_metrics(key, metrics)
+
+    if pipeline_depth:
+        doc_requests = lm_eval.pipeline.prefetch(doc_requests, max_size=pipeline_depth)
+
+    if journal is not None:
+        lm = lm_eval.journal.JournaledLM(lm, journal)
+    doc_requests = skip_docs(
+        doc_requests, journal, add_metrics, task_done=stopper.is_stopped if stopper is not None else None
+    )
+
+    if stopper is not None:
+        # each window is a round of a single task and prompt mode
+        def check_round(window):
+            task_name, prompt_mode, _ = window[0][0]
+            stopper.check(task_name, prompt_mode, store)
+
+        run_requests(lm, doc_requests, process_doc, window_size=ci_round_size, split_tasks=True, on_window_done=check_round)
+    else:
+        # when profiling, tasks are run separately to attribute the LM time to each of them
+        split_tasks = bool(pipeline_depth) or profiling.PROFILER.enabled
+        run_requests(lm, doc_requests, process_doc, window_size=stream_window, split_tasks=split_tasks)
+
+    if sample_logger is not None:
+        sample_logger.close()
+
+    if fewshot_manifest is not None:
+        fewshot_manifest.save()
+
+    if partial_output:
+        save_partial_results(partial_output, store, task_doc_counts, versions, prompt_modes, shard)
+
+    results = aggregate_results(task_dict, store, bootstrap_iters=bootstrap_iters)
+    if anchors is not None:
+        add_anchor_estimates(results, task_dict, store, anchors)
+    store.close()
 
-    # unpack results and sort back in order and return control to Task
-    # group by task_name, prompt_mode
-    
-    grouped_task_prompt_mode = collections.defaultdict(list)
-    
-    # grouping by task is convenient to show evaluation progress, when evaluating with llm
-    # this may take a while
-    for (task_name, prompt_mode, doc_id), requests in process_res_queue.items():
-        grouped_task_prompt_mode[(task_name, prompt_mode)].append((requests, doc_id))
-        
-    for (task_name, prompt_mode), requests in grouped_task_prompt_mode.items():
-        
-        task=task_dict[task_name]
-        
-        
-        llm_judged_task = False
-        
-        # show tqdm only for tasks that are evaluated with llm as judge
-        for request_list, doc_id in tqdm(requests, desc=f"Evaluating {task_name} {prompt_mode}", disable=not llm_judged_task):
-            
-            request_list.sort(key=lambda x: x[0])
-            
-            preds = [x[1] for x in request_list]         
-            doc = docs[(task_name, prompt_mode, doc_id)]
-            metrics = task.process_results(doc, preds)
-            
-            _, pred, req_obj, reqtype = request_list[0]
-            
-            if output_dir and reqtype=="greedy_until":
-                write_sample(output_dir, task_name, prompt_mode, doc_id, pred=pred, req_obj=req_obj, metrics=metrics)
-
-            for metric, value in metrics.items():
-                vals[(task_name, prompt_mode, metric)].append(value)
-        
-    
-    # aggregate results
-    for (task_name, prompt_mode, metric), items in vals.items():
-        task = task_dict[task_name]
-        try:
-            results[task_name][prompt_mode][metric] = task.aggregation()[metric](items)
-        except KeyError:
-            # allows tasks to not define an aggregation method for a metric
-            # useful for logging extra metrics that don't need aggregation
-            continue
-        # hotfix: bleu, chrf, ter seem to be really expensive to bootstrap
-        # so we run them less iterations. still looking for a cleaner way to do this
-        stderr = lm_eval.metrics.stderr_for_metric(
-            metric=task.aggregation()[metric],
-            bootstrap_iters=min(bootstrap_iters, 1000) if metric in ["bleu", "chrf", "ter"] else bootstrap_iters,
-        )
-        if stderr is not None:
-            results[task_name][prompt_mode][metric + "_stderr"] = stderr(items)
-    
     for task_name in task_dict:
-        # Count how many docs were actually evaluated
-        task_doc_count = len([1 for key in process_res_queue.keys() if key[0] == task_name])
         for prompt_mode in prompt_modes:
-            # Save the count in the results
-            results[task_name][prompt_mode]["num_examples"] = task_doc_count
-    
+            # Save the count of evaluated docs in the results
+            results[task_name][prompt_mode]["num_examples"] = task_doc_counts[task_name]
+
     return {
-        "results": dict(results),
+        "results": {task_name: dict(res) for task_name, res in results.items()},
         "versions": dict(versions)
     }
 
@@ -0,0 +1,120 @@
+"""Few-shot manifests: the few-shot examples of each doc of a run, recorded by id (see
+PromptSelectionTask.fewshot_example_id) for each (task, prompt_mode, doc_id).
+
+A run given a manifest builds its contexts with the examples recorded there, without
+selecting them again (random draws, balanced selection, BM25 retrieval), so all the
+models evaluated with the same manifest see exactly the same prompts. The examples of
+the docs missing from the manifest are selected as usual and added to it.
+
+The manifest is a JSON file:
+
+{
+  "version": 1,
+  "num_fewshot": 5,
+  "tasks": {
+    "<task>": {"version": 0, "docs": {"<prompt_mode>": {"<doc_id>": ["train:12", ...]}}}
+  }
+}
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+
+VERSION = 1
+
+
+class FewShotManifest:
+    def __init__(self, path, num_fewshot):
+        """
+        :param path: str
+            JSON file of the manifest, read if it exists
+        :param num_fewshot: int
+            Number of few-shot examples of the run, which must be the one of the manifest
+        """
+        self.path = path
+        self.num_fewshot = num_fewshot
+        self._lock = threading.Lock()
+        # (task_name, prompt_mode, doc_id) -> list of example ids
+        self.entries = {}
+        self.task_versions = {}
+        # entries selected during this run, not in the file yet
+        self.new_entries = {}
+        self.new_task_versions = {}
+        if os.path.exists(path):
+            entries, task_versions = self._read()
+            self.entries.update(entries)
+            self.task_versions.update(task_versions)
+
+    def _read(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        assert data["version"] == VERSION, f"unsupported few-shot manifest version {data['version']}"
+        assert data["num_fewshot"] == self.num_fewshot, (
+            f"the few-shot manifest {self.path} was recorded with num_fewshot={data['num_fewshot']}, "
+            f"not {self.num_fewshot}"
+        )
+        entries = {}
+        task_versions = {}
+        for task_name, task in data["tasks"].items():
+            task_versions[task_name] = task["version"]
+            for prompt_mode, docs in task["docs"].items():
+                for doc_id, example_ids in docs.items():
+                    entries[task_name, prompt_mode, int(doc_id)] = example_ids
+        return entries, task_versions
+
+    def check_task(self, task_name, version):
+        """Records the version of a task, warning if the examples of the manifest were
+        selected for another version."""
+        recorded = self.task_versions.get(task_name)
+        if recorded is None:
+            with self._lock:
+                self.task_versions[task_name] = version
+                self.new_task_versions[task_name] = version
+        elif recorded != version:
+            print(
+                f"WARNING: the few-shot examples of {task_name} in {self.path} were selected "
+                f"for version {recorded} of the task, not {version}"
+            )
+
+    def get(self, key):
+        """Returns the ids of the examples of a (task_name, prompt_mode, doc_id) key,
+        or None if they are not recorded."""
+        return self.entries.get(key)
+
+    def add(self, key, example_ids):
+        with self._lock:
+            self.entries[key] = example_ids
+            self.new_entries[key] = example_ids
+
+    def save(self):
+        """Adds the new entries to the file, keeping the ones other runs (e.g. the
+        other shards) added since it was read."""
+        with self._lock:
+            if not self.new_entries and not self.new_task_versions:
+                return
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dirname, exist_ok=True)
+            with open(self.path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    entries, task_versions = self._read() if os.path.exists(self.path) else ({}, {})
+                    entries.update(self.new_entries)
+                    for task_name, version in self.new_task_versions.items():
+                        task_versions.setdefault(task_name, version)
+
+                    tasks = {}
+                    for (task_name, prompt_mode, doc_id), example_ids in sorted(entries.items()):
+                        task = tasks.setdefault(task_name, {"version": task_versions.get(task_name), "docs": {}})
+                        task["docs"].setdefault(prompt_mode, {})[str(doc_id)] = example_ids
+
+                    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".fewshot_manifest_")
+                    with os.fdopen(fd, "w") as f:
+                        json.dump({"version": VERSION, "num_fewshot": self.num_fewshot, "tasks": tasks}, f, ensure_ascii=False)
+                    os.replace(tmp_path, self.path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self.new_entries = {}
+            self.new_task_versions = {}
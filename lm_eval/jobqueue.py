@@ -0,0 +1,221 @@
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """Job queue stored in a SQLite file, shared by any number of workers (processes
+    on the same machine or on nodes that mount the same file system).
+
+    A worker claims the oldest available job, holding a lease on it that it renews
+    while the job runs (see `keep_alive`). Jobs whose lease expired, because their
+    worker died, are available again, so they are reclaimed by another worker. The
+    workers run the jobs with `work`, which returns once every job is finished.
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3, timeout=60):
+        """
+        :param path: str
+            SQLite file of the queue, created if needed
+        :param lease_seconds: float
+            Time after which a job not renewed by its worker can be claimed again
+        :param max_attempts: int
+            Number of times a job is tried before it is marked as failed
+        :param timeout: float
+            Seconds to wait for the lock of the database held by another worker
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # transactions are managed explicitly, see `_transaction`
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._transaction() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, payload TEXT, status TEXT, worker TEXT, "
+                "lease_expires REAL, attempts INTEGER DEFAULT 0, error TEXT, "
+                "position INTEGER)"
+            )
+            # the worker that finalizes the queue, see `claim_finalization`
+            cur.execute("CREATE TABLE IF NOT EXISTS finalization (id INTEGER PRIMARY KEY CHECK (id = 0), worker TEXT)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            cur = self.conn.cursor()
+            # IMMEDIATE takes the write lock upfront, so two workers can't claim the same job
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+
+    def add(self, job_id, payload):
+        """Adds a job, unless a job with the same id was already added (by this or
+        another worker). Returns whether the job was added."""
+        with self._transaction() as cur:
+            cur.execute(
+                "INSERT OR IGNORE INTO jobs (id, payload, status, position) "
+                "VALUES (?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM jobs))",
+                (job_id, json.dumps(payload), PENDING),
+            )
+            return cur.rowcount > 0
+
+    def claim(self, worker_id):
+        """Claims the oldest pending job, or a running job whose lease expired. A job
+        whose lease expired after `max_attempts` attempts (e.g. one that kills its
+        workers) is marked as failed instead.
+
+        :return: (job id, payload), or None if there is no job available
+        """
+        now = time.time()
+        with self._transaction() as cur:
+            while True:
+                cur.execute(
+                    "SELECT id, payload, status, worker, attempts FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY position LIMIT 1",
+                    (PENDING, RUNNING, now),
+                )
+                row = cur.fetchone()
+                if row is None:
+                    return None
+                job_id, payload, status, previous_worker, attempts = row
+                if status != RUNNING:
+                    break
+                if attempts < self.max_attempts:
+                    print(f"WARNING: the lease of {previous_worker} on job {job_id} expired, reclaiming it")
+                    break
+                print(
+                    f"WARNING: the lease of {previous_worker} on job {job_id} expired after "
+                    f"{attempts} attempts, marking it as failed"
+                )
+                cur.execute(
+                    "UPDATE jobs SET status = ?, lease_expires = NULL, error = ? WHERE id = ?",
+                    (FAILED, f"lease of {previous_worker} expired", job_id),
+                )
+            cur.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, worker_id, now + self.lease_seconds, job_id),
+            )
+        return job_id, json.loads(payload)
+
+    def renew(self, job_id, worker_id):
+        """Extends the lease of a job. Returns False if the worker lost the job (its
+        lease expired and another worker claimed it)."""
+        with self._transaction() as cur:
+            cur.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + self.lease_seconds, job_id, worker_id, RUNNING),
+            )
+            return cur.rowcount > 0
+
+    def complete(self, job_id, worker_id):
+        with self._transaction() as cur:
+            cur.execute(
+                "UPDATE jobs SET status = ?, lease_expires = NULL WHERE id = ? AND worker = ?",
+                (DONE, job_id, worker_id),
+            )
+
+    def fail(self, job_id, worker_id, error):
+        """Releases a job that raised an error: it is tried again by any worker, up
+        to `max_attempts` times, and is then marked as failed."""
+        with self._transaction() as cur:
+            cur.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, "
+                "lease_expires = NULL, error = ? WHERE id = ? AND worker = ?",
+                (self.max_attempts, PENDING, FAILED, str(error), job_id, worker_id),
+            )
+
+    def keep_alive(self, job_id, worker_id):
+        """Renews the lease of a job in a background thread, until the returned event
+        is set."""
+        stop = threading.Event()
+
+        def renew_loop():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(job_id, worker_id):
+                    print(f"WARNING: worker {worker_id} lost its lease on job {job_id}")
+                    return
+
+        threading.Thread(target=renew_loop, name="lm_eval-job-lease", daemon=True).start()
+        return stop
+
+    def work(self, worker_id, run_job, poll_seconds=None):
+        """Runs jobs until every job of the queue is finished. A job that raises is
+        released with `fail`. While the remaining jobs are run by other workers, the
+        queue is polled every `poll_seconds` (a third of the lease by default), so
+        the jobs of the workers that die are reclaimed.
+
+        :param run_job: Callable[[str, dict], None]
+            Runs a job, given its id and payload
+        """
+        if poll_seconds is None:
+            poll_seconds = self.lease_seconds / 3
+        waiting = False
+        while True:
+            job = self.claim(worker_id)
+            if job is None:
+                if self.is_finished():
+                    return
+                if not waiting:
+                    print(f"INFO: no job left for worker {worker_id}, waiting for the other workers {self.counts()}")
+                    waiting = True
+                time.sleep(poll_seconds)
+                continue
+
+            waiting = False
+            job_id, payload = job
+            print(f"**** Worker {worker_id} claimed job {job_id} ****")
+            stop_renewing = self.keep_alive(job_id, worker_id)
+            try:
+                run_job(job_id, payload)
+            except Exception as e:
+                print(f"WARNING: job {job_id} failed: {e}")
+                self.fail(job_id, worker_id, e)
+            else:
+                self.complete(job_id, worker_id)
+            finally:
+                stop_renewing.set()
+
+    def claim_finalization(self, worker_id):
+        """Returns True for a single worker, the first one to call it, e.g. to compute
+        the results of all the jobs once they are finished."""
+        with self._transaction() as cur:
+            cur.execute("INSERT OR IGNORE INTO finalization (id, worker) VALUES (0, ?)", (worker_id,))
+            return cur.rowcount > 0
+
+    def counts(self):
+        """Returns {status: number of jobs}."""
+        with self._transaction() as cur:
+            cur.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            return dict(cur.fetchall())
+
+    def jobs(self):
+        """Returns the (id, status, worker, attempts, error) of every job, in order."""
+        with self._transaction() as cur:
+            cur.execute("SELECT id, status, worker, attempts, error FROM jobs ORDER BY position")
+            return cur.fetchall()
+
+    def is_finished(self):
+        counts = self.counts()
+        return counts.get(PENDING, 0) == 0 and counts.get(RUNNING, 0) == 0
+
+    def close(self):
+        self.conn.close()
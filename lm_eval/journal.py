@@ -0,0 +1,166 @@
+import base64
+import hashlib
+import json
+import os
+import pickle
+import time
+
+from lm_eval.base import CacheHook, CachingLM, hash_args
+
+
+# main.py keeps the command line arguments of a run here, to be able to `--resume` it
+RUN_ARGS_FILE = "run_args.json"
+
+
+def config_hash(config):
+    dat = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(dat.encode("utf-8")).hexdigest()[:16]
+
+
+class RunJournal:
+    """Append-only journal of an evaluation run.
+
+    Every completed LM request and every scored document is appended as a JSON
+    line, so an interrupted run can be continued from exactly where it stopped.
+    The journal file is keyed by the hash of the run config: a run directory can
+    only resume runs with the very same config.
+
+    A torn last line (e.g. the process was killed while writing) is ignored on load.
+    """
+
+    # fsync the journal at most every FSYNC_INTERVAL seconds
+    FSYNC_INTERVAL = 5.0
+
+    def __init__(self, run_dir, config):
+        """
+        :param run_dir: str
+            Directory that holds the journal
+        :param config: dict
+            JSON-serializable run config. Used to key the journal file
+        """
+        self.run_dir = run_dir
+        self.config = config
+        os.makedirs(run_dir, exist_ok=True)
+        self.path = os.path.join(run_dir, f"journal_{config_hash(config)}.jsonl")
+
+        self.responses = {}
+        self.docs = {}
+        if os.path.exists(self.path):
+            self._load()
+            print(f"Resuming from journal {self.path}: {len(self.docs)} docs and {len(self.responses)} requests already done")
+        else:
+            with open(os.path.join(run_dir, f"journal_{config_hash(config)}.config.json"), "w") as f:
+                json.dump(config, f, indent=2, ensure_ascii=False)
+
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._last_fsync = time.time()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # incomplete write at the end of the file
+                    continue
+                if entry["kind"] == "response":
+                    self.responses[entry["hash"]] = entry["response"]
+                elif entry["kind"] == "doc":
+                    key = (entry["task"], entry["prompt_mode"], entry["doc_id"])
+                    self.docs[key] = pickle.loads(base64.b64decode(entry["metrics"]))
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if time.time() - self._last_fsync > self.FSYNC_INTERVAL:
+            os.fsync(self._file.fileno())
+            self._last_fsync = time.time()
+
+    def get_response(self, reqtype, args):
+        return self.responses.get(hash_args(reqtype, args))
+
+    def record_response(self, reqtype, args, response):
+        hsh = hash_args(reqtype, args)
+        if hsh in self.responses:
+            return
+        self.responses[hsh] = response
+        self._append({"kind": "response", "hash": hsh, "reqtype": reqtype, "args": list(args), "response": response})
+
+    def has_doc(self, key):
+        return key in self.docs
+
+    def get_doc(self, key):
+        return self.docs[key]
+
+    def record_doc(self, key, metrics):
+        task_name, prompt_mode, doc_id = key
+        self.docs[key] = metrics
+        # metric values can be any python object (tuples, dicts, numpy scalars), so
+        # they are pickled to be restored exactly
+        self._append({
+            "kind": "doc", "task": task_name, "prompt_mode": prompt_mode, "doc_id": doc_id,
+            "metrics": base64.b64encode(pickle.dumps(metrics)).decode("ascii"),
+        })
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+class JournalCacheHook(CacheHook):
+    """Records the partial results reported by the LM while a call is still running,
+    then forwards them to the previous hook (e.g. the one of a CachingLM)."""
+
+    def __init__(self, journal, previous_hook=None):
+        self.journal = journal
+        self.previous_hook = previous_hook
+        self.dbdict = None
+
+    def add_partial(self, attr, req, res):
+        self.journal.record_response(attr, req, res)
+        if self.previous_hook is not None:
+            self.previous_hook.add_partial(attr, req, res)
+
+
+class JournaledLM:
+    def __init__(self, lm, journal):
+        """LM wrapper that serves the responses already present in the journal and
+        records the new ones as they complete.
+
+        :param lm: LM or CachingLM
+            Underlying LM
+        :param journal: RunJournal
+        """
+        self.lm = lm
+        self.journal = journal
+
+        inner_lm = lm.lm if isinstance(lm, CachingLM) else lm
+        inner_lm.set_cache_hook(JournalCacheHook(journal, previous_hook=inner_lm.cache_hook))
+
+    def __getattr__(self, attr):
+        def fn(requests):
+            res = []
+            remaining_reqs = []
+
+            for req in requests:
+                ob = self.journal.get_response(attr, req)
+                res.append(ob)
+                if ob is None:
+                    remaining_reqs.append(req)
+
+            # the LM may modify the request args in place (e.g. appending the EOS
+            # token to `until`), so the keys are serialized before the call
+            remaining_keys = [json.loads(json.dumps(list(req))) for req in remaining_reqs]
+            rem_res = getattr(self.lm, attr)(remaining_reqs) if remaining_reqs else []
+
+            resptr = 0
+            for req, r in zip(remaining_keys, rem_res):
+                while res[resptr] is not None:
+                    resptr += 1
+                res[resptr] = r
+                self.journal.record_response(attr, req, r)
+
+            return res
+        return fn
@@ -2,12 +2,12 @@ import math
 from collections.abc import Iterable
 
 import numpy as np
-import sacrebleu
-import sklearn.metrics
 import random
 import re
 import string
 
+from lm_eval import profiling
+
 def mean(arr):
     return sum(arr) / len(arr)
 
@@ -33,6 +33,7 @@ def median(arr):
 
 
 def matthews_corrcoef(items):
+    import sklearn.metrics
     unzipped_list = list(zip(*items))
     golds = unzipped_list[0]
     preds = unzipped_list[1]
@@ -40,6 +41,7 @@ def matthews_corrcoef(items):
 
 
 def f1_score(items):
+    import sklearn.metrics
     unzipped_list = list(zip(*items))
     golds = unzipped_list[0]
     preds = unzipped_list[1]
@@ -49,6 +51,7 @@ def f1_score(items):
     return np.max(fscore)
 
 def f1_score_macro(items):
+    import sklearn.metrics
     unzipped_list = list(zip(*items))
     golds = unzipped_list[0]
     preds = unzipped_list[1]
@@ -56,6 +59,7 @@ def f1_score_macro(items):
     return np.max(fscore)
 
 def f1_score_weighted(items):
+    import sklearn.metrics
     unzipped_list = list(zip(*items))
     golds = unzipped_list[0]
     preds = unzipped_list[1]
@@ -197,6 +201,8 @@ def bleu(items):
 
     Higher is better
     """
+    import sacrebleu
+
     refs = list(zip(*items))[0]
     preds = list(zip(*items))[1]
     refs, preds = _sacreformat(refs, preds)
@@ -211,6 +217,8 @@ def chrf(items):
 
     Higher is better  # TODO I think
     """
+    import sacrebleu
+
     refs = list(zip(*items))[0]
     preds = list(zip(*items))[1]
     refs, preds = _sacreformat(refs, preds)
@@ -226,6 +234,8 @@ def ter(items):
 
     Lower is better
     """
+    import sacrebleu
+
     refs = list(zip(*items))[0]
     preds = list(zip(*items))[1]
     refs, preds = _sacreformat(refs, preds)
@@ -293,11 +303,12 @@ def bootstrap_stderr(f, xs, iters):
     chunk_size = min(1000, iters)
     from tqdm import tqdm
     print("bootstrapping for stddev:", f.__name__)
-    for bootstrap in tqdm(pool.imap(
-            _bootstrap_internal(f, chunk_size),
-            [(i, xs) for i in range(iters // chunk_size)]), total=iters // chunk_size):
-        # sample w replacement
-        res.extend(bootstrap)
+    with profiling.span("bootstrap", metric=f.__name__, iters=iters):
+        for bootstrap in tqdm(pool.imap(
+                _bootstrap_internal(f, chunk_size),
+                [(i, xs) for i in range(iters // chunk_size)]), total=iters // chunk_size):
+            # sample w replacement
+            res.extend(bootstrap)
 
     pool.close()
     return sample_stddev(res)
@@ -0,0 +1,141 @@
+"""Local mirror of the files the tasks download.
+
+Files are stored by content (`objects/<sha256>`), and `manifest.json` maps each URL
+to the checksum and size of its file. Tasks download through `download` and
+`fetch`, which serve the mirrored file when there is one, so an evaluation node
+with a mirror (see scripts/prefetch.py) never hits the network for these files.
+
+With LM_EVAL_OFFLINE=1, a file missing from the mirror raises MirrorMissError
+instead of being downloaded, and the Hugging Face libraries are set offline too (when
+lm_eval is imported, see lm_eval/__init__.py), so `datasets.load_dataset` only uses
+the datasets already in the HF cache.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+
+MIRROR_DIR = os.path.abspath(os.environ.get("LM_EVAL_MIRROR_DIR", os.path.join("data", "mirror")))
+OFFLINE = os.environ.get("LM_EVAL_OFFLINE", "0") == "1"
+MANIFEST_FILE = "manifest.json"
+
+
+class MirrorMissError(Exception):
+    pass
+
+
+def sha256_file(path):
+    hsh = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hsh.update(chunk)
+    return hsh.hexdigest()
+
+
+class Mirror:
+    def __init__(self, mirror_dir=MIRROR_DIR, offline=OFFLINE):
+        """
+        :param mirror_dir: str
+            Directory of the mirror
+        :param offline: bool
+            If True, files missing from the mirror are not downloaded
+        """
+        self.mirror_dir = mirror_dir
+        self.offline = offline
+        self.manifest_path = os.path.join(mirror_dir, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        # one lock per URL, so the same file is not downloaded twice at the same time
+        self._url_locks = {}
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)["files"]
+
+    @contextlib.contextmanager
+    def _manifest_lock(self):
+        # other processes (e.g. workers of the same node) may update the manifest too
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.mirror_dir, ".manifest.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _add(self, url, sha256, size):
+        with self._manifest_lock():
+            files = self.load_manifest()
+            files[url] = {"sha256": sha256, "size": size, "object": os.path.join("objects", sha256)}
+            fd, tmp_path = tempfile.mkstemp(dir=self.mirror_dir, prefix=".manifest_")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"files": files}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
+
+    def _download(self, url):
+        import requests
+
+        print(f"Downloading {url}")
+        os.makedirs(os.path.join(self.mirror_dir, "objects"), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.mirror_dir, "objects"), prefix=".download_")
+        hsh = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f, requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+                    hsh.update(chunk)
+                    size += len(chunk)
+            sha256 = hsh.hexdigest()
+            os.replace(tmp_path, os.path.join(self.mirror_dir, "objects", sha256))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._add(url, sha256, size)
+
+    def fetch(self, url):
+        """Returns the path of the mirrored file of `url`, downloading it first if
+        needed (unless offline)."""
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            entry = self.load_manifest().get(url)
+            if entry is None or not os.path.exists(os.path.join(self.mirror_dir, entry["object"])):
+                if self.offline:
+                    raise MirrorMissError(f"{url} is not in the mirror {self.mirror_dir}, run scripts/prefetch.py first")
+                self._download(url)
+                entry = self.load_manifest()[url]
+        return os.path.join(self.mirror_dir, entry["object"])
+
+    def verify(self):
+        """Returns the URLs whose mirrored file is missing or doesn't match its checksum."""
+        bad = []
+        for url, entry in self.load_manifest().items():
+            path = os.path.join(self.mirror_dir, entry["object"])
+            if not os.path.exists(path) or sha256_file(path) != entry["sha256"]:
+                bad.append(url)
+        return bad
+
+
+# mirror used by the tasks
+MIRROR = Mirror()
+
+
+def fetch(url):
+    return MIRROR.fetch(url)
+
+
+def download(url, path):
+    """Copies the file of `url` to `path`, from the mirror."""
+    src = MIRROR.fetch(url)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copyfile(src, path)
@@ -1,29 +1,25 @@
-from . import azure
-from . import fireworks
-from . import gpt
-from . import gpt2
-from . import gpt3
-from . import dummy
-from . import seq2seq
-from . import google
-from . import openai_compatible_models
+from lm_eval.utils import LazyRegistry
 
-MODEL_REGISTRY = {
-    "azure": azure.AZURECHATGPTLM,
-    "gpt": gpt.GPTLM,
-    "seq2seq": seq2seq.Seq2SeqLM,
-    "fireworks": fireworks.FireworksLM,
-    "google": google.GoogleLM,
-    "fireworks": openai_compatible_models.FireworksAPI,
-    "deepinfra": openai_compatible_models.DeepinfraAPI,
-    "deepseek": openai_compatible_models.DeekseekAPI,
-    "tgi": openai_compatible_models.TGIAPI,
-    "vllm": openai_compatible_models.VLLMAPI,
-    "gemini": openai_compatible_models.GeminiAPI,
-    "maritalk": openai_compatible_models.MaritalkAPI,
-    "chatgpt": openai_compatible_models.OpenaiAPI,
-}
+
+# "module:class" of each model, imported only when the model is used, so that
+# e.g. API models never import torch or the SDKs of the other providers
+MODEL_REGISTRY = LazyRegistry(package="lm_eval.models", paths={
+    "gpt": "gpt:GPTLM",
+    "seq2seq": "seq2seq:Seq2SeqLM",
+    "google": "google:GoogleLM",
+    "fireworks": "openai_compatible_models:FireworksAPI",
+    "deepinfra": "openai_compatible_models:DeepinfraAPI",
+    "deepseek": "openai_compatible_models:DeekseekAPI",
+    "tgi": "openai_compatible_models:TGIAPI",
+    "vllm": "openai_compatible_models:VLLMAPI",
+    "gemini": "openai_compatible_models:GeminiAPI",
+    "maritalk": "openai_compatible_models:MaritalkAPI",
+    "chatgpt": "openai_compatible_models:OpenaiAPI",
+    "replay": "replay:ReplayLM",
+})
 
 
 def get_model(model_name):
+    if model_name not in MODEL_REGISTRY:
+        raise KeyError(f"Missing model {model_name}, available models: {', '.join(MODEL_REGISTRY)}")
     return MODEL_REGISTRY[model_name]
@@ -2,6 +2,7 @@ import json
 import os
 from lm_eval.base import BaseLM
 from lm_eval import utils
+from lm_eval import profiling
 import requests
 from tqdm import tqdm
 import time
@@ -18,18 +19,20 @@ def fireworks_completion(**kwargs):
     n_retry = 0
     while n_retry < max_retry:
         try:
-            request = requests.post(
-                f"https://api.fireworks.ai/inference/v1/chat/completions",
-                json=kwargs,
-                headers={
-                    "Authorization": f"Bearer {api_key}"
-                }
-            )
+            with profiling.span("api_call", model=kwargs.get("model")):
+                request = requests.post(
+                    f"https://api.fireworks.ai/inference/v1/chat/completions",
+                    json=kwargs,
+                    headers={
+                        "Authorization": f"Bearer {api_key}"
+                    }
+                )
             if not request.ok:
                 raise ValueError(request.text)
             return request.json()
         except Exception as e:
             import traceback
+            profiling.count("api_retries")
             traceback.print_exc()
             time.sleep(backoff_time)
             backoff_time *= 1.5
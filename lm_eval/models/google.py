@@ -3,6 +3,7 @@ from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import json
 from lm_eval.base import BaseLM
 from lm_eval import utils
+from lm_eval import profiling
 import os
 from tqdm import tqdm
 import time
@@ -94,9 +95,11 @@ class GoogleLM(BaseLM):
         n_retry = 0
         while n_retry < max_retry:
             try:
-                return self.model.generate_content(messages)
+                with profiling.span("api_call"):
+                    return self.model.generate_content(messages)
             except Exception as e:
                 import traceback
+                profiling.count("api_retries")
                 traceback.print_exc()
                 time.sleep(backoff_time)
                 backoff_time *= 1.5
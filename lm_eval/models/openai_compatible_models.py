@@ -3,6 +3,7 @@ import openai
 import os
 from lm_eval.base import BaseLM
 from lm_eval import utils
+from lm_eval import profiling
 from tqdm import tqdm
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -104,15 +105,20 @@ def openai_completion(client, is_chat=False, **kwargs):
     while n_retry < max_retry:
         try:
             is_using_response_format = kwargs.get("response_format")
-            if is_chat and not is_using_response_format:
-                return client.chat.completions.create(**kwargs)
-            elif is_chat and is_using_response_format:
-                return client.beta.chat.completions.parse(**kwargs)
-            else:
-                return client.completions.create(**kwargs)
+            with profiling.span("api_call", model=kwargs.get("model")):
+                if is_chat and not is_using_response_format:
+                    response = client.chat.completions.create(**kwargs)
+                elif is_chat and is_using_response_format:
+                    response = client.beta.chat.completions.parse(**kwargs)
+                else:
+                    response = client.completions.create(**kwargs)
+            if getattr(response, "usage", None) is not None:
+                profiling.count("tokens", response.usage.total_tokens)
+            return response
         except openai.OpenAIError:
             import traceback
 
+            profiling.count("api_retries")
             traceback.print_exc()
             time.sleep(backoff_time)
             backoff_time *= 1.5
@@ -0,0 +1,131 @@
+import glob
+import json
+import os
+
+from lm_eval.base import LM, ModelCategory
+from lm_eval.sample_logger import prompt_hash
+
+
+class MissingResponseError(Exception):
+    pass
+
+
+def request_key(reqtype, args):
+    """Key of a request in the stored responses.
+
+    Generations are keyed by their prompt only: the stop sequences logged with a
+    request may have been extended by the LM that ran it (e.g. with its EOS token).
+    """
+    key = (reqtype, prompt_hash(args[0]))
+    if reqtype == "loglikelihood":
+        key += (args[1],)
+    return key
+
+
+class PartialResponse(tuple):
+    """Response of which only some elements were stored: the sample logs keep the
+    element selected by the request index (e.g. the logprob of a (logprob, is_greedy)
+    pair). Accessing an element that was not stored raises MissingResponseError."""
+
+    def __new__(cls, elements, description):
+        self = super().__new__(cls, [elements.get(i) for i in range(max(elements) + 1)])
+        self.elements = elements
+        self.description = description
+        return self
+
+    def __getitem__(self, index):
+        if index not in self.elements:
+            raise MissingResponseError(f"Element {index} of the {self.description} was not stored")
+        return self.elements[index]
+
+
+class ReplayLM(LM):
+    """LM that answers requests with the responses stored by a previous run, without
+    running any model. Used to re-score a run after changing the answer extraction or
+    the metrics of a task.
+
+    Responses are read from the samples logged by the evaluator (see
+    lm_eval.sample_logger.SampleLogger, `{task}_{prompt_mode}_samples.jsonl`) and from
+    run journals (see lm_eval.journal.RunJournal, `journal_*.jsonl`).
+    """
+
+    def __init__(self, path, model_category=ModelCategory.COMPLETION_MODEL.value, batch_size=None, device=None):
+        """
+        :param path: str
+            Directory with the samples or journals of the run to replay. Use the same
+            prompt options as that run, so the prompts match
+        :param model_category: str
+            Category of the model that was evaluated ("completion_model" or
+            "chat_model"), as the prompts depend on it
+        """
+        super().__init__()
+        self.path = path
+        self.MODEL_CATEGORY = ModelCategory(model_category)
+        self.responses = {}
+
+        for samples_path in sorted(glob.glob(os.path.join(path, "*_samples.jsonl"))):
+            self._load_samples(samples_path)
+        for journal_path in sorted(glob.glob(os.path.join(path, "journal_*.jsonl"))):
+            self._load_journal(journal_path)
+
+        if not self.responses:
+            raise MissingResponseError(f"No stored responses found in {path}")
+        print(f"Replaying {len(self.responses)} responses from {path}")
+
+    def _load_samples(self, samples_path):
+        with open(samples_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    sample = json.loads(line)
+                except json.JSONDecodeError:
+                    # incomplete write at the end of the file
+                    continue
+                for req in sample["requests"]:
+                    key = (req["type"], req["prompt"])
+                    if req["type"] == "loglikelihood":
+                        key += (req["args"][0],)
+                    if req.get("index") is None:
+                        self.responses[key] = req["response"]
+                    else:
+                        # several requests of a doc can select different elements of one response
+                        partial = self.responses.get(key)
+                        if not isinstance(partial, dict):
+                            partial = self.responses[key] = {}
+                        partial[req["index"]] = req["response"]
+
+    def _load_journal(self, journal_path):
+        with open(journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["kind"] == "response":
+                    self.responses.setdefault(request_key(entry["reqtype"], entry["args"]), entry["response"])
+
+    def _replay(self, reqtype, requests):
+        res = []
+        for args in requests:
+            key = request_key(reqtype, args)
+            if key not in self.responses:
+                raise MissingResponseError(
+                    f"No stored {reqtype} response in {self.path} for the prompt {key[1]}: "
+                    f"{args[0][-200:]!r}" + (f" with the continuation {args[1]!r}" if reqtype == "loglikelihood" else "")
+                )
+            resp = self.responses[key]
+            if isinstance(resp, dict):
+                resp = PartialResponse(resp, f"{reqtype} response for the prompt {key[1]}")
+            elif isinstance(resp, list):
+                # tuples (e.g. (logprob, is_greedy) pairs) are stored as JSON lists
+                resp = tuple(resp)
+            res.append(resp)
+        return res
+
+    def loglikelihood(self, requests):
+        return self._replay("loglikelihood", requests)
+
+    def loglikelihood_rolling(self, requests):
+        return self._replay("loglikelihood_rolling", requests)
+
+    def greedy_until(self, requests):
+        return self._replay("greedy_until", requests)
@@ -5,6 +5,7 @@ import time
 import transformers
 from lm_eval.base import BaseLM
 from lm_eval import utils
+from lm_eval import profiling
 from tqdm import tqdm
 
 
@@ -44,10 +45,12 @@ def oa_completion(client, **kwargs):
     backoff_time = 3
     while True:
         try:
-            return client.chat.completions.create(**kwargs)
+            with profiling.span("api_call", model=kwargs.get("model")):
+                return client.chat.completions.create(**kwargs)
         except openai.OpenAIError as e:
             import traceback
 
+            profiling.count("api_retries")
             traceback.print_exc()
             time.sleep(backoff_time)
             backoff_time *= 1.5
@@ -0,0 +1,118 @@
+import collections.abc
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lm_eval import profiling
+
+
+_DONE = object()
+
+
+def prefetch(iterable, max_size):
+    """Consumes `iterable` in a background thread, keeping at most `max_size` items
+    ready ahead of the caller. Exceptions raised by the iterable are re-raised in
+    the caller's thread.
+
+    Used to build contexts and requests while the LM is busy with the previous ones.
+    """
+    buffer = queue.Queue(maxsize=max_size)
+
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put((item, None))
+        except BaseException as e:
+            buffer.put((_DONE, e))
+            return
+        buffer.put((_DONE, None))
+
+    # daemon, so a producer blocked on a full queue does not hang the process when
+    # the consumer fails
+    thread = threading.Thread(target=produce, name="lm_eval-prefetch", daemon=True)
+    thread.start()
+
+    while True:
+        item, error = buffer.get()
+        if item is _DONE:
+            if error is not None:
+                raise error
+            return
+        yield item
+
+
+class TaskPrefetcher(collections.abc.Mapping):
+    """Task dict that instantiates the tasks in the background, in order, keeping up
+    to `ahead` tasks loaded (or loading) past the last one accessed.
+
+    Only the task names are known upfront (`names`): `task_dict[name]` waits for that
+    task to be ready, and iterating waits for each task in turn. Like
+    lm_eval.tasks.get_task_dict, a task that fails to load is left out of the dict.
+    """
+
+    def __init__(self, task_loaders, ahead=2, on_load=None, num_workers=1, errors=None):
+        """
+        :param task_loaders: dict[str, Callable[[], Task]]
+            Function that instantiates each task, see lm_eval.tasks.get_task_loaders
+        :param ahead: int
+            Number of tasks loaded ahead of the last one accessed
+        :param on_load: Callable[[Task], None], optional
+            Called on each task after it is instantiated, in the loading thread
+        :param num_workers: int
+            Number of tasks instantiated concurrently, among the ones scheduled
+        :param errors: dict, optional
+            Filled with the exception of each task that failed to load
+        """
+        self.task_loaders = task_loaders
+        self.names = list(task_loaders)
+        self.ahead = ahead
+        self.on_load = on_load
+        self.errors = errors if errors is not None else {}
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="lm_eval-task-loader")
+        self._lock = threading.Lock()
+        self._schedule(0)
+
+    def _load(self, name):
+        with profiling.span("load_task", task=name):
+            task = self.task_loaders[name]()
+        if self.on_load is not None:
+            self.on_load(task)
+        return task
+
+    def _schedule(self, index):
+        with self._lock:
+            for name in self.names[index:index + self.ahead + 1]:
+                if name not in self.futures:
+                    print(f"Loading task {name}")
+                    self.futures[name] = self.executor.submit(self._load, name)
+
+    def _result(self, name):
+        """Waits for a task, returns None if it failed to load."""
+        self._schedule(self.names.index(name))
+        try:
+            return self.futures[name].result()
+        except Exception as e:
+            if name not in self.errors:
+                print(f"WARNING: unable to load task {name}, evaluating without it: {e!r}")
+                self.errors[name] = e
+            return None
+
+    def __getitem__(self, name):
+        if name not in self.task_loaders:
+            raise KeyError(name)
+        task = self._result(name)
+        if task is None:
+            raise KeyError(name)
+        return task
+
+    def __iter__(self):
+        for name in self.names:
+            if self._result(name) is not None:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
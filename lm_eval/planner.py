@@ -0,0 +1,194 @@
+import collections
+import json
+
+import lm_eval.evaluator
+import lm_eval.models
+import lm_eval.tasks
+from lm_eval import utils
+
+
+# rough number of characters per token, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+
+class ApproximateTokenizer:
+    """Stands for the model tokenizer when it can't be loaded (e.g. API models)."""
+
+    def count(self, text):
+        return max(1, round(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+class HFTokenizer:
+    def __init__(self, name):
+        import transformers
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(name)
+
+    def count(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+def get_tokenizer(tokenizer_name=None, model_args=""):
+    """Returns the tokenizer used to count tokens: `tokenizer_name`, or the
+    `tokenizer`/`pretrained` model arg, falling back to `ApproximateTokenizer`.
+    """
+    args = utils.simple_parse_args_string(model_args or "")
+    name = tokenizer_name or args.get("tokenizer") or args.get("pretrained")
+    if name:
+        try:
+            return HFTokenizer(name)
+        except Exception as e:
+            print(f"WARNING: unable to load the tokenizer {name} ({e}), token counts are approximated")
+    else:
+        print(f"WARNING: no tokenizer given, token counts are approximated as {CHARS_PER_TOKEN} characters per token")
+    return ApproximateTokenizer()
+
+
+def _request_tokens(tokenizer, task, doc, req):
+    """Returns the (prompt, continuation, generation) token counts of a request."""
+    if req.request_type == "loglikelihood":
+        return tokenizer.count(req.args[0]), tokenizer.count(req.args[1]), 0
+    if req.request_type == "loglikelihood_rolling":
+        return tokenizer.count(req.args[0]), 0, 0
+    if req.request_type == "greedy_until":
+        # generations are expected to stop around the length of the reference answer
+        try:
+            target = task.doc_to_target(doc)
+        except Exception:
+            target = ""
+        return tokenizer.count(req.args[0]), 0, tokenizer.count(target if isinstance(target, str) else str(target))
+    return 0, 0, 0
+
+
+def plan(model, model_args="", tasks=(), num_fewshot=0, prompt_modes=("dynamic-random",), limit=None,
+        description_dict=None, conversation_template=None, prompt_as_single_user_message=False,
+        fewshot_seed=None, tokenizer=None, throughput=None):
+    """Builds the requests of every task, exactly as `evaluator.evaluate` would but
+    without calling any model, and predicts the tokens, time and cost of the run.
+
+    :param model: str
+        Name of the model, see lm_eval.models.get_model. The model is not instantiated
+    :param tokenizer: str, optional
+        Name of the Hugging Face tokenizer used to count tokens. Defaults to the
+        tokenizer/pretrained model arg, or an approximation
+    :param throughput: dict, optional
+        Throughput profile, with `prompt_tokens_per_second` and
+        `generation_tokens_per_second` (or a single `tokens_per_second`), and for
+        API models `input_price_per_million` and `output_price_per_million` tokens
+    :return: dict
+        Totals of each task and of the whole run
+    """
+    throughput = throughput or {}
+    model_category = lm_eval.models.get_model(model).MODEL_CATEGORY
+    token_counter = get_tokenizer(tokenizer, model_args)
+
+    task_dict = lm_eval.tasks.get_task_dict(list(tasks))
+    for task in task_dict.values():
+        task.set_inference_model_category(model_category)
+
+    versions = {}
+    doc_requests = lm_eval.evaluator.iter_doc_requests(
+        lm_eval.evaluator.iter_evaluable_tasks(task_dict, versions),
+        prompt_modes=list(prompt_modes),
+        num_fewshot=num_fewshot,
+        limit=limit,
+        description_dict=description_dict,
+        conversation_template=conversation_template,
+        prompt_as_single_user_message=prompt_as_single_user_message,
+        fewshot_seed=fewshot_seed,
+    )
+
+    task_plans = collections.defaultdict(collections.Counter)
+    for (task_name, _, _), doc, reqs in doc_requests:
+        task_plan = task_plans[task_name]
+        task_plan["docs"] += 1
+        for req in reqs:
+            prompt_tokens, continuation_tokens, generation_tokens = _request_tokens(
+                token_counter, task_dict[task_name], doc, req
+            )
+            task_plan[f"{req.request_type}_requests"] += 1
+            task_plan["prompt_tokens"] += prompt_tokens
+            task_plan["continuation_tokens"] += continuation_tokens
+            task_plan["generation_tokens"] += generation_tokens
+            task_plan["max_request_tokens"] = max(task_plan["max_request_tokens"], prompt_tokens + continuation_tokens)
+
+    result = {"tasks": {}, "total": collections.Counter()}
+    for task_name, task_plan in task_plans.items():
+        task_plan = dict(task_plan)
+        task_plan.update(estimate(task_plan, throughput))
+        result["tasks"][task_name] = task_plan
+        for key, value in task_plan.items():
+            if value is None:
+                continue
+            if key == "max_request_tokens":
+                result["total"][key] = max(result["total"][key], value)
+            else:
+                result["total"][key] += value
+    result["total"] = dict(result["total"])
+    return result
+
+
+def estimate(task_plan, throughput):
+    """Estimates the seconds and cost of a task plan from a throughput profile.
+    Values that can't be estimated with the given profile are None.
+    """
+    input_tokens = task_plan.get("prompt_tokens", 0) + task_plan.get("continuation_tokens", 0)
+    output_tokens = task_plan.get("generation_tokens", 0)
+
+    prompt_speed = throughput.get("prompt_tokens_per_second", throughput.get("tokens_per_second"))
+    generation_speed = throughput.get("generation_tokens_per_second", throughput.get("tokens_per_second"))
+    seconds = None
+    if prompt_speed and (generation_speed or not output_tokens):
+        seconds = input_tokens / prompt_speed + (output_tokens / generation_speed if output_tokens else 0)
+
+    cost = None
+    if "input_price_per_million" in throughput:
+        cost = (
+            input_tokens * throughput["input_price_per_million"]
+            + output_tokens * throughput.get("output_price_per_million", throughput["input_price_per_million"])
+        ) / 1e6
+
+    return {"estimated_seconds": seconds, "estimated_cost": cost}
+
+
+def load_throughput(path):
+    """Loads a throughput profile. Besides the keys documented in `plan`, the file
+    can be the output of a `--profile` run (see lm_eval.profiling.Profiler.task_stats),
+    in which case the measured tokens per second of that run is used.
+    """
+    with open(path) as f:
+        throughput = json.load(f)
+    if "tasks" in throughput:
+        measured = throughput["tasks"].values()
+        seconds = sum(stats["lm_seconds"] for stats in measured)
+        tokens = sum(stats["tokens"] for stats in measured)
+        throughput = {key: value for key, value in throughput.items() if key != "tasks"}
+        if seconds and tokens:
+            throughput.setdefault("tokens_per_second", tokens / seconds)
+    return throughput
+
+
+def make_plan_table(result):
+    """Generate table of the plan."""
+    from pytablewriter import MarkdownTableWriter
+
+    def fmt(value, spec):
+        return "" if value is None else format(value, spec)
+
+    md_writer = MarkdownTableWriter()
+    md_writer.headers = [
+        "Task", "Docs", "Loglikelihood", "Greedy", "Prompt tokens", "Continuation tokens",
+        "Generation tokens", "Max request tokens", "Time (min)", "Cost",
+    ]
+    rows = list(result["tasks"].items()) + [("Total", result["total"])]
+    md_writer.value_matrix = [
+        [
+            task_name, task_plan.get("docs", 0), task_plan.get("loglikelihood_requests", 0),
+            task_plan.get("greedy_until_requests", 0), task_plan.get("prompt_tokens", 0),
+            task_plan.get("continuation_tokens", 0), task_plan.get("generation_tokens", 0),
+            task_plan.get("max_request_tokens", 0),
+            fmt(task_plan.get("estimated_seconds") and task_plan["estimated_seconds"] / 60, ".1f"),
+            fmt(task_plan.get("estimated_cost"), ".4f"),
+        ]
+        for task_name, task_plan in rows
+    ]
+    return md_writer.dumps()
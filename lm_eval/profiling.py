@@ -0,0 +1,155 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Profiler:
+    """Collects timed spans and counters of an evaluation run.
+
+    Spans and counters are attributed to a task: the one given explicitly, or the
+    task whose requests the LM is currently running (see `task_scope`). When the
+    profiler is disabled, `span` and `count` do nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.current_task = None
+        # (name, category, start, duration, thread id, args)
+        self.events = []
+        # task -> counter name -> value
+        self.counters = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.current_task = None
+        self.events = []
+        self.counters = collections.defaultdict(collections.Counter)
+
+    @contextlib.contextmanager
+    def task_scope(self, task_name):
+        """Attributes the spans and counters recorded inside, from any thread and
+        without an explicit task, to `task_name`."""
+        previous_task = self.current_task
+        self.current_task = task_name
+        try:
+            yield
+        finally:
+            self.current_task = previous_task
+
+    @contextlib.contextmanager
+    def span(self, name, task=None, **args):
+        if not self.enabled:
+            yield
+            return
+
+        task = task or self.current_task
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if task is not None:
+                args["task"] = task
+            with self._lock:
+                self.events.append((name, name.split(".")[0], start, duration, threading.get_ident(), args))
+
+    def count(self, name, value=1, task=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[task or self.current_task][name] += value
+
+    def export_chrome_trace(self, path):
+        """Writes the spans in the Chrome trace event format, to be opened with
+        chrome://tracing or https://ui.perfetto.dev"""
+        pid = os.getpid()
+        trace_events = [
+            {
+                "name": name, "cat": category, "ph": "X",
+                "ts": start * 1e6, "dur": duration * 1e6,
+                "pid": pid, "tid": tid, "args": args,
+            }
+            for name, category, start, duration, tid, args in self.events
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+    def phase_times(self):
+        """Returns {span name: (number of calls, total seconds)}."""
+        phases = collections.defaultdict(lambda: [0, 0.0])
+        for name, _, _, duration, _, _ in self.events:
+            phases[name][0] += 1
+            phases[name][1] += duration
+        return {name: tuple(phase) for name, phase in phases.items()}
+
+    def task_stats(self):
+        """Returns the throughput figures of each task.
+
+        Rates are computed over the time spent in the LM calls of the task.
+        """
+        lm_time = collections.Counter()
+        for name, category, _, duration, _, args in self.events:
+            if category == "lm":
+                lm_time[args.get("task")] += duration
+
+        stats = {}
+        for task in sorted(set(lm_time) | set(self.counters), key=str):
+            counters = self.counters[task]
+            seconds = lm_time[task]
+            cache_lookups = counters["cache_hits"] + counters["cache_misses"]
+            stats[task] = {
+                "lm_seconds": seconds,
+                "requests": counters["requests"],
+                "requests_per_second": counters["requests"] / seconds if seconds else None,
+                "tokens": counters["tokens"],
+                "tokens_per_second": counters["tokens"] / seconds if seconds else None,
+                "padding_efficiency": counters["tokens"] / counters["padded_tokens"] if counters["padded_tokens"] else None,
+                "cache_hit_rate": counters["cache_hits"] / cache_lookups if cache_lookups else None,
+                "api_retries": counters["api_retries"],
+            }
+        return stats
+
+    def summary(self):
+        """Returns the per-phase and per-task breakdown as markdown tables."""
+        from pytablewriter import MarkdownTableWriter
+
+        def fmt(value, spec):
+            return "" if value is None else format(value, spec)
+
+        phase_writer = MarkdownTableWriter()
+        phase_writer.headers = ["Phase", "Calls", "Total (s)", "Mean (ms)"]
+        phase_writer.value_matrix = [
+            [name, calls, "%.3f" % total, "%.3f" % (1000 * total / calls)]
+            for name, (calls, total) in sorted(self.phase_times().items(), key=lambda x: -x[1][1])
+        ]
+
+        task_writer = MarkdownTableWriter()
+        task_writer.headers = [
+            "Task", "LM (s)", "Requests", "Requests/s", "Tokens", "Tokens/s",
+            "Padding efficiency", "Cache hit rate", "API retries",
+        ]
+        task_writer.value_matrix = [
+            [
+                task or "-", "%.3f" % stats["lm_seconds"], stats["requests"], fmt(stats["requests_per_second"], ".2f"),
+                stats["tokens"], fmt(stats["tokens_per_second"], ".1f"), fmt(stats["padding_efficiency"], ".2%"),
+                fmt(stats["cache_hit_rate"], ".2%"), stats["api_retries"],
+            ]
+            for task, stats in self.task_stats().items()
+        ]
+
+        # nested spans (e.g. forward inside lm.loglikelihood) are counted in both phases
+        return phase_writer.dumps() + "\n" + task_writer.dumps()
+
+
+# profiler of the current process, used by the evaluator, the LMs and the metrics
+PROFILER = Profiler()
+
+span = PROFILER.span
+count = PROFILER.count
+task_scope = PROFILER.task_scope
@@ -0,0 +1,175 @@
+"""Prompts made of segments: the description, the few-shot examples and the question
+of a doc. Most of a few-shot prompt is made of examples drawn from the same training
+pool, so the LMs tokenize each segment once (see SegmentEncoder) instead of
+tokenizing every prompt whole, and tokenization scales with the unique content
+rather than with docs x shots.
+
+Set LM_EVAL_PROMPT_SEGMENTS=1 to enable it. By default, the prompts are tokenized
+whole.
+"""
+import collections
+import os
+
+
+ENABLED = os.environ.get("LM_EVAL_PROMPT_SEGMENTS", "0") == "1"
+
+
+class SegmentedPrompt(str):
+    """A prompt, used as a regular string everywhere (requests, caches, logs), that
+    also keeps the segments it is the concatenation of. Any operation on it (e.g.
+    `ctx + "..."`) returns a plain string, whose segments are forgotten.
+    """
+
+    def __new__(cls, segments):
+        segments = tuple(segment for segment in segments if segment)
+        prompt = super().__new__(cls, "".join(segments))
+        prompt.segments = segments
+        return prompt
+
+    def __reduce__(self):
+        return (SegmentedPrompt, (self.segments,))
+
+
+class SegmentEncoder:
+    """Tokenizes SegmentedPrompts by concatenating the tokens of their segments.
+
+    The tokens of a segment depend on the text around it: sentencepiece tokenizers
+    mark the start of a text, so each segment but the first is tokenized after the
+    last character of the previous segment, which is then removed from its tokens.
+    And a token may merge the end of a segment with the start of the next one, or
+    the end of a segment may be split differently depending on what follows (e.g.
+    "\n\n" is a single token at the end of a text, but two tokens before a word for
+    byte-level BPE tokenizers), so the text around each boundary (WINDOW characters
+    on each side) is tokenized too, and must give the tokens of both sides
+    concatenated. A boundary that doesn't is moved before the whitespace at the end
+    of the segment, if any, and the prompt is tokenized whole if that doesn't work
+    either. If none of the first VERIFY_FIRST prompts can be split, the encoder is
+    disabled.
+
+    The tokens of the first VERIFY_FIRST prompts, and then of one prompt every
+    VERIFY_EVERY, are also checked against the tokens of the whole prompt. On the
+    first difference (e.g. a tokenizer adding an EOS token to every text), the
+    encoder is disabled and all the prompts are tokenized whole.
+    """
+
+    VERIFY_FIRST = 32
+    VERIFY_EVERY = 100
+
+    # Characters tokenized on each side of a boundary to check it
+    WINDOW = 32
+
+    # Number of segment encodings kept. The last segment of a prompt (the question
+    # of its doc) is not cached
+    MAX_CACHED = 100000
+
+    def __init__(self, tok_encode):
+        """
+        :param tok_encode: Callable[[str], list[int]]
+            Tokenizer of the LM
+        """
+        self.tok_encode = tok_encode
+        self.enabled = ENABLED
+        self.num_prompts = 0
+        self.num_whole = 0
+        # (previous character, segment) -> tokens of the segment, or None if it
+        # can't be split from the previous character
+        self._cache = collections.OrderedDict()
+        self._char_tokens = {}
+        # (end of a segment, start of the next one) -> whether they can be split
+        self._boundaries = collections.OrderedDict()
+
+    def _encode_segment(self, prev_char, segment, cache=True):
+        key = (prev_char, segment)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if prev_char is None:
+            tokens = self.tok_encode(segment)
+        else:
+            if prev_char not in self._char_tokens:
+                self._char_tokens[prev_char] = self.tok_encode(prev_char)
+            prefix = self._char_tokens[prev_char]
+            tokens = self.tok_encode(prev_char + segment)
+            tokens = tokens[len(prefix):] if tokens[:len(prefix)] == prefix else None
+
+        if cache:
+            self._cache[key] = tokens
+            if len(self._cache) > self.MAX_CACHED:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def _check_boundary(self, prev_segment, segment):
+        """Whether the tokens around the boundary of two segments are the tokens of
+        the end of the first one followed by the tokens of the start of the second
+        one, tokenized as in `encode`."""
+        key = (prev_segment[-self.WINDOW:], segment[:self.WINDOW])
+        if key in self._boundaries:
+            self._boundaries.move_to_end(key)
+            return self._boundaries[key]
+
+        end, start = key
+        start_tokens = self._encode_segment(end[-1], start, cache=False)
+        split = start_tokens is not None and self.tok_encode(end + start) == self.tok_encode(end) + start_tokens
+
+        self._boundaries[key] = split
+        if len(self._boundaries) > self.MAX_CACHED:
+            self._boundaries.popitem(last=False)
+        return split
+
+    def _encode_whole(self, prompt):
+        self.num_whole += 1
+        if not self.num_prompts and self.num_whole >= self.VERIFY_FIRST:
+            print(
+                "WARNING: the segmented prompts can't be split with this tokenizer, "
+                "the prompts are tokenized whole from now on"
+            )
+            self.enabled = False
+            self._cache.clear()
+            self._boundaries.clear()
+        return self.tok_encode(str(prompt))
+
+    def encode(self, prompt):
+        """Returns the tokens of a prompt, from its segments if it is a SegmentedPrompt."""
+        segments = getattr(prompt, "segments", None)
+        if not self.enabled or not segments or len(segments) < 2:
+            return self.tok_encode(prompt)
+
+        # the prompt is split at the boundaries of its segments, or before the
+        # whitespace at their end when it is tokenized with the text that follows
+        # (e.g. byte-level BPE tokenizers put a space in the token of the next word)
+        pieces = [segments[0]]
+        for segment in segments[1:]:
+            prev_piece = pieces[-1]
+            stripped = prev_piece.rstrip()
+            whitespace = prev_piece[len(stripped):]
+            if self._check_boundary(prev_piece, segment):
+                pieces.append(segment)
+            elif stripped and whitespace and self._check_boundary(stripped, whitespace + segment):
+                pieces[-1] = stripped
+                pieces.append(whitespace + segment)
+            else:
+                return self._encode_whole(prompt)
+
+        tokens = []
+        prev_char = None
+        for i, piece in enumerate(pieces):
+            piece_tokens = self._encode_segment(prev_char, piece, cache=i < len(pieces) - 1)
+            if piece_tokens is None:
+                return self._encode_whole(prompt)
+            tokens.extend(piece_tokens)
+            prev_char = piece[-1]
+
+        self.num_prompts += 1
+        if self.num_prompts <= self.VERIFY_FIRST or self.num_prompts % self.VERIFY_EVERY == 0:
+            expected = self.tok_encode(str(prompt))
+            if tokens != expected:
+                print(
+                    "WARNING: the tokens of a segmented prompt differ from the tokens of the whole prompt "
+                    "with this tokenizer, the prompts are tokenized whole from now on"
+                )
+                self.enabled = False
+                self._cache.clear()
+                self._boundaries.clear()
+                return expected
+        return tokens
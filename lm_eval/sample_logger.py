@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _to_json(ob):
+    # numpy scalars and arrays
+    if hasattr(ob, "tolist"):
+        return ob.tolist()
+    return str(ob)
+
+
+class SampleLogger:
+    """Logs the requests, responses and metrics of every evaluated doc.
+
+    For each task and prompt mode, two JSONL files are written to `output_dir`:
+    - `{task}_{prompt_mode}_samples.jsonl`: one line per doc, with the requests
+      (prompt hash, remaining request args and response) and the doc metrics
+    - `{task}_{prompt_mode}_prompts.jsonl`: one line per distinct prompt, mapping
+      its hash to the full prompt, so few-shot prompts are not repeated per request
+
+    Serialization and writes happen in a background thread; `log` only enqueues the
+    objects it is given.
+    """
+
+    # maximum number of docs waiting to be written
+    QUEUE_SIZE = 10000
+    # size of the write buffer of each file, in bytes
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, output_dir, append=False):
+        """
+        :param output_dir: str
+            Directory of the sample files
+        :param append: bool
+            If True, samples are appended to the existing files (e.g. when resuming
+            a run). Otherwise existing files are overwritten
+        """
+        self.output_dir = output_dir
+        self.append = append
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._files = {}
+        self._seen_prompts = {}
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, name="lm_eval-sample-logger", daemon=True)
+        self._thread.start()
+
+    def log(self, task_name, prompt_mode, doc_id, reqs, resps, metrics):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((task_name, prompt_mode, doc_id, reqs, resps, metrics))
+
+    def close(self):
+        """Writes everything still queued and closes the files."""
+        self._queue.put(None)
+        self._thread.join()
+        for samples_file, prompts_file in self._files.values():
+            samples_file.close()
+            prompts_file.close()
+        self._files = {}
+        if self._error is not None:
+            raise self._error
+
+    def _get_files(self, task_name, prompt_mode):
+        key = (task_name, prompt_mode)
+        if key not in self._files:
+            mode = "a" if self.append else "w"
+            prefix = os.path.join(self.output_dir, f"{task_name}_{prompt_mode}")
+            self._files[key] = (
+                open(prefix + "_samples.jsonl", mode, encoding="utf-8", buffering=self.BUFFER_SIZE),
+                open(prefix + "_prompts.jsonl", mode, encoding="utf-8", buffering=self.BUFFER_SIZE),
+            )
+            seen = set()
+            if self.append and os.path.exists(prefix + "_prompts.jsonl"):
+                with open(prefix + "_prompts.jsonl", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            seen.add(json.loads(line)["hash"])
+                        except (json.JSONDecodeError, KeyError):
+                            continue
+            self._seen_prompts[key] = seen
+        return self._files[key], self._seen_prompts[key]
+
+    def _write(self, task_name, prompt_mode, doc_id, reqs, resps, metrics):
+        (samples_file, prompts_file), seen_prompts = self._get_files(task_name, prompt_mode)
+
+        requests = []
+        for req, resp in zip(reqs, resps):
+            prompt = req.args[0]
+            hsh = prompt_hash(prompt)
+            if hsh not in seen_prompts:
+                seen_prompts.add(hsh)
+                prompts_file.write(json.dumps({"hash": hsh, "prompt": prompt}, ensure_ascii=False) + "\n")
+
+            entry = {"type": req.request_type, "prompt": hsh}
+            if len(req.args) > 1:
+                entry["args"] = list(req.args[1:])
+            if req.index is not None:
+                entry["index"] = req.index
+            entry["response"] = resp
+            requests.append(entry)
+
+        line = json.dumps(
+            {"doc_id": doc_id, "requests": requests, "metrics": metrics},
+            ensure_ascii=False, separators=(",", ":"), default=_to_json,
+        )
+        samples_file.write(line + "\n")
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # keep draining the queue so `log` never blocks
+                continue
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._error = e
@@ -0,0 +1,116 @@
+import collections
+import os
+import pickle
+import sqlite3
+import tempfile
+
+
+def current_rss_mb():
+    """Returns the resident set size of the current process in MB, or None if it
+    cannot be measured on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 ** 2)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 ** 2)
+    except ImportError:
+        return None
+
+
+class SpillingItemStore:
+    """Stores per-document metric items grouped by key, spilling them to an
+    sqlite file once the process memory crosses `max_memory_mb`.
+
+    Items are always returned sorted by `doc_id`, so aggregations do not depend
+    on the order in which documents finished.
+    """
+
+    # how many additions between two memory checks; reading the rss is cheap
+    # but not free
+    CHECK_EVERY = 1000
+
+    def __init__(self, max_memory_mb=None, spill_dir=None):
+        """
+        :param max_memory_mb: float, optional
+            Memory threshold (resident set size, in MB) above which the buffered
+            items are moved to disk. If None, everything is kept in memory.
+        :param spill_dir: str, optional
+            Directory for the spill file. Defaults to the system temp dir.
+        """
+        self.max_memory_mb = max_memory_mb
+        self.spill_dir = spill_dir
+        self.buffer = collections.defaultdict(list)
+        self.keys = []
+        self._known_keys = set()
+        self._db = None
+        self._db_path = None
+        self._since_check = 0
+        self.n_spilled = 0
+
+        if self.max_memory_mb is not None and current_rss_mb() is None:
+            print("WARNING: unable to measure process memory on this platform, metric items will not be spilled to disk")
+            self.max_memory_mb = None
+
+    def add(self, key, doc_id, value):
+        if key not in self._known_keys:
+            self._known_keys.add(key)
+            self.keys.append(key)
+        self.buffer[key].append((doc_id, value))
+
+        self._since_check += 1
+        if self.max_memory_mb is not None and self._since_check >= self.CHECK_EVERY:
+            self._since_check = 0
+            if current_rss_mb() > self.max_memory_mb:
+                self.spill()
+
+    def spill(self):
+        """Moves every buffered item to the sqlite file."""
+        if not self.buffer:
+            return
+        db = self._get_db()
+        rows = []
+        for key, items in self.buffer.items():
+            key_blob = pickle.dumps(key)
+            for doc_id, value in items:
+                rows.append((key_blob, doc_id, pickle.dumps(value)))
+        db.executemany("INSERT INTO items (key, doc_id, value) VALUES (?, ?, ?)", rows)
+        db.commit()
+        self.n_spilled += len(rows)
+        self.buffer = collections.defaultdict(list)
+
+    def doc_items(self, key):
+        """Returns the (doc_id, value) pairs stored under `key`, sorted by doc_id."""
+        items = list(self.buffer.get(key, []))
+        if self._db is not None:
+            cursor = self._db.execute("SELECT doc_id, value FROM items WHERE key = ?", (pickle.dumps(key),))
+            items.extend((doc_id, pickle.loads(value)) for doc_id, value in cursor)
+        items.sort(key=lambda x: x[0])
+        return items
+
+    def items(self, key):
+        """Returns the values stored under `key`, sorted by doc_id."""
+        return [value for _, value in self.doc_items(key)]
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self._db_path)
+
+    def _get_db(self):
+        if self._db is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            fd, self._db_path = tempfile.mkstemp(prefix="lm_eval_spill_", suffix=".db", dir=self.spill_dir)
+            os.close(fd)
+            print(f"Memory above {self.max_memory_mb} MB, spilling metric items to {self._db_path}")
+            self._db = sqlite3.connect(self._db_path)
+            self._db.execute("CREATE TABLE items (key BLOB, doc_id INTEGER, value BLOB)")
+            self._db.execute("CREATE INDEX items_key ON items (key)")
+        return self._db
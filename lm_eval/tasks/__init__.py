@@ -1,30 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from typing import List, Union
 
-import sacrebleu
 import lm_eval.base
+import lm_eval.utils
 
 
-from . import arc
-
-from . import assin
-from . import faquad
-from . import big_bench
-from . import tweetsentbr
-from . import enem
-from . import massive
-from . import mkqa
-from . import agnewspt
-from . import imdbpt
-from . import sst2_pt
-from . import boolq_pt
-from . import wsc285_pt
-from . import bluex
-from . import poscomp
-from . import hatebr
-from . import storycloze_pt
-from . import pt_hate_speech
-
 ########################################
 # Translation tasks
 ########################################
@@ -36,18 +17,24 @@ gpt3_translation_benchmarks = {
 }
 
 
-# 28 total
-selected_translation_benchmarks = {
-    **gpt3_translation_benchmarks,
-    "wmt20": sacrebleu.get_langpairs_for_testset("wmt20"),
-    "iwslt17": ['en-ar', 'ar-en']  # Arabic
-}
+def __getattr__(name):
+    # computed on first access, as listing the sacrebleu test sets is slow
+    import sacrebleu
 
-# 319 total
-all_translation_benchmarks = {
-    ts: sacrebleu.get_langpairs_for_testset(ts)
-    for ts in sacrebleu.get_available_testsets()
-}
+    if name == "selected_translation_benchmarks":
+        # 28 total
+        return {
+            **gpt3_translation_benchmarks,
+            "wmt20": sacrebleu.get_langpairs_for_testset("wmt20"),
+            "iwslt17": ['en-ar', 'ar-en']  # Arabic
+        }
+    if name == "all_translation_benchmarks":
+        # 319 total
+        return {
+            ts: sacrebleu.get_langpairs_for_testset(ts)
+            for ts in sacrebleu.get_available_testsets()
+        }
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 ########################################
@@ -55,120 +42,121 @@ all_translation_benchmarks = {
 ########################################
 
 
-TASK_REGISTRY = {
+# "module:class" of each task, imported only when the task is used (see get_task)
+TASK_REGISTRY = lm_eval.utils.LazyRegistry(package="lm_eval.tasks", paths={
     
-    "broverbs_proverb_to_history_greedy": big_bench.BroverbsProverbToHistoryTaskGreedy,
-    "broverbs_history_to_proverb_greedy": big_bench.BroverbsHistoryToProverbTaskGreedy,
-    "bigbench_pt_analogical_similarity_greedy": big_bench.AnalogicalSimilarityTaskGreedy,
-    "bigbench_pt_code_line_description_greedy": big_bench.CodeLineDescriptionTaskGreedy,
-    "bigbench_pt_contextual_parametric_knowledge_conflicts_greedy": big_bench.ContextualParametricKnowledgeConflictsTaskGreedy,
-    "bigbench_pt_dark_humor_detection_greedy": big_bench.DarkHumorDetectionTaskGreedy,
-    "bigbench_pt_empirical_judgments_greedy": big_bench.EmpiricalJudgmentsTaskGreedy,
-    "bigbench_pt_formal_fallacies_syllogisms_negation_greedy": big_bench.FormalFallaciesSyllogismsNegationTaskGreedy,
-    "bigbench_pt_general_knowledge_greedy": big_bench.GeneralKnowledgeTaskGreedy,
-    "bigbench_pt_mathematical_induction_greedy": big_bench.MathematicalInductionTaskGreedy,
-    "bigbench_pt_simple_ethical_questions_greedy": big_bench.SimpleEthicalQuestionsTaskGreedy,
-    "bigbench_pt_strategyqa_greedy": big_bench.StrategyQATaskGreedy,
-    "bigbench_pt_vitaminc_fact_verification_greedy": big_bench.VitamincFactVerificationTaskGreedy,
-    "bigbench_pt_causal_judgment_greedy": big_bench.CausalJudgmentTaskGreedy,
-    "bigbench_pt_cause_and_effect_two_sentences_greedy": big_bench.CauseAndEffectTwoSentencesTaskGreedy,
-    "bigbench_pt_bbq_greedy": big_bench.BbqTaskGreedy,
-    "bigbench_pt_social_iqa_greedy": big_bench.SocialIQATaskGreedy,
+    "broverbs_proverb_to_history_greedy": "big_bench:BroverbsProverbToHistoryTaskGreedy",
+    "broverbs_history_to_proverb_greedy": "big_bench:BroverbsHistoryToProverbTaskGreedy",
+    "bigbench_pt_analogical_similarity_greedy": "big_bench:AnalogicalSimilarityTaskGreedy",
+    "bigbench_pt_code_line_description_greedy": "big_bench:CodeLineDescriptionTaskGreedy",
+    "bigbench_pt_contextual_parametric_knowledge_conflicts_greedy": "big_bench:ContextualParametricKnowledgeConflictsTaskGreedy",
+    "bigbench_pt_dark_humor_detection_greedy": "big_bench:DarkHumorDetectionTaskGreedy",
+    "bigbench_pt_empirical_judgments_greedy": "big_bench:EmpiricalJudgmentsTaskGreedy",
+    "bigbench_pt_formal_fallacies_syllogisms_negation_greedy": "big_bench:FormalFallaciesSyllogismsNegationTaskGreedy",
+    "bigbench_pt_general_knowledge_greedy": "big_bench:GeneralKnowledgeTaskGreedy",
+    "bigbench_pt_mathematical_induction_greedy": "big_bench:MathematicalInductionTaskGreedy",
+    "bigbench_pt_simple_ethical_questions_greedy": "big_bench:SimpleEthicalQuestionsTaskGreedy",
+    "bigbench_pt_strategyqa_greedy": "big_bench:StrategyQATaskGreedy",
+    "bigbench_pt_vitaminc_fact_verification_greedy": "big_bench:VitamincFactVerificationTaskGreedy",
+    "bigbench_pt_causal_judgment_greedy": "big_bench:CausalJudgmentTaskGreedy",
+    "bigbench_pt_cause_and_effect_two_sentences_greedy": "big_bench:CauseAndEffectTwoSentencesTaskGreedy",
+    "bigbench_pt_bbq_greedy": "big_bench:BbqTaskGreedy",
+    "bigbench_pt_social_iqa_greedy": "big_bench:SocialIQATaskGreedy",
     
     # bigbench en
-    "bigbench_en_analogical_similarity_greedy": big_bench.EnglishOriginalAnalogicalSimilarityTaskGreedy,
-    "bigbench_en_code_line_description_greedy": big_bench.EnglishOriginalCodeLineDescriptionTaskGreedy,
-    "bigbench_en_contextual_parametric_knowledge_conflicts_greedy": big_bench.EnglishOriginalContextualParametricKnowledgeConflictsTaskGreedy,
-    "bigbench_en_dark_humor_detection_greedy": big_bench.EnglishOriginalDarkHumorDetectionTaskGreedy,
-    "bigbench_en_empirical_judgments_greedy": big_bench.EnglishOriginalEmpiricalJudgmentsTaskGreedy,
-    "bigbench_en_formal_fallacies_syllogisms_negation_greedy": big_bench.EnglishOriginalFormalFallaciesSyllogismsNegationTaskGreedy,
-    "bigbench_en_general_knowledge_greedy": big_bench.EnglishOriginalGeneralKnowledgeTaskGreedy,
-    "bigbench_en_mathematical_induction_greedy": big_bench.EnglishOriginalMathematicalInductionTaskGreedy,
-    "bigbench_en_simple_ethical_questions_greedy": big_bench.EnglishOriginalSimpleEthicalQuestionsTaskGreedy,
-    "bigbench_en_strategyqa_greedy": big_bench.EnglishOriginalStrategyQATaskGreedy,
-    "bigbench_en_vitaminc_fact_verification_greedy": big_bench.EnglishOriginalVitamincFactVerificationTaskGreedy,
-    "bigbench_en_cause_and_effect_two_sentences_greedy": big_bench.EnglishOriginalCauseAndEffectTwoSentencesTaskGreedy,
-    "bigbench_en_bbq_greedy": big_bench.EnglishOriginalBbqTaskGreedy,
-    "bigbench_en_social_iqa_greedy": big_bench.EnglishOriginalSocialIQATaskGreedy,
-    "bigbench_en_causal_judgment_greedy": big_bench.EnglishOriginalCausalJudgmentTaskGreedy,
+    "bigbench_en_analogical_similarity_greedy": "big_bench:EnglishOriginalAnalogicalSimilarityTaskGreedy",
+    "bigbench_en_code_line_description_greedy": "big_bench:EnglishOriginalCodeLineDescriptionTaskGreedy",
+    "bigbench_en_contextual_parametric_knowledge_conflicts_greedy": "big_bench:EnglishOriginalContextualParametricKnowledgeConflictsTaskGreedy",
+    "bigbench_en_dark_humor_detection_greedy": "big_bench:EnglishOriginalDarkHumorDetectionTaskGreedy",
+    "bigbench_en_empirical_judgments_greedy": "big_bench:EnglishOriginalEmpiricalJudgmentsTaskGreedy",
+    "bigbench_en_formal_fallacies_syllogisms_negation_greedy": "big_bench:EnglishOriginalFormalFallaciesSyllogismsNegationTaskGreedy",
+    "bigbench_en_general_knowledge_greedy": "big_bench:EnglishOriginalGeneralKnowledgeTaskGreedy",
+    "bigbench_en_mathematical_induction_greedy": "big_bench:EnglishOriginalMathematicalInductionTaskGreedy",
+    "bigbench_en_simple_ethical_questions_greedy": "big_bench:EnglishOriginalSimpleEthicalQuestionsTaskGreedy",
+    "bigbench_en_strategyqa_greedy": "big_bench:EnglishOriginalStrategyQATaskGreedy",
+    "bigbench_en_vitaminc_fact_verification_greedy": "big_bench:EnglishOriginalVitamincFactVerificationTaskGreedy",
+    "bigbench_en_cause_and_effect_two_sentences_greedy": "big_bench:EnglishOriginalCauseAndEffectTwoSentencesTaskGreedy",
+    "bigbench_en_bbq_greedy": "big_bench:EnglishOriginalBbqTaskGreedy",
+    "bigbench_en_social_iqa_greedy": "big_bench:EnglishOriginalSocialIQATaskGreedy",
+    "bigbench_en_causal_judgment_greedy": "big_bench:EnglishOriginalCausalJudgmentTaskGreedy",
     
     # not actually from bigbench, just using the same format
-    "ethics_commonsense_test_hard_greedy": big_bench.EthicsCommonSenseHardTaskGreedy,
-    "inferbr_greedy": big_bench.InferBRTaskGreedy,
-    "repro_greedy": big_bench.ReproTaskGreedy,
-    "mina_br_greedy": big_bench.MinaBRTaskGreedy,
-    "math_mc_greedy": big_bench.MathMCTaskGreedy,
-    "gsm8k_mc_greedy": big_bench.GSM8KMCTaskGreedy,
-    "agieval_sat_math_greedy": big_bench.SATMathTaskGreedy,
-    "balanced_copa_greedy": big_bench.BalancedCopaTaskGreedy,
-    "logiqa_greedy": big_bench.LogiQATaskGreedy,
+    "ethics_commonsense_test_hard_greedy": "big_bench:EthicsCommonSenseHardTaskGreedy",
+    "inferbr_greedy": "big_bench:InferBRTaskGreedy",
+    "repro_greedy": "big_bench:ReproTaskGreedy",
+    "mina_br_greedy": "big_bench:MinaBRTaskGreedy",
+    "math_mc_greedy": "big_bench:MathMCTaskGreedy",
+    "gsm8k_mc_greedy": "big_bench:GSM8KMCTaskGreedy",
+    "agieval_sat_math_greedy": "big_bench:SATMathTaskGreedy",
+    "balanced_copa_greedy": "big_bench:BalancedCopaTaskGreedy",
+    "logiqa_greedy": "big_bench:LogiQATaskGreedy",
     
-    "assin_rte": assin.ASSIN_RTE,
-    "assin_rte_greedy": assin.ASSIN_RTE_GREEDY,
-    "assin_sts": assin.ASSIN_STS,
-    "assin_sts_greedy": assin.ASSIN_STS_GREEDY,
+    "assin_rte": "assin:ASSIN_RTE",
+    "assin_rte_greedy": "assin:ASSIN_RTE_GREEDY",
+    "assin_sts": "assin:ASSIN_STS",
+    "assin_sts_greedy": "assin:ASSIN_STS_GREEDY",
 
-    "faquad": faquad.FAQuAD,
+    "faquad": "faquad:FAQuAD",
 
-    "tweetsentbr": tweetsentbr.TweetSentBR,
-    "tweetsentbr_greedy": tweetsentbr.TweetSentBR_GREEDY,
+    "tweetsentbr": "tweetsentbr:TweetSentBR",
+    "tweetsentbr_greedy": "tweetsentbr:TweetSentBR_GREEDY",
 
-    "pt_hate_speech": pt_hate_speech.HateSpeechPT_Binary,
-    "pt_hate_speech_greedy": pt_hate_speech.HateSpeechPT_Greedy,
+    "pt_hate_speech": "pt_hate_speech:HateSpeechPT_Binary",
+    "pt_hate_speech_greedy": "pt_hate_speech:HateSpeechPT_Greedy",
 
-    "hatebr_binary": hatebr.HateBR_Binary,
-    "hatebr_multi": hatebr.HateBR_multiclass,
-    "hatebr_binary_greedy": hatebr.HateBR_Binary_Greedy,
-    "hatebr_multi_greedy": hatebr.HateBR_multiclass_Greedy,
+    "hatebr_binary": "hatebr:HateBR_Binary",
+    "hatebr_multi": "hatebr:HateBR_multiclass",
+    "hatebr_binary_greedy": "hatebr:HateBR_Binary_Greedy",
+    "hatebr_multi_greedy": "hatebr:HateBR_multiclass_Greedy",
 
     # StoryCloze pt
-    "storycloze_pt": storycloze_pt.StoryClozePT,
-    "storycloze_pt_greedy": storycloze_pt.StoryClozePT_Greedy,
+    "storycloze_pt": "storycloze_pt:StoryClozePT",
+    "storycloze_pt_greedy": "storycloze_pt:StoryClozePT_Greedy",
 
-    "bluex": bluex.BLUEX,
-    "bluex_greedy": bluex.BLUEX_GREEDY,
-    "bluex_recent": bluex.BLUEX_RECENT,
-    "bluex_launch_version_greedy": bluex.BLUEX_LAUNCH_VERSION_GREEDY,
+    "bluex": "bluex:BLUEX",
+    "bluex_greedy": "bluex:BLUEX_GREEDY",
+    "bluex_recent": "bluex:BLUEX_RECENT",
+    "bluex_launch_version_greedy": "bluex:BLUEX_LAUNCH_VERSION_GREEDY",
 
-    "poscomp": poscomp.POSCOMP,
-    "poscomp_greedy": poscomp.POSCOMP_GREEDY,
-    "poscomp_recent": poscomp.POSCOMP_RECENT,
-    "poscomp_recent_greedy": poscomp.POSCOMP_RECENT_GREEDY,
+    "poscomp": "poscomp:POSCOMP",
+    "poscomp_greedy": "poscomp:POSCOMP_GREEDY",
+    "poscomp_recent": "poscomp:POSCOMP_RECENT",
+    "poscomp_recent_greedy": "poscomp:POSCOMP_RECENT_GREEDY",
 
-    "enem": enem.ENEM,
-    "enem_2022": enem.ENEM_2022,
-    "enem_greedy": enem.ENEM_GREEDY,
-    "enem_2022_greedy": enem.ENEM_2022_GREEDY,
+    "enem": "enem:ENEM",
+    "enem_2022": "enem:ENEM_2022",
+    "enem_greedy": "enem:ENEM_GREEDY",
+    "enem_2022_greedy": "enem:ENEM_2022_GREEDY",
 
-    "massive": massive.MASSIVE,
-    "massive_greedy": massive.MASSIVE_GREEDY,
+    "massive": "massive:MASSIVE",
+    "massive_greedy": "massive:MASSIVE_GREEDY",
 
-    "mkqa": mkqa.MKQA,
-    "mkqa_greedy": mkqa.MKQA_GREEDY,
+    "mkqa": "mkqa:MKQA",
+    "mkqa_greedy": "mkqa:MKQA_GREEDY",
 
-    "agnews_pt": agnewspt.AGNewsPT,
-    "agnews_pt_greedy": agnewspt.AGNewsPT_GREEDY,
+    "agnews_pt": "agnewspt:AGNewsPT",
+    "agnews_pt_greedy": "agnewspt:AGNewsPT_GREEDY",
 
-    "imdb_pt": imdbpt.IMDBPT,
-    "imdb_pt_greedy": imdbpt.IMDBPT_GREEDY,
+    "imdb_pt": "imdbpt:IMDBPT",
+    "imdb_pt_greedy": "imdbpt:IMDBPT_GREEDY",
 
-    "sst2_pt": sst2_pt.SST2PT,
-    "sst2_pt_greedy": sst2_pt.SST2PT_GREEDY,
+    "sst2_pt": "sst2_pt:SST2PT",
+    "sst2_pt_greedy": "sst2_pt:SST2PT_GREEDY",
 
-    "boolq_pt": boolq_pt.BOOLQPT,
-    "boolq_pt_greedy": boolq_pt.BOOLQPT_GREEDY,
+    "boolq_pt": "boolq_pt:BOOLQPT",
+    "boolq_pt_greedy": "boolq_pt:BOOLQPT_GREEDY",
 
-    "wsc285_pt": wsc285_pt.WinogradSchemaChallenge285,
-    "wsc285_pt_greedy": wsc285_pt.WinogradSchemaChallenge285_GREEDY,
+    "wsc285_pt": "wsc285_pt:WinogradSchemaChallenge285",
+    "wsc285_pt_greedy": "wsc285_pt:WinogradSchemaChallenge285_GREEDY",
 
-    "arc_challenge_greedy": arc.ARC_CHALLENGE_greedy,
-    "arc_challenge_greedy_pt": arc.ARC_CHALLENGE_greedy_PT,
-    "arc_easy_greedy": arc.ARC_EASY_greedy,
-    "arc_easy_greedy_pt": arc.ARC_EASY_greedy_PT,
+    "arc_challenge_greedy": "arc:ARC_CHALLENGE_greedy",
+    "arc_challenge_greedy_pt": "arc:ARC_CHALLENGE_greedy_PT",
+    "arc_easy_greedy": "arc:ARC_EASY_greedy",
+    "arc_easy_greedy_pt": "arc:ARC_EASY_greedy_PT",
     
     
     
-}
+})
 
 
 ALL_TASKS = sorted(list(TASK_REGISTRY))
@@ -179,12 +167,13 @@ def get_task(task_name):
         return TASK_REGISTRY[task_name]
     except KeyError as e:
         print("Available tasks:")
-        pprint(TASK_REGISTRY)
+        pprint(ALL_TASKS)
         raise KeyError(f"Missing task {task_name}")
 
 
 def get_task_name_from_object(task_object):
-    for name, class_ in TASK_REGISTRY.items():
+    # only the tasks already imported can be the class of the object
+    for name, class_ in TASK_REGISTRY.loaded.items():
         if class_ is task_object:
             return name
 
@@ -192,13 +181,57 @@ def get_task_name_from_object(task_object):
     return task_object.EVAL_HARNESS_NAME if hasattr(task_object, "EVAL_HARNESS_NAME") else type(task_object).__name__
 
 
-def get_task_dict(task_name_list: List[Union[str, lm_eval.base.Task]]):
+class TaskLoadError(Exception):
+    pass
+
+
+def get_task_dict(task_name_list: List[Union[str, lm_eval.base.Task]], num_workers=1, strict=False, errors=None):
+    """Instantiates the tasks, `num_workers` at a time in a thread pool (downloading,
+    parsing and indexing the datasets is mostly I/O). The dict follows the order of
+    `task_name_list`.
+
+    A task that fails to load doesn't stop the others: it is left out of the dict,
+    and the run goes on with the tasks that loaded. A TaskLoadError is raised if no
+    task loaded.
+
+    :param strict: bool
+        If True, all the tasks are loaded, and then a TaskLoadError listing every
+        failure is raised if any task failed
+    :param errors: dict, optional
+        Filled with the exception of each task that failed to load
+    """
+    task_loaders = get_task_loaders(task_name_list)
+    with ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="lm_eval-task-loader") as executor:
+        futures = {task_name: executor.submit(load_task) for task_name, load_task in task_loaders.items()}
+
+    task_dict = {}
+    failures = {}
+    for task_name, future in futures.items():
+        try:
+            task_dict[task_name] = future.result()
+        except Exception as e:
+            print(f"WARNING: unable to load task {task_name}: {e!r}")
+            failures[task_name] = e
+    if errors is not None:
+        errors.update(failures)
+    if failures and (strict or not task_dict):
+        raise TaskLoadError(f"Unable to load the tasks {', '.join(failures)}") from next(iter(failures.values()))
+    if failures:
+        print(f"WARNING: evaluating without the tasks that failed to load: {', '.join(failures)}")
+    return task_dict
+
+
+def get_task_loaders(task_name_list: List[Union[str, lm_eval.base.Task]]):
+    """Like `get_task_dict`, but maps each task name to a function that returns the
+    task instance, so that tasks can be instantiated (downloaded, parsed, indexed)
+    only when they are needed.
+    """
     task_name_dict = {
-        task_name: get_task(task_name)()
+        task_name: get_task(task_name)
         for task_name in task_name_list if isinstance(task_name, str)
     }
     task_name_from_object_dict = {
-        get_task_name_from_object(task_object): task_object
+        get_task_name_from_object(task_object): (lambda task_object=task_object: task_object)
         for task_object in task_name_list if not isinstance(task_object, str)
     }
     assert set(task_name_dict.keys()).isdisjoint(set(task_name_from_object_dict.keys()))
@@ -13,13 +13,16 @@ from lm_eval.metrics import mean
 from datasets import load_dataset, load_from_disk
 import os
 import json
-import requests
 import random
+from concurrent.futures import ThreadPoolExecutor
+from lm_eval import mirror
 from lm_eval.base import ModelCategory
 
 _CITATION = """
 """
 
+RANDOM_SEED = 1234
+
 # first 4 general education questions from ENADE 2021 that does not require image understanding.
 
 
@@ -31,6 +34,7 @@ class BigBenchJsonTaskBase(MultipleChoicePromptSelectionTask):
         "https://github.com/google/BIG-bench/blob/main/bigbench/benchmark_tasks/X.json"
     )
     DATASET_NAME = None
+    CACHE_DOCS = True
 
     KEYS_TO_INDEX = ["input"]
     SEARCHER_K = 10
@@ -54,14 +58,14 @@ class BigBenchJsonTaskBase(MultipleChoicePromptSelectionTask):
             self.JSON_URL
         ), "LOCAL_PATH and JSON_URLs must have the same length"
 
-        for local_path, json_url in zip(self.LOCAL_PATH, self.JSON_URL):
-            # check if local path exists
-            if not os.path.exists(local_path):
-                # download json from url
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                response = requests.get(json_url)
-                with open(local_path, "w") as f:
-                    f.write(response.text)
+        # download the missing files concurrently, from the mirror if they are there
+        missing = [
+            (json_url, local_path)
+            for local_path, json_url in zip(self.LOCAL_PATH, self.JSON_URL)
+            if not os.path.exists(local_path)
+        ]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda x: mirror.download(*x), missing))
 
         # load data from all local paths
         big_bench_task_data = {}
@@ -71,23 +75,27 @@ class BigBenchJsonTaskBase(MultipleChoicePromptSelectionTask):
                 big_bench_task_data[local_path] = json.load(f)
                 all_examples.extend(big_bench_task_data[local_path]["examples"])
 
-        random.shuffle(all_examples)
+        self.rnd.shuffle(all_examples)
         big_bench_task_data["examples"] = all_examples
 
         return big_bench_task_data
 
+    def docs_cache_sources(self):
+        return self.LOCAL_PATH if isinstance(self.LOCAL_PATH, list) else [self.LOCAL_PATH]
+
     def download(self, data_dir=None, cache_dir=None, download_mode=None):
+        # each task shuffles with its own generator, so the shuffles don't depend on
+        # the other tasks loaded before or at the same time (see get_task_dict). The
+        # seed is the one set by the evaluator, so a single task is shuffled as before
+        self.rnd = random.Random(RANDOM_SEED)
 
         if isinstance(self.LOCAL_PATH, list):
             self.big_bench_task_data = self.handle_multiple_path_download()
         else:
             # check if local path exists
             if not os.path.exists(self.LOCAL_PATH):
-                # download json from url
-                os.makedirs(os.path.dirname(self.LOCAL_PATH), exist_ok=True)
-                response = requests.get(self.JSON_URL)
-                with open(self.LOCAL_PATH, "w") as f:
-                    f.write(response.text)
+                # download json from url, or from the mirror
+                mirror.download(self.JSON_URL, self.LOCAL_PATH)
 
             # load json from local path
             with open(self.LOCAL_PATH, "r") as f:
@@ -163,7 +171,7 @@ class BigBenchJsonTaskBase(MultipleChoicePromptSelectionTask):
 
             target_scores = list(doc["target_scores"].items())
             if self.shuffle_alternatives:
-                random.shuffle(target_scores)
+                self.rnd.shuffle(target_scores)
             letters = [
                 "A)",
                 "B)",
@@ -3,7 +3,6 @@ BLUEX is a dataset containing multiple choice questions extracted from the entra
 of two of the major Brazilian universities: University of São Paulo (USP) and University of Campinas (UNICAMP).
 """
 import collections
-import json
 import numpy as np
 import os
 import re
@@ -94,6 +93,7 @@ class BLUEX(MultipleChoicePromptSelectionTask):
 
     KEYS_TO_INDEX = ["context", "question"]
     SEARCHER_K = 10
+    PARTITION_KEY = "exam"
 
     tag = None
 
@@ -137,12 +137,11 @@ class BLUEX(MultipleChoicePromptSelectionTask):
 
         self.dataset["test"] = list(map(self._process_doc, self.dataset["test"]))
 
-    def create_collection_to_index(self):
-        """Creates a JSON collection to index. Overwrite this funtion to keep
+    def collection_to_index(self):
+        """Returns the collection to index. Overwrite this funtion to keep
         more arguments.
         """
-        with open(self.documents_to_index, "w") as f:
-            json.dump(self.dataset["test"], f)
+        return self.dataset["test"]
 
     def has_training_docs(self):
         return True
@@ -299,10 +298,7 @@ class BLUEX(MultipleChoicePromptSelectionTask):
     def fewshot_examples(self, k, rnd, prompt_mode, doc):
         # For each doc, limit the self._training_docs to examples from other exams.
         # We also remove the top-10 largest documents from the list of prompt candidates.
-        self._training_docs = []
-        for d in self.training_docs():
-            if d["exam"] != doc["exam"]:
-                self._training_docs.append(d)
+        self._training_docs = self.partition_pool(doc)
         if prompt_mode == "dynamic-random":
             return rnd.sample(self._training_docs, k)
 
@@ -310,10 +306,7 @@ class BLUEX(MultipleChoicePromptSelectionTask):
             return rnd.sample(self._training_docs[:k], k)
 
         elif prompt_mode == "manual":
-            _manual_docs = []
-            for d in self.manual_examples:
-                if d["exam"] != doc["exam"]:
-                    _manual_docs.append(d)
+            _manual_docs = self.partition_pool(doc, manual=True)
             assert k <= len(_manual_docs), (
                 f"The number of manual_examples is not enough to satisfy "
                 f"num_fewshot={k}. Please, include more examples."
@@ -8,6 +8,7 @@ The text-pair classification setup is similar to existing natural language infer
 Homepage: https://github.com/google-research-datasets/boolean-questions
 """
 import re
+from lm_eval import docs_cache
 from lm_eval.base import rf, PromptSelectionTask
 from lm_eval.metrics import mean
 
@@ -32,6 +33,7 @@ class BOOLQPT(PromptSelectionTask):
     VERSION = 0
     DATASET_PATH = "maritaca-ai/boolq_pt"
     DATASET_NAME = None
+    CACHE_DOCS = True
 
     KEYS_TO_INDEX = ['question', 'passage']
     KEY_TO_BALANCE = 'answer'
@@ -55,6 +57,9 @@ class BOOLQPT(PromptSelectionTask):
 
         self.dataset["validation"] = self.dataset["validation"].map(truncate)
 
+    def docs_cache_version(self):
+        return docs_cache.hub_revision(self.DATASET_PATH)
+
     def has_training_docs(self):
         return True
 
@@ -13,16 +13,14 @@ Homepage: https://www.ime.usp.br/~ddm/project/enem
 """
 import collections
 import datasets
-from io import BytesIO
 import json
 import numpy as np
 import os
 import re
-import urllib.request
-from urllib.request import urlopen
 import xml.etree.ElementTree as ET 
 from zipfile import ZipFile
 
+from lm_eval import mirror
 from lm_eval.base import rf, MultipleChoicePromptSelectionTask
 from lm_eval.metrics import mean
 
@@ -77,9 +75,11 @@ class ENEM(MultipleChoicePromptSelectionTask):
     VERSION = 0
     DATASET_PATH = 'data/enem'
     DATASET_NAME = None
+    CACHE_DOCS = True
 
     KEYS_TO_INDEX = ['context', 'question']
     SEARCHER_K = 10
+    PARTITION_KEY = 'exam'
 
     use_just_linguistic_and_humanities = False
     tag = None
@@ -119,8 +119,7 @@ class ENEM(MultipleChoicePromptSelectionTask):
         if not os.path.exists(self.DATASET_PATH):
             os.makedirs(self.DATASET_PATH, exist_ok=True)
             URL = "https://www.ime.usp.br/~ddm/project/enem/ENEMdataset.zip"
-            http_response = urlopen(URL)
-            zipfile = ZipFile(BytesIO(http_response.read()))
+            zipfile = ZipFile(mirror.fetch(URL))
             zipfile.extractall(path=self.DATASET_PATH)
 
         self.dataset = collections.defaultdict(list)
@@ -224,12 +223,14 @@ class ENEM(MultipleChoicePromptSelectionTask):
 
         return documents
 
-    def create_collection_to_index(self):
-        """ Creates a JSON collection to index. Overwrite this funtion to keep
+    def collection_to_index(self):
+        """ Returns the collection to index. Overwrite this funtion to keep
         more arguments.
         """
-        with open(self.documents_to_index, 'w') as f:
-            json.dump(self.dataset['train'], f)
+        return self.dataset['train']
+
+    def fewshot_query(self, doc):
+        return doc['contents']
 
     def has_training_docs(self):
         return True
@@ -323,13 +324,13 @@ class ENEM(MultipleChoicePromptSelectionTask):
             "unknown_pred": mean,
         }
 
+    def is_fewshot_candidate(self, doc):
+        return doc['id'] not in self.too_large
+
     def fewshot_examples(self, k, rnd, prompt_mode, doc):
         # For each doc, limit the self._training_docs to examples from other exams.
         # We also remove the top-10 largest documents from the list of prompt candidates.
-        self._training_docs = []
-        for d in self.training_docs():
-            if d['exam'] != doc['exam'] and d['id'] not in self.too_large:
-                self._training_docs.append(d)
+        self._training_docs = self.partition_pool(doc)
 
         if prompt_mode == 'dynamic-random':
             return rnd.sample(self._training_docs, k)
@@ -338,41 +339,17 @@ class ENEM(MultipleChoicePromptSelectionTask):
             return rnd.sample(self._training_docs[:k], k)
 
         elif prompt_mode == 'manual':
-            _manual_docs = []
-            for d in self.manual_examples:
-                if d['exam'] != doc['exam']:
-                    _manual_docs.append(d)
+            _manual_docs = self.partition_pool(doc, manual=True)
             assert k <= len(_manual_docs), (
                 f'The number of manual_examples is not enough to satisfy '
                 f'num_fewshot={k}. Please, include more examples.')
             return rnd.sample(_manual_docs, k)
             
         elif prompt_mode == 'dynamic-similar':
-            if self.searcher is None:
-                from pyserini.search.lucene import LuceneSearcher
-                
-                self.indexes_dir = os.path.join('data', self.DATASET_PATH, 'indexes')
-                self.documents_to_index = os.path.join(
-                    'data', self.DATASET_PATH, 'docs_to_index', 'documents.json')
-
-                # Index the training documents for dynamic-similar prompt mode.
-                # Run only once.
-                if not os.path.exists(self.indexes_dir):
-                    os.makedirs(os.path.dirname(self.documents_to_index), exist_ok=True)
-                    self.create_collection_to_index()
-                    self.indexing()
-
-                # Instantiate the searcher for dynamic-similar prompts.
-                self.searcher = LuceneSearcher(self.indexes_dir)
-                self.searcher.set_language('pt')
-
-            hits = self.searcher.search(doc['contents'], k=self.SEARCHER_K)
             selected_hits = []
 
-            for hit in hits:
-                hit = json.loads(hit.raw)
-
-                if hit['exam'] != doc['exam'] and hit['id'] not in self.too_large:
+            for hit in self.search(doc):
+                if hit['exam'] != doc['exam'] and self.is_fewshot_candidate(hit):
                     selected_hits.append(hit)
 
                 if len(selected_hits) == k:
@@ -405,7 +382,7 @@ class ENEM_2022(ENEM):
         if os.path.exists(fname):
             print(f"Reusing dataset enem-2022 ({self.DATASET_PATH})")
         else:
-            urllib.request.urlretrieve('https://raw.githubusercontent.com/piresramon/gpt-4-enem/main/data/enem/2022.json', fname)
+            mirror.download('https://raw.githubusercontent.com/piresramon/gpt-4-enem/main/data/enem/2022.json', fname)
 
         with open(fname) as f:
             documents = json.load(f)
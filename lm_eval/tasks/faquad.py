@@ -10,7 +10,7 @@ import os
 import json
 import numpy as np
 import datasets
-from urllib.request import urlretrieve
+from lm_eval import mirror
 from conversation import get_conv_template
 from math import exp
 from lm_eval import utils
@@ -63,8 +63,8 @@ class FAQuAD(PromptSelectionTask):
             print(f"Reusing dataset faquad ({self.DATASET_PATH})")
         else:
             os.makedirs(self.DATASET_PATH, exist_ok=True)
-            urlretrieve('https://raw.githubusercontent.com/liafacom/faquad/master/data/train.json', os.path.join(self.DATASET_PATH, "train.json"))
-            urlretrieve('https://raw.githubusercontent.com/liafacom/faquad/master/data/dev.json', os.path.join(self.DATASET_PATH, "dev.json"))
+            mirror.download('https://raw.githubusercontent.com/liafacom/faquad/master/data/train.json', os.path.join(self.DATASET_PATH, "train.json"))
+            mirror.download('https://raw.githubusercontent.com/liafacom/faquad/master/data/dev.json', os.path.join(self.DATASET_PATH, "dev.json"))
 
         self.dataset = {}
         self.dataset['train'] = [ sample for id, sample in self._generate_examples(self.DATASET_PATH + 'train.json')]
@@ -217,9 +217,11 @@ class FAQuAD(PromptSelectionTask):
         self, doc, num_fewshot, prompt_mode=None, provide_description=None, rnd=None, description=None, conversation_template=None, **kwargs
     ):
         # Those documents and respective dynamic contexts do not fit into 
-        # 2048-150 tokens. Decreasing the num_fewshot.
+        # 2048-150 tokens. Decreasing the num_fewshot, unless the contexts are
+        # fitted to the model with a token budget.
         if prompt_mode != 'fixed' and doc['id'] in \
-            ['bd6b3b2b1c7b4c49a3affa5ac5b54f31', '568a6fa71815493e865cc15dc4ea5a26'] and num_fewshot>0:
+            ['bd6b3b2b1c7b4c49a3affa5ac5b54f31', '568a6fa71815493e865cc15dc4ea5a26'] and num_fewshot>0 \
+            and kwargs.get('token_budget') is None:
             num_fewshot -= 1
 
         return super().fewshot_context(
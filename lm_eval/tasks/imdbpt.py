@@ -11,6 +11,7 @@ formats are provided. See the README file contained in the release for more deta
 Homepage: http://ai.stanford.edu/~amaas/data/sentiment/
 """
 import re
+from lm_eval import docs_cache
 from lm_eval.base import rf, PromptSelectionTask
 from lm_eval.metrics import mean
 
@@ -38,6 +39,7 @@ class IMDBPT(PromptSelectionTask):
     VERSION = 0
     DATASET_PATH = "maritaca-ai/imdb_pt"
     DATASET_NAME = None
+    CACHE_DOCS = True
 
     KEYS_TO_INDEX = ['text']
     KEY_TO_BALANCE = 'label'
@@ -71,6 +73,9 @@ class IMDBPT(PromptSelectionTask):
             for doc in self.dataset['test']
         ]
 
+    def docs_cache_version(self):
+        return docs_cache.hub_revision(self.DATASET_PATH)
+
     def has_training_docs(self):
         return True
 
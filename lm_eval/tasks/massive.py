@@ -18,9 +18,9 @@ import collections
 import json
 import numpy as np
 import os
-import requests
 from sklearn.metrics import f1_score
 import tarfile
+from lm_eval import mirror
 from lm_eval.base import rf, PromptSelectionTask
 from ..metrics import mean
 
@@ -130,8 +130,7 @@ class MASSIVE(PromptSelectionTask):
         if not os.path.exists(self.DATASET_PATH):
             os.makedirs(self.DATASET_PATH, exist_ok=True)
             URL = "https://amazon-massive-nlu-dataset.s3.amazonaws.com/amazon-massive-dataset-1.0.tar.gz"
-            response = requests.get(URL, stream=True)
-            file = tarfile.open(fileobj=response.raw, mode="r|gz")
+            file = tarfile.open(mirror.fetch(URL), mode="r:gz")
             file.extractall(path=self.DATASET_PATH)
 
         with open(os.path.join(self.DATASET_PATH, '1.0', 'data', 'pt-PT.jsonl')) as f:
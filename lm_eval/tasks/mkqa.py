@@ -15,17 +15,16 @@ model using in-context learning with leave-one-out validation protocol.
 
 """
 import collections
-import copy
 from gzip import GzipFile
 import re
 import os
 import json
 from math import exp
 from lm_eval.base import rf, PromptSelectionTask
-from functools import partial
+from functools import lru_cache, partial
 from lm_eval.metrics import yesno
 from lm_eval.custom_eval.mkqa import mkqa_eval
-from urllib.request import urlretrieve
+from lm_eval import mirror
 
 
 _CITATION = """
@@ -37,15 +36,33 @@ _CITATION = """
 }
 """
 
-def _mkqa_agg(key, items):
-
-    annotations = mkqa_eval.read_annotations('data/mkqa/mkqa.jsonl.gz')['pt']
-    predictions = mkqa_eval.process_predictions(items)
-    metrics = mkqa_eval.evaluate(
-        annotations, predictions, language='pt', verbose=False, print_metrics=False
+@lru_cache(maxsize=None)
+def _load_annotations(gold_path, language='pt'):
+    """Reads and normalizes the annotations once per process."""
+    annotations = mkqa_eval.read_annotations(gold_path, languages=[language])[language]
+    return annotations, mkqa_eval.normalize_annotations(annotations, language)
+
+
+@lru_cache(maxsize=4)
+def _mkqa_metrics(items):
+    annotations, normalized_answers = _load_annotations('data/mkqa/mkqa.jsonl.gz')
+    predictions = mkqa_eval.process_predictions([
+        {"example_id": example_id, "prediction": prediction,
+         "binary_answer": binary_answer, "no_answer_prob": no_answer_prob}
+        for example_id, prediction, binary_answer, no_answer_prob in items
+    ])
+    return mkqa_eval.evaluate_single_pass(
+        annotations, predictions, language='pt', normalized_answers=normalized_answers
     )
 
-    return metrics[key]
+
+def _mkqa_agg(key, items):
+    # the six metrics get the same items, so they are all computed by the first one
+    items = tuple(
+        (item["example_id"], item["prediction"], item["binary_answer"], item["no_answer_prob"])
+        for item in items
+    )
+    return _mkqa_metrics(items)[key]
 
 _manual_examples = [
     # number_with_unit
@@ -143,6 +160,7 @@ _manual_examples = [
 class MKQA(PromptSelectionTask):
     VERSION = 1
     DATASET_PATH = "data/mkqa"
+    CACHE_DOCS = True
     
     KEYS_TO_INDEX = ['query']
     KEY_TO_BALANCE = None
@@ -163,8 +181,8 @@ class MKQA(PromptSelectionTask):
             print(f"Reusing dataset mkqa ({self.DATASET_PATH})")
         else:
             os.makedirs(self.DATASET_PATH, exist_ok=True)
-            urlretrieve('https://github.com/apple/ml-mkqa/raw/651b8cc85c407270b024157aff06ee6ab8c4fc6d/dataset/mkqa.jsonl.gz',
-                        os.path.join(self.DATASET_PATH, 'mkqa.jsonl.gz'))
+            mirror.download('https://github.com/apple/ml-mkqa/raw/651b8cc85c407270b024157aff06ee6ab8c4fc6d/dataset/mkqa.jsonl.gz',
+                            os.path.join(self.DATASET_PATH, 'mkqa.jsonl.gz'))
 
         self.dataset = collections.defaultdict(list)
         gzipped_input_file = open(os.path.join(self.DATASET_PATH, 'mkqa.jsonl.gz'), "rb")
@@ -198,8 +216,8 @@ class MKQA(PromptSelectionTask):
 
                 self.dataset['train'].append(example)
 
-    def create_collection_to_index(self):
-        """ Creates a JSON collection to index. Overwrite this funtion to keep
+    def collection_to_index(self):
+        """ Returns the collection to index. Overwrite this funtion to keep
         more arguments.
         """
         json_data = []
@@ -220,8 +238,7 @@ class MKQA(PromptSelectionTask):
 
             json_data.append(data)
 
-        with open(self.documents_to_index, 'w') as f:
-            json.dump(json_data, f)
+        return json_data
 
     def has_training_docs(self):
         return True
@@ -342,51 +359,26 @@ class MKQA(PromptSelectionTask):
 
         if prompt_mode == 'dynamic-random':
             # Ignore the current document
-            _training_docs = copy.copy(self.training_docs())
-            _training_docs.remove(doc)
-            return rnd.sample(_training_docs, k)
+            return self.sample_fewshot_docs(
+                k, rnd, self._training_docs, exclude=self.training_doc_index(doc))
 
         elif prompt_mode == 'fixed':
             # Ignore the current document
-            _training_docs = copy.copy(self.training_docs())
-            _training_docs.remove(doc)
-            return rnd.sample(_training_docs[:k], k)
+            return self.sample_fewshot_docs(
+                k, rnd, self._training_docs, exclude=self.training_doc_index(doc), limit=k)
 
         elif prompt_mode == 'manual':
             assert k <= len(self.manual_examples), (
                 f'The number of manual_examples is not enough to satisfy '
                 f'num_fewshot={k}. Please, include more examples.')
             # Ignore the current document
-            _manual_examples = copy.copy(self.manual_examples)
-            if doc in _manual_examples:
-                _manual_examples.remove(doc)
-            return rnd.sample(_manual_examples, k)
+            exclude = self.manual_examples.index(doc) if doc in self.manual_examples else None
+            return self.sample_fewshot_docs(k, rnd, self.manual_examples, exclude=exclude)
 
         elif prompt_mode == 'dynamic-similar':
-            if self.searcher is None:
-                from pyserini.search.lucene import LuceneSearcher
-                
-                self.indexes_dir = os.path.join('data', self.DATASET_PATH, 'indexes')
-                self.documents_to_index = os.path.join(
-                    'data', self.DATASET_PATH, 'docs_to_index', 'documents.json')
-
-                # Index the training documents for dynamic-similar prompt mode.
-                # Run only once.
-                if not os.path.exists(self.indexes_dir):
-                    os.makedirs(os.path.dirname(self.documents_to_index), exist_ok=True)
-                    self.create_collection_to_index()
-                    self.indexing()
-
-                # Instantiate the searcher for dynamic-similar prompts.
-                self.searcher = LuceneSearcher(self.indexes_dir)
-                self.searcher.set_language('pt')
-
-            hits = self.searcher.search(doc['query'], k=self.SEARCHER_K)
             indices = []
 
-            for hit in hits:
-                hit = json.loads(hit.raw)
-
+            for hit in self.search(doc):
                 # Ignore the current document
                 if hit['example_id'] == doc['example_id']:
                     continue
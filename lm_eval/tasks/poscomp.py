@@ -3,7 +3,6 @@ POSCOMP is a dataset containing multiple choice questions extracted from pos gra
 """
 
 import collections
-import json
 import numpy as np
 import os
 import re
@@ -133,6 +132,7 @@ class POSCOMP(MultipleChoicePromptSelectionTask):
 
     KEYS_TO_INDEX = ["context", "question"]
     SEARCHER_K = 10
+    PARTITION_KEY = "exam"
 
     tag = None
 
@@ -178,12 +178,14 @@ class POSCOMP(MultipleChoicePromptSelectionTask):
 
         self.dataset["test"] = list(map(self._process_doc, self.dataset["test"]))
 
-    def create_collection_to_index(self):
-        """Creates a JSON collection to index. Overwrite this funtion to keep
+    def collection_to_index(self):
+        """Returns the collection to index. Overwrite this funtion to keep
         more arguments.
         """
-        with open(self.documents_to_index, "w") as f:
-            json.dump(self.dataset["test"], f)
+        return self.dataset["test"]
+
+    def fewshot_query(self, doc):
+        return doc["contents"]
 
     def has_training_docs(self):
         return True
@@ -308,24 +310,21 @@ class POSCOMP(MultipleChoicePromptSelectionTask):
             **subjects_agg_dict,
         }
 
+    def fewshot_candidate_docs(self):
+        return self.test_docs()
+
     def fewshot_examples(self, k, rnd, prompt_mode, doc):
         # For each doc, limit the self._training_docs to examples from other exams.
         # We also remove the top-10 largest documents from the list of prompt candidates.
-        self._training_docs = []
-        for d in self.test_docs():
-            if d["exam"] != doc["exam"]:
-                self._training_docs.append(d)
+        self._training_docs = self.partition_pool(doc)
         if prompt_mode == "dynamic-random":
             return rnd.sample(self._training_docs, k)
 
         elif prompt_mode == "fixed":
-            return rnd.sample(self._test_docs[:k], k)
+            return rnd.sample(self._training_docs[:k], k)
 
         elif prompt_mode == "manual":
-            _manual_docs = []
-            for d in self.manual_examples:
-                if d["exam"] != doc["exam"]:
-                    _manual_docs.append(d)
+            _manual_docs = self.partition_pool(doc, manual=True)
             assert k <= len(_manual_docs), (
                 f"The number of manual_examples is not enough to satisfy "
                 f"num_fewshot={k}. Please, include more examples."
@@ -333,31 +332,9 @@ class POSCOMP(MultipleChoicePromptSelectionTask):
             return rnd.sample(_manual_docs, k)
 
         elif prompt_mode == "dynamic-similar":
-            if self.searcher is None:
-                from pyserini.search.lucene import LuceneSearcher
-
-                self.indexes_dir = os.path.join("data", self.DATASET_PATH, "indexes")
-                self.documents_to_index = os.path.join(
-                    "data", self.DATASET_PATH, "docs_to_index", "documents.json"
-                )
-
-                # Index the training documents for dynamic-similar prompt mode.
-                # Run only once.
-                if not os.path.exists(self.indexes_dir):
-                    os.makedirs(os.path.dirname(self.documents_to_index), exist_ok=True)
-                    self.create_collection_to_index()
-                    self.indexing()
-
-                # Instantiate the searcher for dynamic-similar prompts.
-                self.searcher = LuceneSearcher(self.indexes_dir)
-                self.searcher.set_language("pt")
-
-            hits = self.searcher.search(doc["contents"], k=self.SEARCHER_K)
             selected_hits = []
 
-            for hit in hits:
-                hit = json.loads(hit.raw)
-
+            for hit in self.search(doc):
                 if hit["exam"] != doc["exam"]:
                     selected_hits.append(hit)
 
@@ -6,10 +6,10 @@ import re
 import numpy as np
 import pandas as pd
 from sklearn.metrics import f1_score
+from lm_eval import mirror
 from lm_eval.base import rf, PromptSelectionTask
 from ..metrics import mean
 import collections
-import requests
 import re
 
 _manual_examples=[
@@ -39,10 +39,7 @@ class HateSpeechPT_Binary(PromptSelectionTask):
         if not os.path.exists(self.DATASET_LOCAL_PATH):
             
             # download the dataset
-            request=requests.get(self.DATASET_URL)
-            os.makedirs(os.path.dirname(self.DATASET_LOCAL_PATH), exist_ok=True)
-            with open(self.DATASET_LOCAL_PATH, "w") as f:
-                f.write(request.text)   
+            mirror.download(self.DATASET_URL, self.DATASET_LOCAL_PATH)
 
         self.dataset_pd = pd.read_csv(self.DATASET_LOCAL_PATH)
         
@@ -23,14 +23,13 @@ Homepages:
 https://cs.nyu.edu/~davise/papers/WinogradSchemas/WS.html
 https://github.com/gabimelo/portuguese_wsc
 """
-import copy
 import json
 import re
 import numpy as np
 import os
 from lm_eval.base import rf, PromptSelectionTask
 from lm_eval.metrics import mean
-from urllib.request import urlretrieve
+from lm_eval import mirror
 
 
 _CITATION = """
@@ -331,8 +330,8 @@ class WinogradSchemaChallenge285(PromptSelectionTask):
             print(f"Reusing dataset wsc285_pt ({self.DATASET_PATH})")
         else:
             os.makedirs(self.DATASET_PATH, exist_ok=True)
-            urlretrieve('https://raw.githubusercontent.com/gabimelo/portuguese_wsc/master/data/processed/portuguese_wsc_portuguese_names.json',
-                        os.path.join(self.DATASET_PATH, 'portuguese_wsc_portuguese_names.json'))
+            mirror.download('https://raw.githubusercontent.com/gabimelo/portuguese_wsc/master/data/processed/portuguese_wsc_portuguese_names.json',
+                            os.path.join(self.DATASET_PATH, 'portuguese_wsc_portuguese_names.json'))
 
         self.dataset = {}
         fname = os.path.join(self.DATASET_PATH, 'portuguese_wsc_portuguese_names.json')
@@ -442,54 +441,26 @@ class WinogradSchemaChallenge285(PromptSelectionTask):
 
         if prompt_mode == 'dynamic-random':
             # Ignore the current document
-            _training_docs = copy.copy(self.training_docs())
-            _training_docs.remove(doc)
-            return rnd.sample(_training_docs, k)
+            return self.sample_fewshot_docs(
+                k, rnd, self._training_docs, exclude=self.training_doc_index(doc))
 
         elif prompt_mode == 'fixed':
             # Ignore the current document
-            _training_docs = copy.copy(self.training_docs())
-            _training_docs.remove(doc)
-            return rnd.sample(_training_docs[:k], k)
+            return self.sample_fewshot_docs(
+                k, rnd, self._training_docs, exclude=self.training_doc_index(doc), limit=k)
 
         elif prompt_mode == 'manual':
             assert k <= len(self.manual_examples), (
                 f'The number of manual_examples is not enough to satisfy '
                 f'num_fewshot={k}. Please, include more examples.')
             # Ignore the current document
-            _manual_examples = copy.copy(self.manual_examples)
-            if doc in _manual_examples:
-                _manual_examples.remove(doc)
-            return rnd.sample(_manual_examples, k)
+            exclude = self.manual_examples.index(doc) if doc in self.manual_examples else None
+            return self.sample_fewshot_docs(k, rnd, self.manual_examples, exclude=exclude)
 
         elif prompt_mode == 'dynamic-similar':
-            if self.searcher is None:
-                from pyserini.search.lucene import LuceneSearcher
-                
-                self.indexes_dir = os.path.join('data', self.DATASET_PATH, 'indexes')
-                self.documents_to_index = os.path.join(
-                    'data', self.DATASET_PATH, 'docs_to_index', 'documents.json')
-
-                # Index the training documents for dynamic-similar prompt mode.
-                # Run only once.
-                if not os.path.exists(self.indexes_dir):
-                    os.makedirs(os.path.dirname(self.documents_to_index), exist_ok=True)
-                    self.create_collection_to_index()
-                    self.indexing()
-
-                # Instantiate the searcher for dynamic-similar prompts.
-                self.searcher = LuceneSearcher(self.indexes_dir)
-                self.searcher.set_language('pt')
-
-            hits = self.searcher.search(
-                '. '.join(doc[key] for key in self.KEYS_TO_INDEX),
-                k=self.SEARCHER_K
-            )
             indices = []
 
-            for hit in hits:
-                hit = json.loads(hit.raw)
-
+            for hit in self.search(doc):
                 # Ignore the current document
                 if hit['id'] == doc['question_id']:
                     continue
@@ -2,11 +2,11 @@ import os
 import pathlib
 import re
 import collections
+import collections.abc
 import functools
+import importlib
 import inspect
 import sys
-import pytest
-import transformers
 from typing import List
 
 
@@ -147,6 +147,80 @@ class Reorderer:
         
         return res
 
+
+class SampleView(collections.abc.Sequence):
+    """Read-only view of some elements of a sequence, without copying them: the
+    elements at `indices` (all of them by default), without the one at position
+    `exclude` of the view, and only the first `limit` of the rest.
+
+    `random.Random.sample` only uses the length of its population and the elements at
+    the positions it draws, so sampling from a view gives the same elements as
+    sampling from the equivalent list, in O(k) instead of O(len(seq)) for large
+    populations.
+    """
+
+    def __init__(self, seq, indices=None, exclude=None, limit=None):
+        self.seq = seq
+        self.indices = indices
+        self.exclude = exclude
+        size = len(seq) if indices is None else len(indices)
+        if exclude is not None:
+            assert 0 <= exclude < size
+            size -= 1
+        self.size = size if limit is None else min(size, limit)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        if self.exclude is not None and i >= self.exclude:
+            i += 1
+        return self.seq[i if self.indices is None else self.indices[i]]
+
+
+class LazyRegistry(collections.abc.MutableMapping):
+    """Registry mapping names to objects given as "module:attribute" paths. A module
+    is imported the first time one of its objects is looked up, so the modules of
+    the objects that are never used are never imported.
+    """
+
+    def __init__(self, paths, package=None):
+        """
+        :param paths: dict[str, str]
+            "module:attribute" path of each object. Modules are relative to `package`
+        :param package: str, optional
+            Package of the modules, e.g. "lm_eval.tasks"
+        """
+        self.paths = dict(paths)
+        self.package = package
+        self.loaded = {}
+
+    def __setitem__(self, name, obj):
+        """Registers an object (e.g. a class defined outside of the package) directly."""
+        self.paths[name] = None
+        self.loaded[name] = obj
+
+    def __delitem__(self, name):
+        del self.paths[name]
+        self.loaded.pop(name, None)
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            module_name, attribute = self.paths[name].split(":")
+            if self.package is not None:
+                module_name = f"{self.package}.{module_name}"
+            self.loaded[name] = getattr(importlib.import_module(module_name), attribute)
+        return self.loaded[name]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
 def positional_deprecated(fn):
     """
     A decorator to nudge users into passing only keyword args (`kwargs`) to the 
@@ -186,62 +260,8 @@ def run_task_tests(task_list: List[str]):
     task_string = ' or '.join(task_list)
     args = [f'{package_root}/tests/test_version_stable.py', f'--rootdir={package_root}', '-k', f'{task_string}']
     sys.path.append(str(package_root))
+    import pytest
+
     pytest_return_val = pytest.main(args)
     if pytest_return_val:
         raise ValueError(f"Not all tests for the specified tasks ({task_list}) ran successfully! Error code: {pytest_return_val}")
-
-class MultiTokenEOSCriteria(transformers.StoppingCriteria):
-    """Criteria to stop on the specified multi-token sequence."""
-
-    def __init__(
-        self,
-        sequence: str,
-        tokenizer: transformers.PreTrainedTokenizer,
-        initial_decoder_input_length: int,
-        batch_size: int,
-    ) -> None:
-        self.initial_decoder_input_length = initial_decoder_input_length
-        self.done_tracker = [False] * batch_size
-        self.sequence = sequence
-        self.sequence_ids = tokenizer.encode(sequence, add_special_tokens=False)
-        # print(sequence, self.sequence_ids)
-        # we look back for 2 more tokens than it takes to encode our stop sequence
-        # because tokenizers suck, and a model might generate `['\n', '\n']` but our `sequence` is `['\n\n']`
-        # and we don't want to mistakenly not stop a generation because our
-        # (string) stop sequence was output in a different tokenization
-
-        # NOTE: there is a minor danger that this will end up looking back 2 tokens into the past, into the inputs to the model,
-        # and stopping generation immediately as a result. With only 2 extra tokens of lookback, this risk is minimized
-        # Additionally, in lookback_ids_batch we should prevent ever looking back into the inputs as described.
-        self.sequence_id_len = len(self.sequence_ids) + 2
-        self.tokenizer = tokenizer
-
-    def __call__(self, input_ids, scores, **kwargs) -> bool:
-        # For efficiency, we compare the last n tokens where n is the number of tokens in the stop_sequence
-        lookback_ids_batch = input_ids[:, self.initial_decoder_input_length :]
-
-        lookback_ids_batch = lookback_ids_batch[:, -self.sequence_id_len :]
-
-        lookback_tokens_batch = self.tokenizer.batch_decode(lookback_ids_batch)
-
-        for i, done in enumerate(self.done_tracker):
-            if not done:
-                self.done_tracker[i] = self.sequence in lookback_tokens_batch[i]
-        return all(self.done_tracker)
-
-def stop_sequences_criteria(
-    tokenizer: transformers.PreTrainedTokenizer,
-    stop_sequences: List[str],
-    initial_decoder_input_length: int,
-    batch_size: int,
-) -> transformers.StoppingCriteriaList:
-    return transformers.StoppingCriteriaList(
-        [
-            *[
-                MultiTokenEOSCriteria(
-                    sequence, tokenizer, initial_decoder_input_length, batch_size
-                )
-                for sequence in stop_sequences
-            ],
-        ]
-    )
\ No newline at end of file
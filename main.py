@@ -3,14 +3,15 @@ import json
 import logging
 import os
 
-from lm_eval import tasks, evaluator
+from lm_eval import anchors, tasks, evaluator, planner, profiling
+from lm_eval.journal import RUN_ARGS_FILE
 
 logging.getLogger("openai").setLevel(logging.WARNING)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--model', required=True)
+    parser.add_argument('--model')
     parser.add_argument('--model_args', default="")
     parser.add_argument('--tasks', default="all_tasks")
     parser.add_argument('--provide_description', action="store_true")
@@ -25,7 +26,78 @@ def parse_args():
     parser.add_argument('--conversation_template', type=str, default=None)
     parser.add_argument('--prompt_as_single_user_message', action="store_true")
     parser.add_argument('--check_integrity', action="store_true")
-    return parser.parse_args()
+    parser.add_argument('--stream_window', type=int, default=None,
+                        help="Send requests to the model this many docs at a time, scoring docs as they complete")
+    parser.add_argument('--max_memory_mb', type=float, default=None,
+                        help="Spill per-doc metric items to disk when the process memory crosses this threshold")
+    parser.add_argument('--spill_dir', default=None)
+    parser.add_argument('--pipeline_depth', type=int, default=None,
+                        help="Load tasks and build contexts in the background, up to this many docs ahead of the model")
+    parser.add_argument('--fewshot_seed', type=int, default=None,
+                        help="Sample the few-shot examples of each doc with a generator seeded from the doc id and this seed")
+    parser.add_argument('--fewshot_manifest', default=None,
+                        help="JSON file of the few-shot examples of each doc: examples recorded there are reused, "
+                             "the ones selected for the other docs are added to it")
+    parser.add_argument('--fit_fewshot', action="store_true",
+                        help="Drop the longest few-shot examples of the contexts that don't fit in the max length of the "
+                             "model, leaving room for the continuations or generations")
+    parser.add_argument('--task_workers', type=int, default=4,
+                        help="Number of tasks instantiated (downloaded, parsed, indexed) concurrently")
+    parser.add_argument('--context_workers', type=int, default=None,
+                        help="Number of processes building the contexts. Requires --fewshot_seed")
+    parser.add_argument('--shard', default=None, metavar="i/N",
+                        help="Evaluate only the i-th of N deterministic partitions of the docs of each task")
+    parser.add_argument('--partial_output', default=None,
+                        help="Where to save the partial results of the shard (default: <output_path>.shard<i>.pkl). "
+                             "Merge them with scripts/merge_shards.py")
+    parser.add_argument('--ci_target', default=None,
+                        help="Stop evaluating a task once the 95%% confidence intervals of its metrics are within "
+                             "±ci_target, e.g. 0.01, or per task: enem_greedy=0.01,assin_rte=0.02")
+    parser.add_argument('--ci_round_size', type=int, default=100,
+                        help="Number of docs of a task evaluated between two --ci_target checks")
+    parser.add_argument('--ci_min_docs', type=int, default=200,
+                        help="Number of docs of a task evaluated before --ci_target can stop it")
+    parser.add_argument('--profile', action="store_true",
+                        help="Print a per-phase and per-task breakdown of where the time went at the end of the run")
+    parser.add_argument('--trace_path', default=None,
+                        help="Save the profiled spans to this file as a Chrome trace (implies --profile)")
+    parser.add_argument('--plan', action="store_true",
+                        help="Build every request without running the model and report the expected tokens, time and cost")
+    parser.add_argument('--tokenizer', default=None,
+                        help="Hugging Face tokenizer used by --plan to count tokens (default: from --model_args)")
+    parser.add_argument('--throughput', default=None,
+                        help="JSON throughput profile used by --plan to estimate time and cost: configured "
+                             "(see lm_eval.planner.plan) or the .profile.json saved by a --profile run")
+    parser.add_argument('--quick', default=None, metavar="ANCHORS_PATH",
+                        help="Evaluate only the anchor docs selected by scripts/select_anchors.py and estimate the full scores")
+    parser.add_argument('--task_configs', default=None,
+                        help="Task configs (e.g. configs/poeta_v2_full.json) used to estimate the NPM in --quick mode")
+    parser.add_argument('--run_dir', default=None,
+                        help="Journal every completed request and doc to this directory, so the run can be resumed")
+    parser.add_argument('--resume', default=None, metavar="RUN_DIR",
+                        help="Continue the run journaled in RUN_DIR with the arguments it was started with. "
+                             "Arguments also given on the command line (e.g. --device of the worker resuming "
+                             "the run) override the saved ones")
+    args = parser.parse_args()
+
+    if args.resume:
+        run_dir = args.resume
+        overrides = {
+            name: value for name, value in vars(args).items()
+            if name != "resume" and value != parser.get_default(name)
+        }
+        with open(os.path.join(run_dir, RUN_ARGS_FILE)) as f:
+            args = argparse.Namespace(**json.load(f))
+        vars(args).update(overrides)
+        args.run_dir = run_dir
+    elif args.run_dir:
+        os.makedirs(args.run_dir, exist_ok=True)
+        with open(os.path.join(args.run_dir, RUN_ARGS_FILE), "w") as f:
+            json.dump(vars(args), f, indent=2)
+
+    if not args.model:
+        parser.error("--model is required unless resuming a run")
+    return args
 
 
 def main():
@@ -35,8 +107,10 @@ def main():
     if args.limit:
         print("WARNING: --limit SHOULD ONLY BE USED FOR TESTING. REAL METRICS SHOULD NOT BE COMPUTED USING LIMIT.")
 
+    anchor_spec = anchors.load_anchors(args.quick) if args.quick else None
+
     if args.tasks == "all_tasks":
-        task_names = tasks.ALL_TASKS
+        task_names = sorted(anchor_spec["tasks"]) if anchor_spec else tasks.ALL_TASKS
     else:
         task_names = args.tasks.split(",")
         
@@ -48,6 +122,29 @@ def main():
         with open(args.description_dict_path, 'r') as f:
             description_dict = json.load(f)
 
+    if args.plan:
+        result = planner.plan(
+            model=args.model,
+            model_args=args.model_args,
+            tasks=task_names,
+            num_fewshot=args.num_fewshot,
+            prompt_modes=prompt_modes,
+            limit=args.limit,
+            description_dict=description_dict,
+            conversation_template=args.conversation_template,
+            prompt_as_single_user_message=args.prompt_as_single_user_message,
+            fewshot_seed=args.fewshot_seed,
+            tokenizer=args.tokenizer,
+            throughput=planner.load_throughput(args.throughput) if args.throughput else None,
+        )
+        dumped = json.dumps(result, indent=2)
+        print(dumped)
+        if args.output_path:
+            with open(args.output_path, "w") as f:
+                f.write(dumped)
+        print(planner.make_plan_table(result))
+        return
+
     if args.output_path:
         output_dir = os.path.dirname(args.output_path)
         # if output path is a file (e.g "output.txt") in the current directory, output_dir will be empty
@@ -55,6 +152,28 @@ def main():
             output_dir = "."
     else:
         output_dir = None
+
+    if args.profile or args.trace_path:
+        profiling.PROFILER.enable()
+
+    ci_target = None
+    if args.ci_target:
+        if "=" in args.ci_target:
+            ci_target = {}
+            for task_target in args.ci_target.split(","):
+                task_name, target = task_target.split("=")
+                ci_target[task_name] = float(target)
+        else:
+            ci_target = float(args.ci_target)
+
+    shard = None
+    partial_output = args.partial_output
+    if args.shard:
+        shard = evaluator.parse_shard(args.shard)
+        if partial_output is None:
+            assert args.output_path, "--shard requires --output_path or --partial_output"
+            partial_output = f"{args.output_path}.shard{shard[0]}.pkl"
+
     results = evaluator.simple_evaluate(
         model=args.model,
         model_args=args.model_args,
@@ -70,8 +189,29 @@ def main():
         prompt_as_single_user_message=args.prompt_as_single_user_message,
         check_integrity=args.check_integrity,
         output_dir=output_dir,
+        stream_window=args.stream_window,
+        max_memory_mb=args.max_memory_mb,
+        spill_dir=args.spill_dir,
+        run_dir=args.run_dir,
+        pipeline_depth=args.pipeline_depth,
+        fewshot_seed=args.fewshot_seed,
+        context_workers=args.context_workers,
+        shard=shard,
+        partial_output=partial_output,
+        ci_target=ci_target,
+        ci_round_size=args.ci_round_size,
+        ci_min_docs=args.ci_min_docs,
+        anchors=anchor_spec,
+        task_workers=args.task_workers,
+        fewshot_manifest=args.fewshot_manifest,
+        fit_fewshot=args.fit_fewshot,
     )
 
+    if anchor_spec and args.task_configs:
+        with open(args.task_configs) as f:
+            task_configs = json.load(f)
+        results["npm_estimate"] = anchors.estimate_npm(results, task_configs, prompt_modes[0])
+
     dumped = json.dumps(results, indent=2)
     
     print(dumped)
@@ -85,6 +225,24 @@ def main():
         f"num_fewshot: {args.num_fewshot}, batch_size: {args.batch_size}"
     )
     print(evaluator.make_table(results))
+    if "task_load_errors" in results:
+        print(f"WARNING: tasks not evaluated because they failed to load: {', '.join(results['task_load_errors'])}")
+    if "npm_estimate" in results:
+        npm = results["npm_estimate"]
+        print("Estimated NPM from anchors:")
+        for name in ["All", "Translated", "Native"]:
+            if f"NPM.{name}" in npm:
+                error = npm.get(f"NPM.{name}_error")
+                print(f"{name}: {npm[f'NPM.{name}']:.2f}" + (f" ± {error:.2f}" if error is not None else ""))
+
+    if profiling.PROFILER.enabled:
+        print(profiling.PROFILER.summary())
+        if args.output_path:
+            # measured throughput, usable by --plan --throughput
+            with open(f"{args.output_path}.profile.json", "w") as f:
+                json.dump({"tasks": {str(task): stats for task, stats in profiling.PROFILER.task_stats().items()}}, f, indent=2)
+        if args.trace_path:
+            profiling.PROFILER.export_chrome_trace(args.trace_path)
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,107 @@
 # Script to download, convert and evaluate checkpoints.
 # Assumes you are logged in with the gcloud cli in an account that is able to access any necessary bucket.
+#
+# With --queue, the task configs are jobs of a queue shared by any number of workers, e.g. one per GPU:
+#   python scripts/bulk_evaluation.py ... --queue /shared/exp123.queue --device cuda:0 &
+#   python scripts/bulk_evaluation.py ... --queue /shared/exp123.queue --device cuda:1 &
+# Each worker evaluates whichever job is next; the jobs of a worker that dies are taken over by
+# another one after --lease_seconds, and continue from the run journal. Workers wait until every job
+# is finished, and then one of them computes the NPM.
 
 import argparse
 import inspect
 import json
 import os
+import sys
 from collections import defaultdict
 from pathlib import Path
 from subprocess import run
 from typing import List
 
 import pandas as pd
-import wandb
+
+try:
+    import wandb
+except ImportError:
+    # only needed by the model configs with log_to_wandb
+    wandb = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from lm_eval.jobqueue import FAILED, JobQueue, default_worker_id
+
+
+def build_eval_command(task_config, prompt_mode, model_command, results_save_file, run_dir):
+    """Returns the main.py command that evaluates a task config, or resumes its
+    evaluation if it was interrupted.
+
+    :param model_command: str
+        Model arguments of the main.py command, see `eval_hf_checkpoint_or_api`
+    :param run_dir: str
+        Directory where the requests and docs of the run are journaled
+    """
+    if os.path.isfile(Path(run_dir, "run_args.json")):
+        print(f"INFO: resuming the interrupted evaluation journaled in {run_dir}")
+        # the model arguments of this worker (e.g. its --device) override the ones
+        # of the worker that started the run
+        return f"python3 main.py --resume {run_dir} {model_command}"
+
+    limit = task_config.get("limit", None)
+    response_format = task_config.get("response_format", None)
+    return (
+        f"python3 main.py "
+        f"{model_command}"
+        f"--tasks {task_config['lm_eval_task']} "
+        f"--num_fewshot {task_config['num_fewshot']} "
+        f"--prompt_modes {prompt_mode} "
+        f"{f'--limit {limit}' if limit else ''} "
+        f"--output_path {results_save_file} "
+        f"{f'--response_format {response_format}' if response_format else ''} "
+        f"--no_cache "
+        f"--run_dir {run_dir} "
+    )
+
+
+def evaluate_task(task_config, prompt_mode, model_command, results_save_dir, checkpoint_number=-1, log_to_wandb=False):
+    """Evaluates the tasks of a task config, unless their results file already exists,
+    and logs the results to wandb.
+
+    :param model_command: str
+        Model arguments of the main.py command, see `eval_hf_checkpoint_or_api`
+    """
+    task_name = task_config['lm_eval_task']
+
+    print(f"**** Running evaluation on {task_name} ****")
+
+    tasks = task_name.split(',')
+    fname = f"{tasks[0]},{tasks[-1]}" if len(tasks) > 1 else task_name
+    results_save_file = Path(results_save_dir, f"{fname}.json")
+    if os.path.isfile(results_save_file):
+        print(f"INFO: the file {results_save_file} already exists, skipping evaluation and using the one that already exists")
+    else:
+        os.makedirs(results_save_dir, exist_ok=True)
+        # requests and docs are journaled here, so a failed evaluation continues where
+        # it stopped when the script is run again (there is no cache, see --no_cache)
+        run_dir = Path(results_save_dir, "runs", fname)
+        run(build_eval_command(task_config, prompt_mode, model_command, results_save_file, run_dir), shell=True, check=True)
+
+    # Send results to wandb, even if it was already there.
+    if log_to_wandb:
+        # retrieve metrics
+        results = json.load(open(Path(results_save_dir, f"{fname}.json")))
+        data = defaultdict(lambda: {})
+        if task_config["metrics"] == ["all"]:
+            for metric_name in results["results"][task_name][prompt_mode]:
+                data[task_name][metric_name] = results["results"][task_name][prompt_mode][metric_name]
+        else:
+            for metric_name in task_config["metrics"]:
+                for task in task_name.split(','):
+                    metric = float(results["results"][task][prompt_mode][metric_name])
+                    data[task][metric_name] = metric
+
+        # specify checkpoint step as a value
+        data["checkpoint_step"] = checkpoint_number
+        wandb.log(data, commit=True)
+
 
 def eval_hf_checkpoint_or_api(args, model_config, model_name_or_path=None, checkpoint_number=-1, results_save_dir=None, wandb_run=None):
     
@@ -37,7 +127,8 @@ def eval_hf_checkpoint_or_api(args, model_config, model_name_or_path=None, check
     tokenizer_for_lm_eval = model_config.get("tokenizer_for_lm_eval", None)
     revision_for_lm_eval = model_config.get("revision_for_lm_eval", None)
     use_adapters = model_config.get("use_adapters", False)
-    device = model_config.get('device', None)
+    # the device of the worker, if given, takes precedence over the one of the config
+    device = args.device or model_config.get('device', None)
     description_path = model_config.get('description_path', None)
     conversation_template = model_config.get('conversation_template', None)
     prompt_as_single_user_message = model_config.get('prompt_as_single_user_message', False)
@@ -50,64 +141,48 @@ def eval_hf_checkpoint_or_api(args, model_config, model_name_or_path=None, check
     else:
         print(f"WARNING: Invalid dtype {dtype_in_config}, no dtype will be specified for lm-eval")
 
+    model_command = (
+        f"--model {model} "
+        f"--model_args {model_args}"
+        f"{dtype_for_eval}"
+        f"{',tokenizer=' + tokenizer_for_lm_eval if tokenizer_for_lm_eval else ''}"
+        f"{',adapter=' + hf_checkpoint_save_path if use_adapters else ''}"
+        f"{',revision=' + revision_for_lm_eval if revision_for_lm_eval else ''} "
+        f"{f'--device {device}' if device else ''} "
+        f"--description_dict_path {description_path} "
+        f"{f'--conversation_template {conversation_template}' if conversation_template else ''} "
+        f"{'--prompt_as_single_user_message' if prompt_as_single_user_message else ''} "
+        f"{f'--batch_size {batch_size}' if batch_size else ''} "
+    )
+    log_to_wandb = model_config.get("log_to_wandb", False)
+
     task_configs = json.load(open(args.task_configs))
-    for task_config in task_configs["tasks"]:
-        task_name = task_config['lm_eval_task']
-        limit = task_config.get("limit", None)
-        response_format = task_config.get("response_format", None)
-        num_fewshot = task_config["num_fewshot"]
-        prompt_mode = task_configs["prompt_mode"]
-
-        print(f"**** Running evaluation on {task_name} ****")
-
-        tasks = task_name.split(',')
-        fname = f"{tasks[0]},{tasks[-1]}" if len(tasks) > 1 else task_name
-        results_save_file = Path(results_save_dir, f"{fname}.json")
-        if os.path.isfile(results_save_file):
-            print(f"INFO: the file {results_save_file} already exists, skipping evaluation and using the one that already exists")
-        else:
-            os.makedirs(results_save_dir, exist_ok=True)
-
-            eval_command = (
-                f"python3 main.py "
-                f"--model {model} "
-                f"--model_args {model_args}"
-                f"{dtype_for_eval}"
-                f"{',tokenizer=' + tokenizer_for_lm_eval if tokenizer_for_lm_eval else ''}"
-                f"{',adapter=' + hf_checkpoint_save_path if use_adapters else ''}"
-                f"{',revision=' + revision_for_lm_eval if revision_for_lm_eval else ''} "
-                f"{f'--device {device}' if device else ''} "
-                f"--task {task_name} "
-                f"--num_fewshot {num_fewshot} "
-                f"--prompt_mode {prompt_mode} "
-                f"{f'--limit {limit}' if limit else ''} "
-                f"--description_dict_path {description_path} "
-                f"{f'--conversation_template {conversation_template}' if conversation_template else ''} "
-                f"{'--prompt_as_single_user_message' if prompt_as_single_user_message else ''} "
-                f"{f'--batch_size {batch_size}' if batch_size else ''} "
-                f"--output_path {results_save_file} "
-                f"{f'--response_format {response_format}' if response_format else ''} "
-                f"--no_cache "
-            )
-            run(eval_command, shell=True, check=True)
-
-        # Send results to wandb, even if it was already there.
-        if model_config.get("log_to_wandb", False):
-            # retrieve metrics
-            results = json.load(open(Path(results_save_dir, f"{fname}.json")))
-            data = defaultdict(lambda: {})
-            if task_config["metrics"] == ["all"]:
-                for metric_name in results["results"][task_name][prompt_mode]:
-                    data[task_name][metric_name] = results["results"][task_name][prompt_mode][metric_name]
-            else:
-                for metric_name in task_config["metrics"]:
-                    for task in task_name.split(','):
-                        metric = float(results["results"][task][prompt_mode][metric_name])
-                        data[task][metric_name] = metric
-
-            # specify checkpoint step as a value
-            data["checkpoint_step"] = checkpoint_number
-            wandb.log(data, commit=True)
+    prompt_mode = task_configs["prompt_mode"]
+    if args.queue:
+        # every task config is a job, claimed by whichever worker is free. The first
+        # worker adds the jobs, the others find them already there
+        queue = JobQueue(args.queue, lease_seconds=args.lease_seconds)
+        for task_config in task_configs["tasks"]:
+            queue.add(f"{results_save_dir}:{task_config['lm_eval_task']}:{prompt_mode}", task_config)
+
+        worker_id = args.worker_id or default_worker_id()
+        # returns once every job is finished, including the ones reclaimed from
+        # workers that died
+        queue.work(
+            worker_id,
+            lambda job_id, task_config: evaluate_task(
+                task_config, prompt_mode, model_command, results_save_dir, checkpoint_number, log_to_wandb
+            ),
+        )
+        if not queue.claim_finalization(worker_id):
+            print("INFO: all the jobs are finished, another worker computes the NPM")
+            return
+        failed = [job for job in queue.jobs() if job[1] == FAILED]
+        if failed:
+            raise RuntimeError(f"Jobs failed: {failed}")
+    else:
+        for task_config in task_configs["tasks"]:
+            evaluate_task(task_config, prompt_mode, model_command, results_save_dir, checkpoint_number, log_to_wandb)
 
     # Compute NPM
     wandb_run_name = ""
@@ -165,6 +240,20 @@ if __name__ == "__main__":
         help="Name of the model (e.g. sabia-3-2024-09-09) when using API calls.",
     )
     
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="Path of a job queue (SQLite file) shared by several workers. See lm_eval/jobqueue.py",
+    )
+    parser.add_argument("--worker_id", default=None, help="Name of the worker in the queue. Defaults to host:pid")
+    parser.add_argument(
+        "--lease_seconds",
+        type=float,
+        default=600,
+        help="Time after which the job of a worker that stopped responding is given to another worker",
+    )
+    parser.add_argument("--device", default=None, help="Device of this worker, overrides the one of the model config")
+
     args = parser.parse_args()
 
     model_config = json.load(open(args.model_config))
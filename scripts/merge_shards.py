@@ -0,0 +1,47 @@
+"""Script to merge the partial results of a sharded evaluation (main.py --shard i/N)
+into the results of the whole run. Aggregate metrics and their stderr are recomputed
+from the per-doc items, so the output is the same as a single-process run.
+
+Example usage:
+
+python scripts/merge_shards.py \
+    --partials results/enem.json.shard0.pkl results/enem.json.shard1.pkl \
+    --output_path results/enem.json
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lm_eval import evaluator, tasks
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--partials", nargs="+", required=True, help="Partial results of every shard (see main.py --partial_output).")
+parser.add_argument("--output_path", default=None, help="Where to save the merged results.")
+parser.add_argument("--bootstrap_iters", type=int, default=100000)
+
+args = parser.parse_args()
+
+partials = []
+for path in args.partials:
+    with open(path, "rb") as f:
+        partials.append(pickle.load(f))
+
+task_names = sorted({task_name for partial in partials for task_name, _, _ in partial["items"]})
+task_dict = tasks.get_task_dict(task_names, strict=True)
+
+results = evaluator.merge_partial_results(partials, task_dict, bootstrap_iters=args.bootstrap_iters)
+results["config"] = {"num_shards": len(partials), "bootstrap_iters": args.bootstrap_iters}
+
+dumped = json.dumps(results, indent=2)
+print(dumped)
+
+if args.output_path:
+    with open(args.output_path, "w") as f:
+        f.write(dumped)
+
+print(evaluator.make_table(results))
@@ -0,0 +1,75 @@
+"""Script to download every file the selected tasks need into the local mirror (see
+lm_eval/mirror.py), so they can be evaluated on nodes without network access.
+
+Tasks are instantiated concurrently in an empty working directory, so that none of
+their files is found locally and every download goes through the mirror. Datasets
+from the Hugging Face hub are downloaded to the Hugging Face cache as usual: copy the
+mirror and the cache to the evaluation nodes and run them with LM_EVAL_OFFLINE=1.
+
+Example usage:
+
+python scripts/prefetch.py --tasks enem,mkqa,faquad --workers 8
+LM_EVAL_OFFLINE=1 python main.py --tasks enem,mkqa,faquad ...
+
+python scripts/prefetch.py --verify
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+# the docs must be built from the downloaded files, not loaded from the docs cache
+os.environ["LM_EVAL_DOCS_CACHE"] = "0"
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+from lm_eval import mirror, tasks
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tasks", type=str, default=None, help="Comma separated task names, all the tasks by default.")
+parser.add_argument("--workers", type=int, default=8, help="Number of tasks downloaded at the same time.")
+parser.add_argument("--verify", action="store_true", help="Only check the checksums of the mirrored files.")
+
+args = parser.parse_args()
+
+if args.verify:
+    bad = mirror.MIRROR.verify()
+    num_files = len(mirror.MIRROR.load_manifest())
+    for url in bad:
+        print(f"WARNING: the mirrored file of {url} is missing or corrupted")
+    print(f"{num_files - len(bad)}/{num_files} files OK in {mirror.MIRROR.mirror_dir}")
+    sys.exit(1 if bad else 0)
+
+task_names = tasks.ALL_TASKS if args.tasks is None else args.tasks.split(",")
+
+# prefetching always downloads, even if LM_EVAL_OFFLINE is set
+mirror.MIRROR.offline = False
+
+with tempfile.TemporaryDirectory(prefix="lm_eval_prefetch_") as workdir:
+    # data shipped with the repository is not downloaded by its task
+    try:
+        shipped = subprocess.run(
+            ["git", "ls-files", "data"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.split()
+    except (OSError, subprocess.CalledProcessError):
+        shipped = []
+    for path in shipped:
+        os.makedirs(os.path.join(workdir, os.path.dirname(path)), exist_ok=True)
+        os.symlink(os.path.abspath(os.path.join(REPO_DIR, path)), os.path.join(workdir, path))
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        tasks.get_task_dict(task_names, num_workers=args.workers, strict=True)
+        failed = False
+    except tasks.TaskLoadError as e:
+        print(f"WARNING: {e}")
+        failed = True
+    finally:
+        os.chdir(cwd)
+
+print(f"{len(mirror.MIRROR.load_manifest())} files in the mirror {mirror.MIRROR.mirror_dir}")
+sys.exit(1 if failed else 0)
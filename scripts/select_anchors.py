@@ -0,0 +1,67 @@
+"""Script to select the anchor docs of each task from the per-doc results of past
+runs, for `main.py --quick`.
+
+Each run folder is the output folder of an evaluation (main.py --output_path), where
+the samples of every task are logged as `{task}_{prompt_mode}_samples.jsonl`. The
+more models the runs cover, the better the anchors; at least 3 are needed to report
+the error of the estimates.
+
+Example usage:
+
+python scripts/select_anchors.py \
+    --runs results/model_a results/model_b results/model_c results/model_d \
+    --task_configs configs/poeta_v2_full.json \
+    --num_anchors 30 \
+    --output anchors.json
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lm_eval import anchors, tasks
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs", nargs="+", required=True, help="Output folders of past evaluations, one per model.")
+parser.add_argument("--task_configs", type=str, required=True, help="Task configs with the preferred metric of each task.")
+parser.add_argument("--num_anchors", type=int, default=30, help="Number of anchor docs per task.")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output", type=str, required=True)
+
+args = parser.parse_args()
+
+task_configs = json.load(open(args.task_configs))
+prompt_mode = task_configs["prompt_mode"]
+
+anchor_spec = {"prompt_mode": prompt_mode, "num_anchors": args.num_anchors, "tasks": {}}
+for task_config in task_configs["tasks"]:
+    for task_name in task_config["lm_eval_task"].split(","):
+        doc_metrics_per_model = [
+            doc_metrics for doc_metrics in (
+                anchors.load_sample_metrics(run_dir, task_name, prompt_mode) for run_dir in args.runs
+            )
+            if doc_metrics
+        ]
+        if not doc_metrics_per_model:
+            print(f"WARNING: no samples of {task_name} in the runs, skipping it")
+            continue
+
+        metric = task_config["preferred_metric"]
+        aggregation = tasks.get_task(task_name)().aggregation()[metric]
+        task_anchors = anchors.build_task_anchors(
+            doc_metrics_per_model, metric, aggregation, args.num_anchors, seed=args.seed
+        )
+        anchor_spec["tasks"][task_name] = task_anchors
+
+        rmse = task_anchors["rmse"]
+        print(
+            f"{task_name}: {len(task_anchors['anchors'])} anchors out of {task_anchors['num_docs']} docs, "
+            f"{task_anchors['num_models']} models, "
+            + (f"leave-one-model-out RMSE {rmse:.4f} (max {task_anchors['max_abs_error']:.4f})" if rmse is not None else "not validated")
+        )
+
+with open(args.output, "w") as f:
+    json.dump(anchor_spec, f, indent=2)
@@ -0,0 +1,58 @@
+"""Script to compare the few-shot searches of lm_eval/bm25.py with pyserini's, which
+the `dynamic-similar` prompts used before. It needs pyserini and a Java runtime:
+
+pip install pyserini
+
+For each task, the collection of `collection_to_index` is indexed with pyserini as
+it used to be (bm25.PyseriniIndex), and the queries of the evaluated docs are
+searched with both indexes. Tasks can also be evaluated with pyserini's searches by
+setting LM_EVAL_BM25=pyserini.
+
+Example usage:
+
+python scripts/validate_bm25.py --tasks enem,bluex,poscomp,mkqa --k 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lm_eval import bm25, tasks
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tasks", type=str, required=True, help="Comma separated task names.")
+parser.add_argument("--k", type=int, default=None, help="Number of hits compared, SEARCHER_K of each task by default.")
+parser.add_argument("--limit", type=int, default=None, help="Compare only the first queries of each task.")
+
+args = parser.parse_args()
+
+for task_name, task in tasks.get_task_dict(args.tasks.split(",")).items():
+    collection = task.collection_to_index()
+    k = args.k or task.SEARCHER_K
+
+    if task.has_test_docs():
+        eval_docs = list(task.test_docs())
+    else:
+        eval_docs = list(task.validation_docs())
+    queries = [task.fewshot_query(doc) for doc in eval_docs[:args.limit]]
+
+    texts = [hit["contents"] for hit in collection]
+    with tempfile.TemporaryDirectory(prefix="validate_bm25_") as tmp_dir:
+        reference = bm25.PyseriniIndex.build(texts, os.path.join(tmp_dir, "index"), language="pt")
+        expected = reference.search(queries, k)
+
+    index = bm25.BM25Index.build(texts, language="pt")
+    actual = [list(hits) for hits in index.search(queries, k)]
+
+    top1 = np.mean([a[:1] == e[:1] for a, e in zip(actual, expected)])
+    overlap = np.mean([len(set(a) & set(e)) / max(1, len(e)) for a, e in zip(actual, expected)])
+    identical = np.mean([a == e for a, e in zip(actual, expected)])
+    print(
+        f"{task_name}: {len(queries)} queries, top-1 agreement {top1:.2%}, "
+        f"overlap@{k} {overlap:.2%}, identical rankings {identical:.2%}"
+    )
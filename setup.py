@@ -46,6 +46,7 @@ setuptools.setup(
         "accelerate>=0.17.1",
         "bitsandbytes>=0.37.2",
         "seqeval>=1.2.2",
+        "scipy>=1.6.0",
         "pyserini>=0.20.0",
         "natsort>=8.3.1",
         "peft==0.2.0",
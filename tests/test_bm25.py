@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+import pytest
+
+from lm_eval import bm25
+
+
+@pytest.mark.parametrize("token, stem", [
+    ("papéis", "papel"),
+    ("bens", "bem"),
+    # "ões" -> "ão", then the final vowel is removed and the accents are folded, as
+    # in Lucene's PortugueseLightStemmer
+    ("limões", "lima"),
+    ("nações", "naca"),
+    ("animais", "animal"),
+    ("anzóis", "anzol"),
+    ("lápis", "lapil"),
+    ("felizmente", "feliz"),
+    ("gatos", "gato"),
+    ("meninas", "menin"),
+    ("cachorros", "cachorr"),
+    ("portuguesa", "portugues"),
+    # shorter than 4 characters
+    ("pés", "pés"),
+])
+def test_portuguese_light_stem(token, stem):
+    assert bm25.portuguese_light_stem(token) == stem
+
+
+@pytest.mark.parametrize("text, terms", [
+    # stopwords are removed, the other words are lowercased and stemmed
+    ("Os Gatos e a Cozinha", ["gato", "cozinh"]),
+    # decimal separators and thousands separators are kept inside numbers
+    ("O preço é 3,50 ou 1.000 reais", ["prec", "é", "3,50", "1.000", "real"]),
+    ("1.000,50; 3, 4", ["1.000,50", "3", "4"]),
+    # hyphens split words, apostrophes between letters don't
+    ("guarda-chuva d'água COVID-19", ["guard", "chuv", "d'agu", "covid", "19"]),
+    ("v1.2 e.g. fim.", ["v1.2", "e.g", "fim"]),
+    ("", []),
+])
+def test_analyze(text, terms):
+    assert bm25.analyze(text) == terms
+
+
+def test_quantize_length():
+    # Lucene's SmallFloat.intToByte4: exact up to 23, then 4 significant bits
+    assert [bm25.quantize_length(length) for length in [0, 10, 23, 24, 30, 100, 1000]] == [0, 10, 23, 24, 30, 96, 984]
+
+
+TEXTS = [
+    "O gato comeu o peixe na cozinha",
+    "Os cachorros correram no parque",
+    "A cozinha estava limpa e o gato dormia",
+    "Peixes nadam no rio",
+    "",
+]
+
+
+def reference_scores(texts, query, k1=0.9, b=0.4):
+    """Lucene's BM25 (without the k1 + 1 factor), for documents shorter than 24 terms."""
+    docs = [bm25.analyze(text) for text in texts]
+    doc_count = sum(1 for doc in docs if doc)
+    avgdl = sum(len(doc) for doc in docs) / doc_count
+    scores = []
+    for doc in docs:
+        score = 0
+        for term in bm25.analyze(query):
+            tf = doc.count(term)
+            if tf:
+                df = sum(1 for other in docs if term in other)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                score += idf * tf / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(score)
+    return scores
+
+
+@pytest.mark.parametrize("query, top_k", [
+    # equal scores are ranked by position in the collection
+    ("gato na cozinha", [0, 2]),
+    # the shorter document ranks first
+    ("peixe", [3, 0]),
+    # repeated query terms are weighted by their count
+    ("cozinha cozinha gato", [0, 2]),
+    ("xyz", []),
+])
+def test_search(query, top_k):
+    index = bm25.BM25Index.build(TEXTS)
+    assert index.search([query], 3)[0].tolist() == top_k
+
+    scores = (index.query_matrix([query]) @ index.doc_weights).toarray()[0]
+    np.testing.assert_allclose(scores, reference_scores(TEXTS, query), rtol=1e-5)
+
+
+def test_scores():
+    index = bm25.BM25Index.build(TEXTS)
+    scores = (index.query_matrix(["gato na cozinha", "peixe"]) @ index.doc_weights).toarray()
+    np.testing.assert_allclose(scores, [
+        [0.7104, 0, 0.7104, 0, 0],
+        [0.3552, 0, 0, 0.37496, 0],
+    ], atol=1e-4)
+
+
+def test_load_or_build(tmp_path):
+    index = bm25.load_or_build(TEXTS, str(tmp_path))
+    loaded = bm25.load_or_build(TEXTS, str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    queries = ["gato na cozinha", "peixe", "parque"]
+    assert [hits.tolist() for hits in loaded.search(queries, 3)] == [hits.tolist() for hits in index.search(queries, 3)]
+
+
+def test_same_hits_as_pyserini(tmp_path, monkeypatch):
+    pytest.importorskip("pyserini")
+    monkeypatch.setattr(bm25, "BACKEND", "pyserini")
+    reference = bm25.load_or_build(TEXTS, str(tmp_path))
+    assert isinstance(reference, bm25.PyseriniIndex)
+
+    queries = ["gato na cozinha", "peixe", "cozinha cozinha gato", "parque", "xyz"]
+    index = bm25.BM25Index.build(TEXTS)
+    assert [hits.tolist() for hits in index.search(queries, 3)] == reference.search(queries, 3)
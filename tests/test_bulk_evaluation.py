@@ -0,0 +1,55 @@
+import importlib.util
+import os
+import shlex
+import sys
+
+import main
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location("bulk_evaluation", os.path.join(ROOT, "scripts", "bulk_evaluation.py"))
+bulk_evaluation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bulk_evaluation)
+
+TASK_CONFIG = {"lm_eval_task": "enem_greedy,bluex_greedy", "num_fewshot": 3, "limit": 10, "metrics": ["acc"]}
+
+
+def model_command(device):
+    # as built by eval_hf_checkpoint_or_api
+    return (
+        f"--model gpt --model_args pretrained=org/model,dtype=bf16 --device {device} "
+        f"--description_dict_path descriptions.json   --batch_size 8 "
+    )
+
+
+def parse(command, monkeypatch):
+    argv = shlex.split(command)
+    assert argv[:2] == ["python3", "main.py"]
+    monkeypatch.setattr(sys, "argv", argv[1:])
+    return main.parse_args()
+
+
+def test_eval_command_parses(tmp_path, monkeypatch):
+    run_dir = str(tmp_path / "runs" / "enem_greedy,bluex_greedy")
+    command = bulk_evaluation.build_eval_command(
+        TASK_CONFIG, "dynamic-random", model_command("cuda:0"), str(tmp_path / "results.json"), run_dir,
+    )
+    args = parse(command, monkeypatch)
+    assert args.tasks == "enem_greedy,bluex_greedy"
+    assert args.prompt_modes == "dynamic-random"
+    assert args.num_fewshot == 3
+    assert args.limit == 10
+    assert args.device == "cuda:0"
+    assert args.no_cache
+    assert args.run_dir == run_dir
+
+    # resumed by another worker, on its own device
+    command = bulk_evaluation.build_eval_command(
+        TASK_CONFIG, "dynamic-random", model_command("cuda:3"), str(tmp_path / "results.json"), run_dir,
+    )
+    assert "--resume" in command
+    args = parse(command, monkeypatch)
+    assert args.tasks == "enem_greedy,bluex_greedy"
+    assert args.device == "cuda:3"
+    assert args.run_dir == run_dir
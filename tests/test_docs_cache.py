@@ -0,0 +1,94 @@
+import types
+
+import huggingface_hub
+from huggingface_hub import constants
+
+from lm_eval import docs_cache
+
+
+class HubTask:
+    VERSION = 0
+    DATASET_PATH = "org/dataset"
+    DATASET_NAME = None
+
+    def __init__(self, sources=()):
+        self.sources = list(sources)
+
+    def docs_cache_sources(self):
+        return self.sources
+
+
+class HubTaskConfig(HubTask):
+    DATASET_NAME = "config"
+
+
+def test_key_depends_on_dataset_version_and_config():
+    task = HubTask()
+    key = docs_cache.cache_key(task, version="abc")
+    assert docs_cache.cache_key(task, version="abc") == key
+    assert docs_cache.cache_key(task, version="def") != key
+    assert docs_cache.cache_key(HubTaskConfig(), version="abc") != key
+
+
+def test_key_depends_on_source_contents(tmp_path):
+    path = tmp_path / "task.json"
+    path.write_text('{"examples": []}')
+    task = HubTask(sources=[str(path)])
+    key = docs_cache.cache_key(task)
+    path.write_text('{"examples": [{"input": "x"}]}')
+    assert docs_cache.cache_key(task) != key
+
+
+def test_hub_revision_offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "HF_HUB_OFFLINE", True)
+    monkeypatch.setattr(constants, "HF_HUB_CACHE", str(tmp_path))
+    assert docs_cache.hub_revision("org/dataset") is None
+
+    refs_dir = tmp_path / "datasets--org--dataset" / "refs"
+    refs_dir.mkdir(parents=True)
+    (refs_dir / "main").write_text("0123abcd\n")
+    assert docs_cache.hub_revision("org/dataset") == "0123abcd"
+    assert docs_cache.hub_revision("org/dataset", revision="v2") is None
+
+
+def test_unknown_version_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(docs_cache, "DOCS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(docs_cache, "ENABLED", True)
+
+    class UnknownVersionTask(HubTask):
+        def docs_cache_version(self):
+            return None
+
+        def download(self, data_dir=None, cache_dir=None, download_mode=None):
+            self.dataset = {"test": [{"text": "a"}]}
+
+    task = UnknownVersionTask()
+    docs_cache.download_cached(task)
+    assert task.dataset == {"test": [{"text": "a"}]}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_hub_revision_prefers_local_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "HF_HUB_OFFLINE", False)
+    monkeypatch.setattr(constants, "HF_HUB_CACHE", str(tmp_path))
+    queried = []
+
+    class FakeApi:
+        def dataset_info(self, path, revision):
+            queried.append((path, revision))
+            return types.SimpleNamespace(sha="4567cdef")
+
+    monkeypatch.setattr(huggingface_hub, "HfApi", FakeApi)
+
+    # not downloaded yet, the Hub is asked
+    assert docs_cache.hub_revision("org/dataset") == "4567cdef"
+    assert queried == [("org/dataset", "main")]
+
+    refs_dir = tmp_path / "datasets--org--dataset" / "refs"
+    refs_dir.mkdir(parents=True)
+    (refs_dir / "main").write_text("0123abcd\n")
+    assert docs_cache.hub_revision("org/dataset") == "0123abcd"
+    assert len(queried) == 1
+
+    assert docs_cache.hub_revision("org/dataset", refresh=True) == "4567cdef"
+    assert len(queried) == 2
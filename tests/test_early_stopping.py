@@ -0,0 +1,46 @@
+import lm_eval.metrics
+from lm_eval.early_stopping import EarlyStopper
+from lm_eval.spill import SpillingItemStore
+
+
+class MeanTask:
+    def aggregation(self):
+        return {"acc": lm_eval.metrics.mean}
+
+
+def add_round(store, start, values):
+    for doc_id, value in enumerate(values, start):
+        store.add(("task", "greedy", "acc"), doc_id, value)
+
+
+def test_zero_variance_first_round_does_not_stop():
+    stopper = EarlyStopper({"task": MeanTask()}, 0.05, round_size=100, min_docs=200)
+    store = SpillingItemStore()
+    # a first round answered all right has a stderr of 0
+    add_round(store, 0, [1] * 100)
+    stopper.check("task", "greedy", store)
+    assert not stopper.is_stopped("task", "greedy")
+
+    add_round(store, 100, [1, 0] * 50)
+    stopper.check("task", "greedy", store)
+    assert not stopper.is_stopped("task", "greedy")
+
+    add_round(store, 200, [1] * 800)
+    stopper.check("task", "greedy", store)
+    assert stopper.is_stopped("task", "greedy")
+
+
+def test_target_not_met():
+    stopper = EarlyStopper({"task": MeanTask()}, 0.01, round_size=100, min_docs=0)
+    store = SpillingItemStore()
+    add_round(store, 0, [1, 0] * 500)
+    stopper.check("task", "greedy", store)
+    assert not stopper.is_stopped("task", "greedy")
+
+
+def test_tasks_without_target_are_not_checked():
+    stopper = EarlyStopper({"task": MeanTask()}, {"other": 0.05}, min_docs=0)
+    store = SpillingItemStore()
+    add_round(store, 0, [1] * 1000)
+    stopper.check("task", "greedy", store)
+    assert not stopper.is_stopped("task", "greedy")
@@ -0,0 +1,86 @@
+from lm_eval import evaluator
+from lm_eval.base import PromptSelectionTask, TokenBudget, rf
+from lm_eval.fewshot_manifest import FewShotManifest
+
+
+class WordsTask(PromptSelectionTask):
+    """Task with training examples of 1 to 40 words."""
+
+    VERSION = 0
+    DATASET_PATH = "words"
+
+    def download(self, data_dir=None, cache_dir=None, download_mode=None):
+        pass
+
+    def has_training_docs(self):
+        return True
+
+    def has_validation_docs(self):
+        return False
+
+    def has_test_docs(self):
+        return True
+
+    def training_docs(self):
+        return [{"text": " ".join(["w"] * (1 + (i * 7) % 40)), "label": "x"} for i in range(50)]
+
+    def test_docs(self):
+        return [{"text": f"q{i}", "label": "y"} for i in range(20)]
+
+    def doc_to_text(self, doc):
+        return doc["text"] + "\nResp:"
+
+    def doc_to_target(self, doc):
+        return " " + doc["label"]
+
+    def construct_requests(self, doc, ctx):
+        return rf.loglikelihood(ctx, " a b c")[0]
+
+    def process_results(self, doc, results):
+        return {}
+
+    def aggregation(self):
+        return {}
+
+    def higher_is_better(self):
+        return {}
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def contexts(task, token_budget=None, manifest=None):
+    return {
+        key: reqs[0].args[0]
+        for key, doc, reqs in evaluator.iter_doc_requests(
+            [("words", task)], ["dynamic-random"], num_fewshot=8, fewshot_seed=1,
+            fewshot_manifest=manifest, token_budget=token_budget,
+        )
+    }
+
+
+def test_contexts_fit_the_budget():
+    task = WordsTask()
+    unfitted = contexts(task)
+    assert contexts(task, TokenBudget(count_words, 10 ** 6, 10)) == unfitted
+
+    fitted = contexts(task, TokenBudget(count_words, 60, 10))
+    assert any(count_words(ctx) + 3 > 60 for ctx in unfitted.values())
+    assert all(count_words(ctx) + 3 <= 60 for ctx in fitted.values())
+
+
+def test_manifest_records_the_examples_before_fitting(tmp_path):
+    task = WordsTask()
+    small = TokenBudget(count_words, 60, 10)
+    path = str(tmp_path / "manifest.json")
+
+    # recorded by a model with a small context window
+    manifest = FewShotManifest(path, num_fewshot=8)
+    fitted = contexts(task, small, manifest)
+    manifest.save()
+    assert all(len(example_ids) == 8 for example_ids in FewShotManifest(path, 8).entries.values())
+
+    # a model with a larger window sees all the examples, a small one fits them again
+    assert contexts(task, manifest=FewShotManifest(path, 8)) == contexts(task)
+    assert contexts(task, small, FewShotManifest(path, 8)) == fitted
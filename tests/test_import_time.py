@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported by the tasks and models that use them, not by the CLI or the registry
+HEAVY_MODULES = ["torch", "transformers", "sklearn", "datasets", "sacrebleu"]
+
+IMPORT_BUDGET_SECONDS = 2.0
+
+
+def test_import_is_lazy_and_fast():
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import lm_eval.tasks, main\n"
+        "task_names = lm_eval.tasks.ALL_TASKS\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps([elapsed, [m for m in {HEAVY_MODULES!r} if m in sys.modules], len(task_names)]))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    elapsed, imported, num_tasks = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert imported == []
+    assert num_tasks > 0
+    assert elapsed < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import time
+
+from lm_eval.jobqueue import DONE, FAILED, JobQueue
+
+
+def run_worker(path, worker_id, claimed):
+    queue = JobQueue(path)
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            break
+        claimed.put(job[0])
+        queue.complete(job[0], worker_id)
+    queue.close()
+
+
+def claim_and_die(path, lease_seconds, max_attempts):
+    # claims a job and exits without completing it or renewing its lease
+    queue = JobQueue(path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    queue.claim("dead")
+    os._exit(0)
+
+
+def run_process(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    process.join()
+    return process
+
+
+def test_each_job_is_claimed_once(tmp_path):
+    path = str(tmp_path / "jobs.queue")
+    queue = JobQueue(path)
+    for i in range(50):
+        queue.add(f"job{i}", {"i": i})
+    # adding the same job again (e.g. by another worker) is a no-op
+    assert not queue.add("job0", {"i": 0})
+
+    ctx = multiprocessing.get_context("fork")
+    claimed = ctx.Queue()
+    workers = [ctx.Process(target=run_worker, args=(path, f"worker{i}", claimed)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    claimed_ids = [claimed.get(timeout=60) for _ in range(50)]
+    for worker in workers:
+        worker.join()
+
+    assert sorted(claimed_ids) == sorted(f"job{i}" for i in range(50))
+    assert queue.counts() == {DONE: 50}
+    assert queue.is_finished()
+
+
+def test_killed_worker_job_is_reclaimed(tmp_path):
+    path = str(tmp_path / "jobs.queue")
+    queue = JobQueue(path, lease_seconds=0.5)
+    queue.add("job", {})
+    assert run_process(claim_and_die, path, 0.5, 3).exitcode == 0
+
+    # the lease of the dead worker still holds
+    assert queue.claim("alive") is None
+    time.sleep(0.6)
+    assert queue.claim("alive") == ("job", {})
+    queue.complete("job", "alive")
+    assert queue.jobs() == [("job", DONE, "alive", 2, None)]
+
+
+def test_attempts_are_capped(tmp_path):
+    path = str(tmp_path / "jobs.queue")
+    queue = JobQueue(path, lease_seconds=0.2, max_attempts=2)
+    queue.add("crashes", {})
+    queue.add("raises", {})
+    for _ in range(2):
+        run_process(claim_and_die, path, 0.2, 2)
+        time.sleep(0.3)
+
+    # the first job killed its 2 workers, it is failed instead of being reclaimed
+    assert queue.claim("worker") == ("raises", {})
+    queue.fail("raises", "worker", "error")
+    assert queue.claim("worker") == ("raises", {})
+    queue.fail("raises", "worker", "error")
+    assert queue.claim("worker") is None
+
+    assert [job[:2] + job[3:4] for job in queue.jobs()] == [("crashes", FAILED, 2), ("raises", FAILED, 2)]
+    assert queue.is_finished()
+
+
+def test_worker_waits_for_the_jobs_of_other_workers(tmp_path):
+    path = str(tmp_path / "jobs.queue")
+    queue = JobQueue(path, lease_seconds=0.5)
+    queue.add("job0", {"i": 0})
+    queue.add("job1", {"i": 1})
+    # a worker dies while running job0
+    assert run_process(claim_and_die, path, 0.5, 3).exitcode == 0
+
+    ran = []
+    start = time.time()
+    queue.work("alive", lambda job_id, payload: ran.append(job_id), poll_seconds=0.1)
+
+    # the worker ran job1, then waited for the lease of job0 to expire and reclaimed it
+    assert ran == ["job1", "job0"]
+    assert time.time() - start >= 0.5
+    assert queue.counts() == {DONE: 2}
+
+
+def test_worker_fails_the_jobs_that_raise(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.queue"), max_attempts=1)
+    queue.add("job", {})
+
+    def run_job(job_id, payload):
+        raise ValueError("broken")
+
+    queue.work("worker", run_job)
+    assert queue.jobs() == [("job", FAILED, "worker", 1, "broken")]
+
+
+def work_and_finalize(path, worker_id, finalized):
+    queue = JobQueue(path, lease_seconds=0.5)
+    queue.work(worker_id, lambda job_id, payload: time.sleep(0.05), poll_seconds=0.05)
+    assert queue.is_finished()
+    if queue.claim_finalization(worker_id):
+        finalized.put(worker_id)
+    queue.close()
+
+
+def test_a_single_worker_finalizes(tmp_path):
+    path = str(tmp_path / "jobs.queue")
+    queue = JobQueue(path)
+    for i in range(8):
+        queue.add(f"job{i}", {})
+
+    ctx = multiprocessing.get_context("fork")
+    finalized = ctx.Queue()
+    workers = [ctx.Process(target=work_and_finalize, args=(path, f"worker{i}", finalized)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert finalized.get(timeout=10).startswith("worker")
+    assert finalized.empty()
+    assert queue.counts() == {DONE: 8}
@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+import pytest
+
+from lm_eval.custom_eval.mkqa import mkqa_eval
+
+
+WORDS = ["o", "rio", "amazonas", "brasil", "1500", "pedro", "álvares", "cabral", "são", "paulo"]
+
+
+def random_text(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 3)))
+
+
+def random_example(rnd, example_id):
+    kind = rnd.choice(["text", "text", "binary", "unanswerable"])
+    if kind == "unanswerable":
+        answers = [""]
+    elif kind == "binary":
+        answers = [rnd.choice(["yes", "no"])]
+    else:
+        answers = list({random_text(rnd) for _ in range(rnd.randint(1, 3))})
+    annotation = mkqa_eval.MKQAAnnotation(example_id=example_id, types=[kind], answers=answers)
+
+    prediction_kind = rnd.choice(["copy", "text", "binary", "empty"])
+    binary_answer = rnd.choice(["yes", "no"]) if prediction_kind == "binary" else None
+    if prediction_kind == "copy":
+        text = rnd.choice(answers)
+    elif prediction_kind == "text":
+        text = random_text(rnd)
+    else:
+        text = ""
+    prediction = mkqa_eval.MKQAPrediction(
+        example_id=example_id,
+        prediction=text,
+        binary_answer=binary_answer,
+        # few distinct values, so that many probabilities are tied
+        no_answer_prob=rnd.choice([0.0, 0.2, 0.5, 0.5, 0.9]),
+    )
+    return annotation, prediction
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_single_pass_equals_evaluate(seed):
+    rnd = random.Random(seed)
+    annotations, predictions = {}, {}
+    for i in range(rnd.randint(1, 60)):
+        annotation, prediction = random_example(rnd, str(i))
+        annotations[annotation.example_id] = annotation
+        predictions[prediction.example_id] = prediction
+    # annotations of examples that are not evaluated, as with a limit
+    annotations["unused"] = mkqa_eval.MKQAAnnotation(example_id="unused", types=["text"], answers=["rio"])
+
+    expected = mkqa_eval.evaluate(annotations, predictions, "pt", print_metrics=False)
+    metrics = mkqa_eval.evaluate_single_pass(annotations, predictions, "pt")
+    normalized = mkqa_eval.normalize_annotations(annotations, "pt")
+    assert mkqa_eval.evaluate_single_pass(annotations, predictions, "pt", normalized_answers=normalized) == metrics
+
+    assert metrics.keys() == expected.keys()
+    for name, value in expected.items():
+        # nan when there is no (un)answerable example
+        np.testing.assert_equal(metrics[name], value, err_msg=name)
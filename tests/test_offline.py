@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def offline_flags(code):
+    env = {name: value for name, value in os.environ.items() if not name.endswith("_OFFLINE")}
+    env["LM_EVAL_OFFLINE"] = "1"
+    code += (
+        "import datasets.config\n"
+        "from huggingface_hub import constants\n"
+        "print(json.dumps([datasets.config.HF_HUB_OFFLINE, constants.HF_HUB_OFFLINE]))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", "import json\n" + code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_hub_task_is_offline():
+    # boolq_pt loads its dataset from the Hub, without going through lm_eval.mirror
+    code = "import lm_eval.tasks\nlm_eval.tasks.get_task('boolq_pt')\n"
+    assert offline_flags(code) == [True, True]
+
+
+def test_libraries_imported_first_are_offline():
+    code = "import datasets, huggingface_hub\nimport lm_eval.tasks\n"
+    assert offline_flags(code) == [True, True]
@@ -0,0 +1,136 @@
+import os
+import pickle
+import random
+import subprocess
+import sys
+
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+from lm_eval.prompt_segments import SegmentedPrompt, SegmentEncoder
+
+
+WORDS = (
+    "o gato comeu peixe na cozinha resposta enunciado alternativas positivo negativo "
+    "questão exemplo ### : ; , . ( ) 12 3.5 ção ões água"
+).split()
+
+
+def sentence(rnd, num_words):
+    return " ".join(rnd.choice(WORDS) for _ in range(num_words))
+
+
+def train_tokenizer(pre_tokenizer):
+    rnd = random.Random(0)
+    # texts ending with "\n\n", so that byte-level BPE learns a "\n\n" token
+    corpus = [sentence(rnd, 30) + "\n\n" + sentence(rnd, 10) + "\n\n" for _ in range(1000)]
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizer
+    tokenizer.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=600, special_tokens=["<unk>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    return lambda text: tokenizer.encode(text, add_special_tokens=False).ids
+
+
+TOKENIZERS = {
+    "byte_level_bpe": lambda: train_tokenizer(pre_tokenizers.ByteLevel(add_prefix_space=False)),
+    "sentencepiece_first": lambda: train_tokenizer(pre_tokenizers.Metaspace(prepend_scheme="first")),
+    "sentencepiece_always": lambda: train_tokenizer(pre_tokenizers.Metaspace(prepend_scheme="always")),
+}
+
+
+def fewshot_prompts(num_prompts):
+    rnd = random.Random(1)
+    pool = [
+        {"text": sentence(rnd, rnd.randint(5, 40)), "label": rnd.choice(["positivo", "negativo"])}
+        for _ in range(30)
+    ]
+    prompts = []
+    for _ in range(num_prompts):
+        segments = ["Classifique o sentimento.\n\n"]
+        for doc in rnd.sample(pool, 5):
+            segments.append(f"Texto: {doc['text']}\nResposta: {doc['label']}\n\n")
+        segments.append(f"Texto: {sentence(rnd, rnd.randint(3, 30))}\nResposta:")
+        prompts.append(SegmentedPrompt(segments))
+    return prompts
+
+
+def unverified_encoder(tok_encode):
+    encoder = SegmentEncoder(tok_encode)
+    encoder.enabled = True
+    # the tokens must be right without comparing them with the whole prompts
+    encoder.VERIFY_FIRST = 0
+    encoder.VERIFY_EVERY = 10 ** 9
+    return encoder
+
+
+@pytest.mark.parametrize("name", TOKENIZERS)
+def test_segments_give_the_tokens_of_the_whole_prompt(name):
+    tok_encode = TOKENIZERS[name]()
+    encoder = unverified_encoder(tok_encode)
+    for prompt in fewshot_prompts(200):
+        assert encoder.encode(prompt) == tok_encode(str(prompt))
+    assert encoder.enabled
+    assert encoder.num_whole == 0
+
+
+def test_multi_character_whitespace_merge():
+    tok_encode = TOKENIZERS["byte_level_bpe"]()
+    # "\n\n" is a single token at the end of a text, but two tokens before a word
+    assert len(tok_encode("a.\n\n")) < len(tok_encode("a.\n\nb")) - 1
+
+    encoder = unverified_encoder(tok_encode)
+    prompt = SegmentedPrompt(["Classifique o sentimento.\n\n", "Texto: o gato\nResposta:"])
+    assert encoder.encode(prompt) == tok_encode(str(prompt))
+
+
+def test_merged_boundaries_are_tokenized_whole():
+    # a tokenizer whose tokens are pairs of characters
+    def tok_encode(text):
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    encoder = unverified_encoder(tok_encode)
+    prompt = SegmentedPrompt(["abc", "def"])
+    assert encoder.encode(prompt) == ["ab", "cd", "ef"]
+    assert encoder.num_whole == 1
+
+
+def test_unsplittable_prompts_disable_the_encoder():
+    tok_encode = TOKENIZERS["byte_level_bpe"]()
+    # e.g. a tokenizer that adds an EOS token to every text
+    encoder = SegmentEncoder(lambda text: tok_encode(text) + [-1])
+    encoder.enabled = True
+    for prompt in fewshot_prompts(SegmentEncoder.VERIFY_FIRST):
+        assert encoder.encode(prompt) == tok_encode(str(prompt)) + [-1]
+    assert encoder.num_whole == SegmentEncoder.VERIFY_FIRST
+    assert not encoder.enabled
+
+
+def test_verification_disables_the_encoder():
+    # a tokenizer whose tokens depend on the length of the whole text, which the
+    # boundaries can't show
+    def tok_encode(text):
+        return list(text) if len(text) < 10 else list(text.upper())
+
+    encoder = SegmentEncoder(tok_encode)
+    encoder.enabled = True
+    encoder.WINDOW = 2
+    prompt = SegmentedPrompt(["abc", "defgh", "ijk"])
+    assert encoder.encode(prompt) == list("ABCDEFGHIJK")
+    assert not encoder.enabled
+
+
+def test_segmented_prompt_is_a_string():
+    prompt = SegmentedPrompt(["a", "", "b"])
+    assert prompt == "ab"
+    assert prompt.segments == ("a", "b")
+    assert pickle.loads(pickle.dumps(prompt)).segments == ("a", "b")
+    assert not hasattr(prompt + "c", "segments")
+
+
+def test_disabled_by_default():
+    env = {name: value for name, value in os.environ.items() if name != "LM_EVAL_PROMPT_SEGMENTS"}
+    code = "import lm_eval.prompt_segments as p; print(p.ENABLED, p.SegmentEncoder(len).enabled)"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.split() == ["False", "False"]
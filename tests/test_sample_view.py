@@ -0,0 +1,43 @@
+import copy
+import random
+
+import pytest
+
+from lm_eval import utils
+
+
+def old_sample(rnd, docs, k, indices=None, exclude=None, limit=None):
+    # the copy + remove + slice the few-shot samplers used to do for every doc
+    pool = copy.copy(docs) if indices is None else [docs[i] for i in indices]
+    if exclude is not None:
+        pool.remove(pool[exclude])
+    if limit is not None:
+        pool = pool[:limit]
+    return rnd.sample(pool, k)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("limit", [None, 3, 8, 100])
+@pytest.mark.parametrize("use_indices", [False, True])
+def test_sample_view_equals_copy(seed, limit, use_indices):
+    docs = [{"id": i, "text": f"doc {i % 7}"} for i in range(40)]
+    indices = list(range(3, 40, 2)) if use_indices else None
+    size = len(indices) if use_indices else len(docs)
+    for exclude in [None, 0, 1, size // 2, size - 1]:
+        view = utils.SampleView(docs, indices, exclude, limit)
+        pool_size = size - (exclude is not None)
+        if limit is not None:
+            pool_size = min(pool_size, limit)
+        assert len(view) == pool_size
+        for k in sorted({0, 1, min(3, pool_size), pool_size}):
+            assert (
+                random.Random(seed).sample(view, k)
+                == old_sample(random.Random(seed), docs, k, indices, exclude, limit)
+            )
+
+
+def test_sample_view_is_a_sequence():
+    view = utils.SampleView(list("abcdef"), indices=[5, 1, 3, 0], exclude=1, limit=2)
+    assert list(view) == ["f", "d"]
+    with pytest.raises(IndexError):
+        view[2]
@@ -0,0 +1,103 @@
+import hashlib
+import pickle
+
+import pytest
+
+from lm_eval import evaluator
+from lm_eval.base import LM, PromptSelectionTask, rf
+from lm_eval.metrics import f1_score, mean
+
+
+class LabelTask(PromptSelectionTask):
+    VERSION = 0
+    DATASET_PATH = "labels"
+
+    def download(self, data_dir=None, cache_dir=None, download_mode=None):
+        pass
+
+    def has_training_docs(self):
+        return True
+
+    def has_validation_docs(self):
+        return False
+
+    def has_test_docs(self):
+        return True
+
+    def training_docs(self):
+        return [{"text": f"train {i}", "label": i % 2} for i in range(20)]
+
+    def test_docs(self):
+        return [{"text": f"test {i}", "label": (i * 7) % 3 % 2} for i in range(37)]
+
+    def doc_to_text(self, doc):
+        return doc["text"] + "\nResposta:"
+
+    def doc_to_target(self, doc):
+        return [" não", " sim"][doc["label"]]
+
+    def construct_requests(self, doc, ctx):
+        return [rf.loglikelihood(ctx, " não")[0], rf.loglikelihood(ctx, " sim")[0]]
+
+    def process_results(self, doc, results):
+        pred = max(range(2), key=lambda i: results[i])
+        return {"acc": pred == doc["label"], "f1": (doc["label"], pred)}
+
+    def aggregation(self):
+        return {"acc": mean, "f1": f1_score}
+
+    def higher_is_better(self):
+        return {"acc": True, "f1": True}
+
+
+class HashLM(LM):
+    """Deterministic pseudo-random log-likelihoods."""
+
+    def loglikelihood(self, requests):
+        return [
+            (-int(hashlib.sha256((context + continuation).encode()).hexdigest()[:8], 16) / 2 ** 32, False)
+            for context, continuation in requests
+        ]
+
+    def loglikelihood_rolling(self, requests):
+        raise NotImplementedError()
+
+    def greedy_until(self, requests):
+        raise NotImplementedError()
+
+
+def run(**kwargs):
+    return evaluator.evaluate(
+        lm=HashLM(), task_dict={"labels": LabelTask()}, num_fewshot=2, fewshot_seed=1,
+        prompt_modes=["dynamic-random"], bootstrap_iters=200, **kwargs,
+    )
+
+
+def run_shards(tmp_path, num_shards):
+    partials = []
+    for shard_index in range(num_shards):
+        path = str(tmp_path / f"shard{shard_index}.pkl")
+        run(shard=(shard_index, num_shards), partial_output=path)
+        with open(path, "rb") as f:
+            partials.append(pickle.load(f))
+    return partials
+
+
+def test_merged_shards_equal_a_single_run(tmp_path):
+    expected = run()
+    partials = run_shards(tmp_path, 3)
+    merged = evaluator.merge_partial_results(partials, {"labels": LabelTask()}, bootstrap_iters=200)
+
+    assert merged == expected
+    assert set(merged["results"]["labels"]["dynamic-random"]) == {"acc", "acc_stderr", "f1", "f1_stderr", "num_examples"}
+    assert merged["results"]["labels"]["dynamic-random"]["num_examples"] == 37
+
+
+def test_missing_or_duplicate_shard_raises(tmp_path):
+    partials = run_shards(tmp_path, 3)
+    with pytest.raises(ValueError):
+        evaluator.merge_partial_results(partials[:2], {"labels": LabelTask()}, bootstrap_iters=200)
+    with pytest.raises(ValueError):
+        evaluator.merge_partial_results(partials + partials[:1], {"labels": LabelTask()}, bootstrap_iters=200)
+    with pytest.raises(ValueError):
+        evaluator.merge_partial_results([partials[0], partials[1], partials[1]], {"labels": LabelTask()}, bootstrap_iters=200)
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import lm_eval.pipeline
+import lm_eval.tasks
+
+
+def make_loaders(monkeypatch, names, failing):
+    def make_loader(name):
+        def load_task():
+            # the first tasks finish loading last
+            time.sleep(0.01 * (len(names) - names.index(name)))
+            if name in failing:
+                raise RuntimeError(f"unable to download {name}")
+            return f"task {name}"
+        return load_task
+
+    monkeypatch.setattr(lm_eval.tasks, "get_task_loaders", lambda task_name_list: {
+        name: make_loader(name) for name in task_name_list
+    })
+
+
+def test_failed_task_is_isolated(monkeypatch):
+    names = ["a", "b", "c", "d"]
+    make_loaders(monkeypatch, names, failing={"b"})
+    errors = {}
+    task_dict = lm_eval.tasks.get_task_dict(names, num_workers=4, errors=errors)
+    assert list(task_dict.items()) == [("a", "task a"), ("c", "task c"), ("d", "task d")]
+    assert list(errors) == ["b"]
+    assert isinstance(errors["b"], RuntimeError)
+
+
+def test_strict_raises_after_loading_all(monkeypatch):
+    names = ["a", "b", "c"]
+    make_loaders(monkeypatch, names, failing={"a", "c"})
+    errors = {}
+    with pytest.raises(lm_eval.tasks.TaskLoadError, match="a, c"):
+        lm_eval.tasks.get_task_dict(names, num_workers=2, strict=True, errors=errors)
+    assert list(errors) == ["a", "c"]
+
+
+def test_no_task_loaded_raises(monkeypatch):
+    make_loaders(monkeypatch, ["a"], failing={"a"})
+    with pytest.raises(lm_eval.tasks.TaskLoadError):
+        lm_eval.tasks.get_task_dict(["a"])
+
+
+def test_prefetcher_skips_failed_task(monkeypatch):
+    names = ["a", "b", "c", "d"]
+    make_loaders(monkeypatch, names, failing={"b"})
+    errors = {}
+    task_dict = lm_eval.pipeline.TaskPrefetcher(
+        lm_eval.tasks.get_task_loaders(names), ahead=1, num_workers=2, errors=errors
+    )
+    try:
+        assert task_dict.names == names
+        assert list(task_dict.items()) == [("a", "task a"), ("c", "task c"), ("d", "task d")]
+        assert list(errors) == ["b"]
+        assert isinstance(errors["b"], RuntimeError)
+        assert "b" not in task_dict
+        assert len(task_dict) == 3
+    finally:
+        task_dict.close()
+
+
+def test_prefetcher_loads_tasks_concurrently(monkeypatch):
+    started = []
+
+    def make_loader(name):
+        def load_task():
+            started.append(name)
+            # waits for the other task to start loading
+            deadline = time.time() + 5
+            while len(started) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            return len(started)
+        return load_task
+
+    task_dict = lm_eval.pipeline.TaskPrefetcher({name: make_loader(name) for name in ["a", "b"]}, num_workers=2)
+    try:
+        assert dict(task_dict) == {"a": 2, "b": 2}
+    finally:
+        task_dict.close()